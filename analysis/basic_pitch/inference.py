@@ -1,14 +1,18 @@
 # %%
 
 
+import functools
 import json
+import warnings
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, cast
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, cast
 import pretty_midi
 import onnxruntime as ort
 import numpy as np
 import numpy.typing as npt
 import librosa
+import soundfile as sf
+import soxr
 
 from .constants import (
     AUDIO_SAMPLE_RATE,
@@ -20,35 +24,190 @@ from . import note_creation as infer
 # %%
 
 ICASSP_2022_MODEL_PATH = Path(__file__).parent.parent.parent / "res/nmp.onnx"
+ORT_CACHE_DIR_NAME = ".ort_cache"  # engine caches, created next to the model
+
+INPUT_NAME = "serving_default_input_2:0"
+INPUT_BATCH_DIM = "unk__749"  # symbolic batch dimension of INPUT_NAME in nmp.onnx
+OUTPUT_NAMES = {
+    "note": "StatefulPartitionedCall:1",
+    "onset": "StatefulPartitionedCall:2",
+    "contour": "StatefulPartitionedCall:0",
+}
+
+# audio to transcribe: a file path, or already decoded (samples[, channels]) float samples with their rate
+AudioSource = Union[Path, str, Tuple[npt.NDArray[np.float32], int]]
 
 # %%
 
 
+# accelerator EPs that run on each torch-style device name; "cpu" uses none
+DEVICE_PROVIDERS = {
+    "cuda": ("TensorrtExecutionProvider", "CUDAExecutionProvider"),
+    "mps": ("CoreMLExecutionProvider",),
+    "cpu": (),
+}
+
+
+def _execution_providers(cache_dir: Path, device: Optional[str] = None) -> List[Union[str, Tuple[str, Dict[str, Any]]]]:
+  """Ordered ORT execution providers, best first, limited to what this build supports.
+
+  device: only use the accelerators for this device ("cuda", "mps" or "cpu"; see
+  DEVICE_PROVIDERS), falling back to the CPU with a warning if this onnxruntime build has
+  none of them (CUDA needs the onnxruntime-gpu package). None picks the best available.
+  """
+  preferred: List[Tuple[str, Dict[str, Any]]] = [
+      ("TensorrtExecutionProvider", {
+          "trt_fp16_enable": True,
+          "trt_engine_cache_enable": True,
+          "trt_engine_cache_path": str(cache_dir / "nmp_trt"),
+      }),
+      ("CUDAExecutionProvider", {"cudnn_conv_algo_search": "HEURISTIC"}),
+      ("CoreMLExecutionProvider", {}),
+      ("DmlExecutionProvider", {}),
+  ]
+  available = ort.get_available_providers()
+  if device is not None:
+    kind = device.split(":")[0]  # "cuda:0" -> "cuda"
+    if kind not in DEVICE_PROVIDERS:
+      raise ValueError(f"device must be one of {tuple(DEVICE_PROVIDERS)}, got {device!r}")
+    wanted = DEVICE_PROVIDERS[kind]
+    if wanted and not any(p in available for p in wanted):
+      warnings.warn(f"onnxruntime has no {'/'.join(wanted)} in this build (available: {available}); "
+                    f"running Basic Pitch on the CPU instead of {device}")
+    preferred = [p for p in preferred if p[0] in wanted]
+  providers: List[Union[str, Tuple[str, Dict[str, Any]]]] = [p for p in preferred if p[0] in available]
+  if any(p[0] == "TensorrtExecutionProvider" for p in providers):
+    (cache_dir / "nmp_trt").mkdir(parents=True, exist_ok=True)
+  providers.append("CPUExecutionProvider")
+  return providers
+
+
+def model_variant_path(model_path: Union[Path, str], precision: str) -> Path:
+  """Path of a reduced precision copy of the model, e.g. nmp.onnx -> nmp.int8.onnx"""
+  model_path = Path(model_path)
+  return model_path.with_suffix(f".{precision}{model_path.suffix}")
+
+
+def _select_model_file(model_path: Path, provider: str, precision: Optional[str] = None) -> Path:
+  """The `precision` variant written by `quantize.py` if present, else the fp32 model.
+
+  By default fp16 on CUDA/TensorRT and fp32 elsewhere. int8 is opt-in: ORT's dynamic int8
+  convolutions ran ~3x slower than fp32 on a CPU without VNNI and dropped notes.
+  """
+  if precision is None:
+    precision = "fp16" if provider in ("TensorrtExecutionProvider", "CUDAExecutionProvider") else "fp32"
+  if precision == "fp32":
+    return model_path
+  variant = model_variant_path(model_path, precision)
+  return variant if variant.exists() else model_path
+
+
 class Model:
 
-  def __init__(self, model_path: Union[Path, str]):
-    providers = ["CPUExecutionProvider"]
-    if "CUDAExecutionProvider" in ort.get_available_providers():
-      providers.insert(0, "CUDAExecutionProvider")
-    self.model = ort.InferenceSession(str(model_path), providers=providers)
+  def __init__(self, model_path: Union[Path, str], batch_size: Optional[int] = None,
+               intra_op_num_threads: Optional[int] = None, precision: Optional[str] = None,
+               device: Optional[str] = None):
+    """
+    Args:
+        model_path: path to the fp32 onnx model
+        batch_size: pin the batch dimension to this size, so ORT plans for one static shape;
+            smaller batches are zero padded. Defaults to DEFAULT_INFERENCE_BATCH_SIZE on
+            TensorRT (every new input shape there builds another engine), dynamic otherwise.
+        intra_op_num_threads: cap ORT's CPU thread pool, e.g. when other CPU-heavy work runs
+            alongside. Defaults to ORT's choice (one thread per physical core).
+        precision: "fp32", "fp16" or "int8" to load that variant from `quantize.py` (fp32 if it
+            doesn't exist). Defaults to fp16 on CUDA/TensorRT, fp32 elsewhere.
+        device: "cuda", "mps" or "cpu" to run there (see `_execution_providers`); None picks
+            the best accelerator this onnxruntime build has.
+    """
+    model_path = Path(model_path)
+    cache_dir = model_path.parent / ORT_CACHE_DIR_NAME
+    providers = _execution_providers(cache_dir, device)
+    top_provider = providers[0] if isinstance(providers[0], str) else providers[0][0]
+    if batch_size is None and top_provider == "TensorrtExecutionProvider":
+      batch_size = DEFAULT_INFERENCE_BATCH_SIZE
+    self.batch_size = batch_size
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_num_threads is not None:
+      sess_options.intra_op_num_threads = intra_op_num_threads
+    if batch_size is not None:
+      sess_options.add_free_dimension_override_by_name(INPUT_BATCH_DIM, batch_size)
+    self.model_path = _select_model_file(model_path, top_provider, precision)
+    self.model = ort.InferenceSession(str(self.model_path), sess_options=sess_options, providers=providers)
+    self.device = "cuda" if top_provider in ("TensorrtExecutionProvider", "CUDAExecutionProvider") else "cpu"
+    self.binding = self.model.io_binding()
+    self._device_inputs: Dict[int, ort.OrtValue] = {}
+    # zero-padded staging batch for short tail batches when the batch dimension is pinned
+    self._padded = None if batch_size is None else np.zeros((batch_size, AUDIO_N_SAMPLES, 1), dtype=np.float32)
+    # output shapes without the batch dimension, e.g. note: (172, 88)
+    session_outputs = {o.name: o.shape for o in self.model.get_outputs()}
+    self.output_shapes = {k: tuple(session_outputs[name][1:]) for k, name in OUTPUT_NAMES.items()}
+    if self.model.get_providers()[0] != "CPUExecutionProvider":
+      # accelerator EPs build kernels/engines lazily; pay that once here instead of on the first window
+      self.predict(np.zeros((self.batch_size or 1, AUDIO_N_SAMPLES, 1), dtype=np.float32))
     return
 
-  def predict(self, x: npt.NDArray[np.float32]) -> Dict[str, npt.NDArray[np.float32]]:
-
-    return {
-        k: v
-        for k, v in zip(
-            ["note", "onset", "contour"],
-            self.model.run(
-                [
-                    "StatefulPartitionedCall:1",
-                    "StatefulPartitionedCall:2",
-                    "StatefulPartitionedCall:0",
-                ],
-                {"serving_default_input_2:0": x},
-            ),
-        )
-    }
+  def predict(
+      self, x: npt.NDArray[np.float32], out: Optional[Dict[str, npt.NDArray[np.float32]]] = None
+  ) -> Dict[str, npt.NDArray[np.float32]]:
+    """Run one batch through the model via IO binding.
+
+    Args:
+        x: audio windows, shape (n_batch, AUDIO_N_SAMPLES, 1)
+        out: optional preallocated, C-contiguous float32 arrays to write note/onset/contour into.
+            Allocated here if not given.
+
+    Returns:
+        dict of note/onset/contour arrays (``out`` itself if it was given)
+    """
+    n_batch = x.shape[0]
+    if self.batch_size is not None and n_batch != self.batch_size:
+      assert n_batch < self.batch_size, f"batch of {n_batch} exceeds the model's fixed batch size {self.batch_size}"
+      padded = self._padded
+      padded[:n_batch] = x
+      padded[n_batch:] = 0
+      result = self.predict(padded)
+      if out is None:
+        return {k: v[:n_batch] for k, v in result.items()}
+      for k in OUTPUT_NAMES:
+        out[k][...] = result[k][:n_batch]
+      return out
+
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    if out is None:
+      out = {k: np.empty((n_batch, *self.output_shapes[k]), dtype=np.float32) for k in OUTPUT_NAMES}
+
+    binding = self.binding
+    binding.clear_binding_inputs()
+    binding.clear_binding_outputs()
+    if self.device == "cpu":
+      # bind the numpy buffer itself: ORT reads x in place, no copy
+      binding.bind_cpu_input(INPUT_NAME, x)
+    else:
+      input_value = self._device_input(n_batch)
+      input_value.update_inplace(x)
+      binding.bind_ortvalue_input(INPUT_NAME, input_value)
+    # results are written straight into `out` (on accelerators: one device-to-host copy, no staging)
+    for k, name in OUTPUT_NAMES.items():
+      v = out[k]
+      binding.bind_output(name, "cpu", 0, np.float32, list(v.shape), v.ctypes.data)
+    self.model.run_with_iobinding(binding)
+    return out
+
+  def _device_input(self, n_batch: int) -> ort.OrtValue:
+    """Device-side input tensor for a batch size, allocated once and reused."""
+    if n_batch not in self._device_inputs:
+      self._device_inputs[n_batch] = ort.OrtValue.ortvalue_from_shape_and_type(
+          (n_batch, AUDIO_N_SAMPLES, 1), np.float32, self.device, 0)
+    return self._device_inputs[n_batch]
+
+
+@functools.lru_cache(maxsize=4)
+def _get_model(model_path: str, device: Optional[str] = None) -> Model:
+  """Process-wide Model per path and device. The first call pays for session creation
+  (and TensorRT engine build/cudnn tuning), later calls reuse it."""
+  return Model(model_path, device=device)
 
 
 DEFAULT_ONSET_THRESHOLD = 0.5
@@ -58,62 +217,156 @@ DEFAULT_MINIMUM_MIDI_TEMPO = 120
 DEFAULT_SONIFICATION_SAMPLERATE = 44100
 DEFAULT_OVERLAPPING_FRAMES = 30
 DEFAULT_MIDI_VELOCITY_SCALE = 127
+DEFAULT_INFERENCE_BATCH_SIZE = 32
+
+# windowing used by run_inference: consecutive windows overlap by DEFAULT_OVERLAPPING_FRAMES
+OVERLAP_LEN = DEFAULT_OVERLAPPING_FRAMES * FFT_HOP
+HOP_SIZE = AUDIO_N_SAMPLES - OVERLAP_LEN
 
 # %%
 
 
 def window_audio_file(
     audio_original: npt.NDArray[np.float32], hop_size: int
-) -> Iterable[Tuple[npt.NDArray[np.float32], Dict[str, float]]]:
+) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float64]]:
   """
   Pad appropriately an audio file, and return as
   windowed signal, with window length = AUDIO_N_SAMPLES
 
   Returns:
-      audio_windowed: tensor with shape (n_windows, AUDIO_N_SAMPLES, 1)
+      audio_windowed: strided view with shape (n_windows, AUDIO_N_SAMPLES, 1)
           audio windowed into fixed length chunks
-      window_times: list of {'start':.., 'end':...} objects (times in seconds)
+      window_starts: array of window start times in seconds
+          (each window ends AUDIO_N_SAMPLES / AUDIO_SAMPLE_RATE later)
 
   """
-  for i in range(0, audio_original.shape[0], hop_size):
-    window = audio_original[i: i + AUDIO_N_SAMPLES]
-    if len(window) < AUDIO_N_SAMPLES:
-      window = np.pad(
-          window,
-          pad_width=[[0, AUDIO_N_SAMPLES - len(window)]],
-      )
-    t_start = float(i) / AUDIO_SAMPLE_RATE
-    window_time = {
-        "start": t_start,
-        "end": t_start + (AUDIO_N_SAMPLES / AUDIO_SAMPLE_RATE),
-    }
-    yield np.expand_dims(window, axis=-1), window_time
+  n_windows = -(-audio_original.shape[0] // hop_size)
+  # pad the tail once so the last window is full length
+  padded_length = (n_windows - 1) * hop_size + AUDIO_N_SAMPLES
+  audio_padded = np.pad(audio_original, (0, padded_length - audio_original.shape[0]))
+  audio_windowed = np.lib.stride_tricks.sliding_window_view(audio_padded, AUDIO_N_SAMPLES)[::hop_size]
+  window_starts = np.arange(n_windows) * hop_size / AUDIO_SAMPLE_RATE
+  return audio_windowed[:, :, np.newaxis], window_starts
+
+
+def load_audio(audio_path: Union[Path, str], sr: int = AUDIO_SAMPLE_RATE) -> npt.NDArray[np.float32]:
+  """Decode an audio file to mono float32 at `sr`.
+
+  Uses soundfile and soxr (HQ, same as librosa's default). Formats libsndfile can't read (m4a, ...)
+  go through librosa.load.
+  """
+  try:
+    audio, file_sr = sf.read(str(audio_path), dtype="float32", always_2d=True)
+  except sf.SoundFileRuntimeError:
+    audio, _ = librosa.load(str(audio_path), sr=sr, mono=True)
+    return audio
+
+  audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+  if file_sr != sr:
+    audio = soxr.resample(audio, file_sr, sr, quality="HQ")
+  return audio
+
+
+def _decode_blocks(f: sf.SoundFile, sr: int, blocksize: int) -> Iterator[npt.NDArray[np.float32]]:
+  """Decode `f` block by block as mono float32 at `sr`; same samples as load_audio."""
+  stream = soxr.ResampleStream(f.samplerate, sr, 1, dtype="float32", quality="HQ") if f.samplerate != sr else None
+  for block in f.blocks(blocksize=blocksize, dtype="float32", always_2d=True):
+    block = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+    yield stream.resample_chunk(block) if stream else block
+  if stream:
+    yield stream.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+def _scatter_to_windows(
+    audio_windowed: npt.NDArray[np.float32], block: npt.NDArray[np.float32], pos: int, hop_size: int
+) -> None:
+  """Copy `block`, starting at sample `pos` of the padded signal, into every window it overlaps.
+  Window i covers samples [i * hop_size, i * hop_size + AUDIO_N_SAMPLES)."""
+  end = pos + len(block)
+  first = max(0, (pos - AUDIO_N_SAMPLES) // hop_size + 1)
+  last = min(audio_windowed.shape[0] - 1, (end - 1) // hop_size)
+  for i in range(first, last + 1):
+    w_start = i * hop_size
+    a = max(pos, w_start)
+    b = min(end, w_start + AUDIO_N_SAMPLES)
+    audio_windowed[i, a - w_start: b - w_start, 0] = block[a - pos: b - pos]
+
+
+def _stream_audio_windows(
+    f: sf.SoundFile, overlap_len: int, hop_size: int
+) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float64], int]:
+  """Decode `f` straight into the (n_windows, AUDIO_N_SAMPLES, 1) batch, without
+  materializing the whole waveform. Same result as window_audio_file on the
+  zero-prefixed output of load_audio."""
+  prefix = overlap_len // 2
+  # resampled length isn't exact until decoding ends; one spare window covers rounding
+  n_samples = -(-f.frames * AUDIO_SAMPLE_RATE // f.samplerate)
+  audio_windowed = np.zeros((-(-(prefix + n_samples) // hop_size) + 1, AUDIO_N_SAMPLES, 1), dtype=np.float32)
+
+  pos = prefix  # position of the next block in the zero-prefixed signal
+  for block in _decode_blocks(f, AUDIO_SAMPLE_RATE, hop_size):
+    _scatter_to_windows(audio_windowed, block, pos, hop_size)
+    pos += len(block)
+
+  n_windows = -(-pos // hop_size)
+  window_starts = np.arange(n_windows) * hop_size / AUDIO_SAMPLE_RATE
+  return audio_windowed[:n_windows], window_starts, pos - prefix
+
+
+def _to_model_rate(audio: npt.NDArray[np.float32], sr: int) -> npt.NDArray[np.float32]:
+  """Mono float32 at AUDIO_SAMPLE_RATE from (samples[, channels]) audio; same samples as load_audio."""
+  audio = np.asarray(audio, dtype=np.float32)
+  if audio.ndim > 1:
+    audio = audio.mean(axis=1)
+  if sr != AUDIO_SAMPLE_RATE:
+    audio = soxr.resample(audio, sr, AUDIO_SAMPLE_RATE, quality="HQ")
+  return audio
+
+
+def _window_decoded_audio(
+    audio_original: npt.NDArray[np.float32], overlap_len: int, hop_size: int
+) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float64], int]:
+  original_length = audio_original.shape[0]
+  # copy into the windows once, the zero prefix and tail padding come from the zeroed batch
+  prefix = overlap_len // 2
+  n_windows = -(-(prefix + original_length) // hop_size)
+  audio_windowed = np.zeros((n_windows, AUDIO_N_SAMPLES, 1), dtype=np.float32)
+  _scatter_to_windows(audio_windowed, audio_original, prefix, hop_size)
+  window_starts = np.arange(n_windows) * hop_size / AUDIO_SAMPLE_RATE
+  return audio_windowed, window_starts, original_length
 
 
 def get_audio_input(
-    audio_path: Union[Path, str], overlap_len: int, hop_size: int
-) -> Iterable[Tuple[npt.NDArray[np.float32], Dict[str, float], int]]:
+    audio_path: AudioSource, overlap_len: int, hop_size: int
+) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float64], int]:
   """
   Read wave file (as mono), pad appropriately, and return as
   windowed signal, with window length = AUDIO_N_SAMPLES
 
+  audio_path may also be an (audio, sr) pair of already decoded samples, which
+  are only mixed down and resampled.
+
   Returns:
       audio_windowed: tensor with shape (n_windows, AUDIO_N_SAMPLES, 1)
           audio windowed into fixed length chunks
-      window_times: list of {'start':.., 'end':...} objects (times in seconds)
+      window_starts: array of window start times in seconds
       audio_original_length: int
           length of original audio file, in frames, BEFORE padding.
 
   """
   assert overlap_len % 2 == 0, f"overlap_length must be even, got {overlap_len}"
 
-  audio_original, _ = librosa.load(str(audio_path), sr=AUDIO_SAMPLE_RATE, mono=True)
+  if isinstance(audio_path, tuple):
+    return _window_decoded_audio(_to_model_rate(*audio_path), overlap_len, hop_size)
 
-  original_length = audio_original.shape[0]
-  audio_original = np.concatenate(
-      [np.zeros((int(overlap_len / 2),), dtype=np.float32), audio_original])
-  for window, window_time in window_audio_file(audio_original, hop_size):
-    yield np.expand_dims(window, axis=0), window_time, original_length
+  try:
+    f = sf.SoundFile(str(audio_path))
+  except sf.SoundFileRuntimeError:
+    # not readable by libsndfile, decode the whole file with librosa instead
+    return _window_decoded_audio(load_audio(audio_path, sr=AUDIO_SAMPLE_RATE), overlap_len, hop_size)
+
+  with f:
+    return _stream_audio_windows(f, overlap_len, hop_size)
 
 
 def unwrap_output(
@@ -147,16 +400,20 @@ def unwrap_output(
 
 
 def run_inference(
-    audio_path: Union[Path, str],
+    audio_path: AudioSource,
     model_or_model_path: Union[Model, Path, str],
     debug_file: Optional[Path] = None,
+    batch_size: int = DEFAULT_INFERENCE_BATCH_SIZE,
+    device: Optional[str] = None,
 ) -> Dict[str, np.array]:
   """Run the model on the input audio path.
 
   Args:
-      audio_path: The audio to run inference on.
+      audio_path: The audio to run inference on, a path or (audio, sr).
       model_or_model_path: A loaded Model or path to a serialized model to load.
       debug_file: An optional path to output debug data to. Useful for testing/verification.
+      batch_size: Number of windows passed to the model per run.
+      device: Where to run a model loaded from a path (see `Model`); ignored for a loaded Model.
 
   Returns:
      A dictionary with the notes, onsets and contours from model inference.
@@ -164,20 +421,17 @@ def run_inference(
   if isinstance(model_or_model_path, Model):
     model = model_or_model_path
   else:
-    model = Model(model_or_model_path)
-
-  # overlap 30 frames
-  n_overlapping_frames = DEFAULT_OVERLAPPING_FRAMES
-  overlap_len = n_overlapping_frames * FFT_HOP
-  hop_size = AUDIO_N_SAMPLES - overlap_len
+    model = _get_model(str(model_or_model_path), device)
 
-  output: Dict[str, Any] = {"note": [], "onset": [], "contour": []}
-  for audio_windowed, _, audio_original_length in get_audio_input(audio_path, overlap_len, hop_size):
-    for k, v in model.predict(audio_windowed).items():
-      output[k].append(v)
+  audio_windowed, _, audio_original_length = get_audio_input(audio_path, OVERLAP_LEN, HOP_SIZE)
+  n_windows = audio_windowed.shape[0]
+  output = {k: np.empty((n_windows, *shape), dtype=np.float32) for k, shape in model.output_shapes.items()}
+  batch_size = model.batch_size or batch_size
+  for i in range(0, n_windows, batch_size):
+    model.predict(audio_windowed[i: i + batch_size], out={k: v[i: i + batch_size] for k, v in output.items()})
 
   unwrapped_output = {
-      k: unwrap_output(np.concatenate(output[k]), audio_original_length, n_overlapping_frames) for k in output
+      k: unwrap_output(output[k], audio_original_length, DEFAULT_OVERLAPPING_FRAMES) for k in output
   }
 
   if debug_file:
@@ -186,8 +440,8 @@ def run_inference(
           {
               "audio_windowed": audio_windowed.tolist(),
               "audio_original_length": audio_original_length,
-              "hop_size_samples": hop_size,
-              "overlap_length_samples": overlap_len,
+              "hop_size_samples": HOP_SIZE,
+              "overlap_length_samples": OVERLAP_LEN,
               "unwrapped_output": {k: v.tolist() for k, v in unwrapped_output.items()},
           },
           f,
@@ -199,7 +453,7 @@ def run_inference(
 
 
 def predict(
-    audio_path: Union[Path, str],
+    audio_path: AudioSource,
     model_or_model_path: Union[Model, Path, str] = ICASSP_2022_MODEL_PATH,
     onset_threshold: float = DEFAULT_ONSET_THRESHOLD,
     frame_threshold: float = DEFAULT_FRAME_THRESHOLD,
@@ -210,6 +464,7 @@ def predict(
     melodia_trick: bool = True,
     debug_file: Optional[Path] = None,
     midi_tempo: float = DEFAULT_MINIMUM_MIDI_TEMPO,
+    device: Optional[str] = None,
 ) -> Tuple[
     Dict[str, np.array],
     pretty_midi.PrettyMIDI,
@@ -218,7 +473,7 @@ def predict(
   """Run a single prediction.
 
   Args:
-      audio_path: File path for the audio to run inference on.
+      audio_path: File path for the audio to run inference on, or (audio, sr) already decoded.
       model_or_model_path: A loaded Model or path to a serialized model to load.
       onset_threshold: Minimum energy required for an onset to be considered present.
       frame_threshold: Minimum energy requirement for a frame to be considered present.
@@ -228,13 +483,14 @@ def predict(
       multiple_pitch_bends: If True, allow overlapping notes in midi file to have pitch bends.
       melodia_trick: Use the melodia post-processing step.
       debug_file: An optional path to output debug data to. Useful for testing/verification.
+      device: Where to run a model loaded from a path (see `Model`); ignored for a loaded Model.
   Returns:
       The model output, midi data and note events from a single prediction
   """
 
-  print(f"Predicting MIDI for {audio_path}...")
+  print(f"Predicting MIDI for {'decoded audio' if isinstance(audio_path, tuple) else audio_path}...")
 
-  model_output = run_inference(audio_path, model_or_model_path, debug_file)
+  model_output = run_inference(audio_path, model_or_model_path, debug_file, device=device)
   min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
   midi_data, note_events = infer.model_output_to_notes(
       model_output,
@@ -276,8 +532,10 @@ def predict(
 
 
 # %%
-def transform_to_midi(audio_path: Path, midi_path: Path):
-  model_output, midi_data, note_events = predict(audio_path)
+def transform_to_midi(audio_path: AudioSource, midi_path: Path,
+                      model_or_model_path: Union[Model, Path, str] = ICASSP_2022_MODEL_PATH,
+                      device: Optional[str] = None):
+  model_output, midi_data, note_events = predict(audio_path, model_or_model_path, device=device)
   midi_data.write(midi_path)
 
 
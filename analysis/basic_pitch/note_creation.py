@@ -4,6 +4,7 @@ import pathlib
 from collections import defaultdict
 from typing import DefaultDict, Dict, List, Optional, Tuple, Union
 import librosa
+import numba
 import numpy as np
 import pretty_midi
 import scipy
@@ -293,12 +294,10 @@ def constrain_frequency(
 
 
 def model_frames_to_time(n_frames: int) -> np.ndarray:
-  original_times = librosa.core.frames_to_time(
-      np.arange(n_frames),
-      sr=AUDIO_SAMPLE_RATE,
-      hop_length=FFT_HOP,
-  )
-  window_numbers = np.floor(np.arange(n_frames) / ANNOT_N_FRAMES)
+  frames = np.arange(n_frames)
+  # same as librosa.frames_to_time(frames, sr=AUDIO_SAMPLE_RATE, hop_length=FFT_HOP)
+  original_times = frames * FFT_HOP / AUDIO_SAMPLE_RATE
+  window_numbers = np.floor(frames / ANNOT_N_FRAMES)
   window_offset = (FFT_HOP / AUDIO_SAMPLE_RATE) * (
       ANNOT_N_FRAMES - (AUDIO_N_SAMPLES / FFT_HOP)
   ) + MAGIC_ALIGNMENT_OFFSET
@@ -337,27 +336,84 @@ def output_to_notes_polyphonic(
       representing the note events, where amplitude is a number between 0 and 1
   """
 
-  n_frames = frames.shape[0]
-
   onsets, frames = constrain_frequency(onsets, frames, max_freq, min_freq)
   # use onsets inferred from frames in addition to the predicted onsets
   if infer_onsets:
     onsets = get_infered_onsets(onsets, frames)
 
-  peak_thresh_mat = np.zeros(onsets.shape)
-  peaks = scipy.signal.argrelmax(onsets, axis=0)
-  peak_thresh_mat[peaks] = onsets[peaks]
-
-  onset_idx = np.where(peak_thresh_mat >= onset_thresh)
-  onset_time_idx = onset_idx[0][::-1]  # sort to go backwards in time
-  onset_freq_idx = onset_idx[1][::-1]  # sort to go backwards in time
+  onset_time_idx, onset_freq_idx = _onset_peaks(onsets, onset_thresh)  # sorted to go backwards in time
 
   remaining_energy = np.zeros(frames.shape)
   remaining_energy[:, :] = frames[:, :]
 
   # loop over onsets
   note_events = []
-  for note_start_idx, freq_idx in zip(onset_time_idx, onset_freq_idx):
+  for i_start, i_end, freq_idx in _track_onset_notes(
+      remaining_energy, onset_time_idx, onset_freq_idx, frame_thresh, min_note_len, energy_tol):
+    # add the note
+    amplitude = np.mean(frames[i_start:i_end, freq_idx])
+    note_events.append((i_start, i_end, freq_idx + MIDI_OFFSET, amplitude))
+
+  if melodia_trick:
+    for i_start, i_end, freq_idx in _track_melodia_notes(remaining_energy, frame_thresh, min_note_len, energy_tol):
+      # add the note
+      amplitude = np.mean(frames[i_start:i_end, freq_idx])
+      note_events.append((i_start, i_end, freq_idx + MIDI_OFFSET, amplitude))
+
+  return note_events
+
+
+# The note tracking loops below walk the (n_times, n_freqs) activations cell by cell;
+# they are compiled with numba since they are pure interpreter overhead in Python.
+
+
+@numba.njit(cache=True)
+def _onset_peaks(onsets: np.ndarray, onset_thresh: float) -> Tuple[np.ndarray, np.ndarray]:
+  """Time/frequency indices of onset peaks (strict local maxima over time) above threshold,
+  latest first. Equivalent to thresholding scipy.signal.argrelmax(onsets, axis=0)."""
+  n_times, n_freqs = onsets.shape
+  time_idx = np.empty(n_times * n_freqs, dtype=np.int64)
+  freq_idx = np.empty(n_times * n_freqs, dtype=np.int64)
+  n = 0
+  for t in range(n_times - 1, -1, -1):
+    for f in range(n_freqs - 1, -1, -1):
+      x = onsets[t, f]
+      is_peak = 0 < t < n_times - 1 and x > onsets[t - 1, f] and x > onsets[t + 1, f]
+      if (x if is_peak else 0.0) >= onset_thresh:
+        time_idx[n] = t
+        freq_idx[n] = f
+        n += 1
+  return time_idx[:n], freq_idx[:n]
+
+
+@numba.njit(cache=True)
+def _clear_energy(remaining_energy: np.ndarray, i: int, freq_idx: int) -> None:
+  remaining_energy[i, freq_idx] = 0
+  if freq_idx < MAX_FREQ_IDX:
+    remaining_energy[i, freq_idx + 1] = 0
+  if freq_idx > 0:
+    remaining_energy[i, freq_idx - 1] = 0
+
+
+@numba.njit(cache=True)
+def _track_onset_notes(
+    remaining_energy: np.ndarray,
+    onset_time_idx: np.ndarray,
+    onset_freq_idx: np.ndarray,
+    frame_thresh: float,
+    min_note_len: int,
+    energy_tol: int,
+) -> List[Tuple[int, int, int]]:
+  """Follow each onset forward until the frame energy drops. Clears used energy in place.
+
+  Returns:
+      list of (start_frame, end_frame, freq_idx)
+  """
+  n_frames = remaining_energy.shape[0]
+  notes = []
+  for j in range(len(onset_time_idx)):
+    note_start_idx = onset_time_idx[j]
+    freq_idx = onset_freq_idx[j]
     # if we're too close to the end of the audio, continue
     if note_start_idx >= n_frames - 1:
       continue
@@ -378,83 +434,73 @@ def output_to_notes_polyphonic(
     if i - note_start_idx <= min_note_len:
       continue
 
-    remaining_energy[note_start_idx:i, freq_idx] = 0
-    if freq_idx < MAX_FREQ_IDX:
-      remaining_energy[note_start_idx:i, freq_idx + 1] = 0
-    if freq_idx > 0:
-      remaining_energy[note_start_idx:i, freq_idx - 1] = 0
+    for t in range(note_start_idx, i):
+      _clear_energy(remaining_energy, t, freq_idx)
+    notes.append((note_start_idx, i, freq_idx))
+  return notes
 
-    # add the note
-    amplitude = np.mean(frames[note_start_idx:i, freq_idx])
-    note_events.append(
-        (
-            note_start_idx,
-            i,
-            freq_idx + MIDI_OFFSET,
-            amplitude,
-        )
-    )
 
-  if melodia_trick:
-    energy_shape = remaining_energy.shape
-
-    while np.max(remaining_energy) > frame_thresh:
-      i_mid, freq_idx = np.unravel_index(np.argmax(remaining_energy), energy_shape)
-      remaining_energy[i_mid, freq_idx] = 0
-
-      # forward pass
-      i = i_mid + 1
-      k = 0
-      while i < n_frames - 1 and k < energy_tol:
-        if remaining_energy[i, freq_idx] < frame_thresh:
-          k += 1
-        else:
-          k = 0
-
-        remaining_energy[i, freq_idx] = 0
-        if freq_idx < MAX_FREQ_IDX:
-          remaining_energy[i, freq_idx + 1] = 0
-        if freq_idx > 0:
-          remaining_energy[i, freq_idx - 1] = 0
-
-        i += 1
-
-      i_end = i - 1 - k  # go back to frame above threshold
-
-      # backward pass
-      i = i_mid - 1
-      k = 0
-      while i > 0 and k < energy_tol:
-        if remaining_energy[i, freq_idx] < frame_thresh:
-          k += 1
-        else:
-          k = 0
-
-        remaining_energy[i, freq_idx] = 0
-        if freq_idx < MAX_FREQ_IDX:
-          remaining_energy[i, freq_idx + 1] = 0
-        if freq_idx > 0:
-          remaining_energy[i, freq_idx - 1] = 0
-
-        i -= 1
-
-      i_start = i + 1 + k  # go back to frame above threshold
-      assert i_start >= 0, "{}".format(i_start)
-      assert i_end < n_frames
-
-      if i_end - i_start <= min_note_len:
-        # note is too short, skip it
-        continue
+@numba.njit(cache=True)
+def _track_melodia_notes(
+    remaining_energy: np.ndarray, frame_thresh: float, min_note_len: int, energy_tol: int
+) -> List[Tuple[int, int, int]]:
+  """Melodia trick: repeatedly grow a note out of the strongest remaining frame,
+  forwards and backwards, until no frame is above threshold. Clears energy in place.
 
-      # add the note
-      amplitude = np.mean(frames[i_start:i_end, freq_idx])
-      note_events.append(
-          (
-              i_start,
-              i_end,
-              freq_idx + MIDI_OFFSET,
-              amplitude,
-          )
-      )
+  Returns:
+      list of (start_frame, end_frame, freq_idx)
+  """
+  n_frames = remaining_energy.shape[0]
+  # per-frame maxima, so finding the global argmax is O(n_frames); only the frames a note
+  # clears need rescanning afterwards
+  row_max = np.empty(n_frames, dtype=remaining_energy.dtype)
+  for t in range(n_frames):
+    row_max[t] = remaining_energy[t].max()
+
+  notes = []
+  while True:
+    # first occurrence in C order, as np.argmax on the full matrix
+    i_mid = np.argmax(row_max)
+    if not row_max[i_mid] > frame_thresh:
+      break
+    freq_idx = np.argmax(remaining_energy[i_mid])
+    remaining_energy[i_mid, freq_idx] = 0
+
+    # forward pass
+    i = i_mid + 1
+    k = 0
+    while i < n_frames - 1 and k < energy_tol:
+      if remaining_energy[i, freq_idx] < frame_thresh:
+        k += 1
+      else:
+        k = 0
+      _clear_energy(remaining_energy, i, freq_idx)
+      i += 1
 
-  return note_events
+    i_forward = i  # frames i_mid..i_forward-1 were cleared going forwards
+    i_end = i - 1 - k  # go back to frame above threshold
+
+    # backward pass
+    i = i_mid - 1
+    k = 0
+    while i > 0 and k < energy_tol:
+      if remaining_energy[i, freq_idx] < frame_thresh:
+        k += 1
+      else:
+        k = 0
+      _clear_energy(remaining_energy, i, freq_idx)
+      i -= 1
+
+    i_start = i + 1 + k  # go back to frame above threshold
+    assert i_start >= 0
+    assert i_end < n_frames
+
+    for t in range(i + 1, i_forward):
+      row_max[t] = remaining_energy[t].max()
+
+    if i_end - i_start <= min_note_len:
+      # note is too short, skip it
+      continue
+
+    notes.append((i_start, i_end, freq_idx))
+  return notes
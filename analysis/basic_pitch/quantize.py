@@ -0,0 +1,52 @@
+# %%
+"""Offline conversion of the basic-pitch model to reduced precision variants.
+
+Writes `nmp.fp16.onnx` (picked by `Model` on CUDA/TensorRT) and `nmp.int8.onnx`
+(used with `Model(..., precision="int8")`) next to the fp32 model. Needs the optional `onnx`
+and `onnxconverter-common` packages.
+
+  python -m analysis.basic_pitch.quantize [--fp16] [--int8]
+"""
+
+from pathlib import Path
+from typing import Union
+
+from .inference import ICASSP_2022_MODEL_PATH, model_variant_path
+
+# %%
+
+
+def convert_int8(model_path: Union[Path, str], output_path: Union[Path, str]) -> Path:
+  """Dynamic int8 weight quantization, for CPU inference."""
+  from onnxruntime.quantization import QuantType, quantize_dynamic
+
+  quantize_dynamic(str(model_path), str(output_path), weight_type=QuantType.QInt8)
+  return Path(output_path)
+
+
+def convert_fp16(model_path: Union[Path, str], output_path: Union[Path, str]) -> Path:
+  """fp16 weights and activations, for GPU inference. Inputs/outputs stay fp32."""
+  import onnx
+  from onnxconverter_common import float16
+
+  model = onnx.load(str(model_path))
+  onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), str(output_path))
+  return Path(output_path)
+
+
+# %%
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="Convert the basic-pitch model to fp16/int8")
+  parser.add_argument("model_path", nargs="?", default=str(ICASSP_2022_MODEL_PATH))
+  parser.add_argument("--fp16", action="store_true", help="only write the fp16 variant")
+  parser.add_argument("--int8", action="store_true", help="only write the int8 variant")
+  args = parser.parse_args()
+
+  model_path = Path(args.model_path)
+  both = not (args.fp16 or args.int8)
+  if args.fp16 or both:
+    print("wrote:", convert_fp16(model_path, model_variant_path(model_path, "fp16")))
+  if args.int8 or both:
+    print("wrote:", convert_int8(model_path, model_variant_path(model_path, "int8")))
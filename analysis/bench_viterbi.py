@@ -0,0 +1,78 @@
+# %%
+"""对比 pyin 在 librosa 自带 Viterbi 内核与 analysis.pitch 对角线内核下的耗时，并检查两者结果一致。
+
+  python -m analysis.bench_viterbi [音频文件] [--offset 60] [--seconds 15] [--repeat 5]
+"""
+
+import argparse
+import threading
+from pathlib import Path
+from time import perf_counter
+
+import librosa.sequence
+import numpy as np
+
+from analysis import pitch
+
+# %%
+
+
+def _best_of(fn, repeat: int) -> float:
+  fn()  # 首次调用含 numba 编译/缓存加载，不计入
+  times = []
+  for _ in range(repeat):
+    start = perf_counter()
+    fn()
+    times.append(perf_counter() - start)
+  return min(times)
+
+
+def bench(y: np.ndarray, sr: float, hop_length: int = 512, repeat: int = 5) -> dict[str, float]:
+  """返回各项耗时（秒，取 repeat 次中最快的一次）：整段 pyin 与其中单独的 Viterbi 解码。"""
+  # 截下本线程 pyin 交给 _viterbi 的参数，单独测解码
+  captured = []
+  this_thread = threading.get_ident()
+  def capture(*args):
+    if threading.get_ident() == this_thread:
+      captured.append(args)
+    return pitch._librosa_viterbi(*args)
+  librosa.sequence._viterbi = capture
+  try:
+    reference = pitch._pyin(y, sr, hop_length)
+  finally:
+    librosa.sequence._viterbi = pitch._librosa_viterbi
+  args = captured[0]
+
+  with pitch.fast_viterbi():
+    fast = pitch._pyin(y, sr, hop_length)
+  for a, b in zip(reference, fast):
+    np.testing.assert_array_equal(a, b)
+
+  def run_pyin(enabled: bool):
+    with pitch.fast_viterbi(enabled):
+      pitch._pyin(y, sr, hop_length)
+
+  return {
+    'frames x states': args[0].shape,
+    'viterbi librosa': _best_of(lambda: pitch._librosa_viterbi(*args), repeat),
+    'viterbi fast': _best_of(lambda: pitch._fast_viterbi(*args), repeat),
+    'pyin librosa': _best_of(lambda: run_pyin(False), repeat),
+    'pyin fast': _best_of(lambda: run_pyin(True), repeat),
+  }
+
+
+# %%
+if __name__ == "__main__":
+  workspace_dir = Path(__file__).parent.parent
+  parser = argparse.ArgumentParser(description="Benchmark the pyin Viterbi kernels")
+  parser.add_argument("audio_path", nargs="?", default=str(workspace_dir / "res/杀破狼.mp3"))
+  parser.add_argument("--offset", type=float, default=60.0, help="start of the excerpt in seconds")
+  parser.add_argument("--seconds", type=float, default=15.0, help="length of the excerpt")
+  parser.add_argument("--repeat", type=int, default=5)
+  args = parser.parse_args()
+
+  y, sr = pitch.load_audio(args.audio_path)
+  y = np.array(y[int(args.offset * sr):int((args.offset + args.seconds) * sr)])
+  print(f"{args.audio_path}: {len(y) / sr:.1f} s at {sr} Hz")
+  for name, value in bench(y, sr, repeat=args.repeat).items():
+    print(f"  {name:16s} {value * 1e3:8.1f} ms" if isinstance(value, float) else f"  {name:16s} {value}")
@@ -1,40 +1,85 @@
 # %%
 import sounddevice as sd
+import json
+import math
 import time
 import numpy as np
 import librosa
 import threading
+from collections import deque
+try:
+  from notes import NOTE_NAMES
+except ImportError:
+  from .notes import NOTE_NAMES
 
 # %%
 CHANNELS = 1
 RATE = 44100  # 采样率
 CHUNK = 4096  # 每次读取的音频块大小
 RECORD_SECONDS = 0  # 0表示无限录制
+MAX_PENDING_FRAMES = 8  # 回调与检测线程之间最多缓存的块数，超出后丢弃最旧的
 
 # %%
+# 只有音频线程写入；每次整体替换为新的不可变对象，读者直接读取引用，无需加锁
+# （CPython 中对全局变量的赋值/读取是原子的）
 latest_pitch_data = None
+latest_pitch_json = b'{"status": "success", "data": {}}'
 is_running = True
-pitch_lock = threading.Lock()
+# 音频回调写入、检测线程读取；deque.append/popleft 在 CPython 中是原子操作，无需加锁
+frame_queue: deque[np.ndarray] = deque(maxlen=MAX_PENDING_FRAMES)
+frame_ready = threading.Event()
 
 # %%
 
 
+YIN_THRESHOLD = 0.1  # 累积均值归一化差分函数的阈值
+PITCH_FMIN = librosa.note_to_hz('D3')  # 最低检测音高
+PITCH_FMAX = librosa.note_to_hz('A5')  # 最高检测音高
+
+
+def _yin_pitch(x: np.ndarray, sr: int, fmin: float, fmax: float, threshold: float = YIN_THRESHOLD) -> float | None:
+  """YIN 基频估计，单帧只做一次 FFT，代替逐帧 pyin (HMM + Viterbi)。"""
+  n = len(x)
+  tau_min = max(int(sr / fmax), 1)
+  tau_max = min(int(sr / fmin), n - 1)
+  if tau_max <= tau_min + 1:
+    return None
+  x = x.astype(np.float64, copy=False)
+  # 自相关 r[tau] = sum(x[j] * x[j + tau])，补零到 2n 避免循环卷积
+  spectrum = np.fft.rfft(x, n=2 * n)
+  r = np.fft.irfft(spectrum * np.conj(spectrum), n=2 * n)[:tau_max + 1]
+  # 差分函数 d[tau] = sum((x[j] - x[j + tau])**2) = E(x[:n-tau]) + E(x[tau:]) - 2 r[tau]
+  energy = np.concatenate(([0.0], np.cumsum(x * x)))
+  taus = np.arange(tau_max + 1)
+  d = energy[n - taus] + (energy[n] - energy[taus]) - 2 * r
+  d[0] = 0.0
+  # 累积均值归一化 d'[tau] = d[tau] * tau / sum(d[1:tau+1])
+  cumulative = np.cumsum(d[1:])
+  cmnd = np.ones_like(d)
+  np.divide(d[1:] * taus[1:], cumulative, out=cmnd[1:], where=cumulative > 0)
+
+  below = np.flatnonzero(cmnd[tau_min:tau_max] < threshold)
+  if len(below) == 0:
+    return None
+  tau = tau_min + below[0]
+  # 沿下降方向走到局部最小值
+  while tau + 1 < tau_max and cmnd[tau + 1] < cmnd[tau]:
+    tau += 1
+  # 抛物线插值细化周期
+  a, b, c = cmnd[tau - 1], cmnd[tau], cmnd[tau + 1]
+  denom = a - 2 * b + c
+  shift = 0.5 * (a - c) / denom if denom != 0 else 0.0
+  return sr / (tau + shift)
+
+
 def detect_pitch(audio_data: np.ndarray, sr=RATE) -> float | None:
-  max_abs = np.max(np.abs(audio_data))
-  if max_abs == 0:
+  if not audio_data.any():
     return None
-  audio_data = audio_data / max_abs
-  f0, _, _ = librosa.pyin(
-      audio_data,
-      fmin=librosa.note_to_hz('D3'),  # 最低检测音高 65hz value=36
-      fmax=librosa.note_to_hz('A5'),  # 最高检测音高 2093hz value=96
-      sr=sr
-  )
-  if f0 is not None:
-    valid_f0 = f0[~np.isnan(f0)]
-    if len(valid_f0) > 0:
-      return np.mean(valid_f0)
-  return None
+  return _yin_pitch(audio_data, sr, PITCH_FMIN, PITCH_FMAX)
+
+
+def hz_to_midi(frequency: float) -> float:
+  return 69 + 12 * math.log2(frequency / 440.0)
 
 
 def hz_to_note(frequency: float) -> str:
@@ -42,45 +87,43 @@ def hz_to_note(frequency: float) -> str:
   if frequency <= 0:
     return "无效频率"
 
-  a4 = 440.0
-  semitones = 12 * np.log2(frequency / a4)
-  semitones_rounded = round(semitones)
-
-  note_names = ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#']
-  octave = 4 + (semitones_rounded + 9) // 12
-  note_index = (semitones_rounded + 9) % 12
-  return f"{note_names[note_index]}{octave} {semitones_rounded + 9} ({frequency:.1f} Hz)"
+  midi = min(max(round(hz_to_midi(frequency)), 0), 127)
+  return f"{NOTE_NAMES[midi]} {midi - 60} ({frequency:.1f} Hz)"
 
 def describe_np(array: np.ndarray) -> str:
   return f"shape: {array.shape}, dtype: {array.dtype}, min: {np.min(array)}, max: {np.max(array)}, mean: {np.mean(array):.4f}, std: {np.std(array):.4f}"
 
-def handle_frame(stream: sd.InputStream, chunk_size = None):
-  # read returns (frames, overflow)
-  global CHUNK
-  frames, overflow = stream.read(CHUNK)
-  if overflow:
-    print("缓冲区溢出，增加块大小", stream.read_available, overflow)
-    CHUNK *= 2
-  # if frames.any(): print(describe_np(frames))
-  # frames shape: (CHUNK, CHANNELS) -> squeeze to 1D for mono
-  audio_data = np.squeeze(np.array(frames, dtype=np.float32))
-  # 检测音高
-  pitch = detect_pitch(audio_data)
-  # 显示结果
-  return pitch
+def audio_callback(indata: np.ndarray, frames_count, time_info, status):
+  if status:
+    print('Audio status:', status)
+  # indata 的缓冲区会被 PortAudio 复用，需要拷贝
+  frame_queue.append(indata[:, 0].copy())
+  frame_ready.set()
+
+def handle_frame() -> float | None:
+  # 只检测最新的一块，积压的旧数据直接丢弃
+  audio_data = None
+  while frame_queue:
+    audio_data = frame_queue.popleft()
+  if audio_data is None:
+    return None
+  return detect_pitch(audio_data)
 
 def audio_processing_thread():
   start_time = time.time()
   print("开始检测音高, start_time:", start_time)
   try:
     # Use sounddevice InputStream which is usually easier to install on macOS
-    with sd.InputStream(samplerate=RATE, channels=CHANNELS, dtype='float32', blocksize=CHUNK) as stream:
+    with sd.InputStream(samplerate=RATE, channels=CHANNELS, dtype='float32', blocksize=CHUNK, callback=audio_callback):
       while is_running:
-        pitch = handle_frame(stream)
+        if not frame_ready.wait(timeout=0.5):
+          continue
+        frame_ready.clear()
+        pitch = handle_frame()
 
         if pitch:
-          midi = librosa.hz_to_midi(pitch)
-          note = librosa.hz_to_note(pitch)
+          midi = hz_to_midi(pitch)
+          note = NOTE_NAMES[min(max(round(midi), 0), 127)]
           # print(f"当前音高: {midi:.2f} MIDI, {note}")
           pitch_data = {
               "midi": midi,
@@ -88,40 +131,76 @@ def audio_processing_thread():
               "pitch": pitch,
               "time": time.time()
           }
-          global latest_pitch_data
-          with pitch_lock:
-            latest_pitch_data = pitch_data
-        # 短暂延迟，减少CPU占用
-        time.sleep(0.05)
+          # 在音频线程里序列化一次，HTTP 请求只需返回现成的 bytes
+          pitch_json = json.dumps({'status': 'success', 'data': pitch_data}).encode()
+          global latest_pitch_data, latest_pitch_json
+          latest_pitch_data = pitch_data
+          latest_pitch_json = pitch_json
   except Exception as e:
     print(f"检测已停止: {e}")
   finally:
     print("音频处理线程已退出")
 
 # %%
-from flask import Flask, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+HTTP_WORKERS = 4  # 处理 HTTP 请求的线程数上限
+
+
+class PitchRequestHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?', 1)[0] != '/pitch':
+      self.send_error(404)
+      return
+    body = latest_pitch_json
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    # 允许所有域名访问
+    self.send_header('Access-Control-Allow-Origin', '*')
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # 轮询频率很高，不逐条打印请求日志
+    pass
+
+
+class PooledHTTPServer(HTTPServer):
+  """用固定大小的线程池处理请求，而不是每个请求新开一个线程"""
+
+  def __init__(self, server_address, handler_class, max_workers=HTTP_WORKERS):
+    super().__init__(server_address, handler_class)
+    self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+  def process_request(self, request, client_address):
+    self._pool.submit(self._process_request, request, client_address)
+
+  def _process_request(self, request, client_address):
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      self.shutdown_request(request)
 
-app = Flask(__name__)
+  def server_close(self):
+    super().server_close()
+    self._pool.shutdown(wait=False)
 
-@app.route('/pitch', methods=['GET'])
-def get_pitch():
-  with pitch_lock:
-    pitch_data = latest_pitch_data
-  response = jsonify({'status': 'success', 'data': pitch_data if pitch_data else {}})
-  # 允许所有域名访问
-  response.headers['Access-Control-Allow-Origin'] = '*'
-  return response
 
 def run_http_server(port=8000, host='localhost'):
-  """启动Flask HTTP服务器"""
+  """启动HTTP服务器"""
   print(f"HTTP服务器已启动, 监听端口 {port}")
   print(f"可用接口: http://localhost:{port}/pitch")
+  server = PooledHTTPServer((host, port), PitchRequestHandler)
   try:
-    # use_reloader=False to avoid spawning child processes which can duplicate audio threads
-    app.run(host=host, port=port, debug=True, threaded=True, use_reloader=False)
+    server.serve_forever()
   except KeyboardInterrupt:
     pass
   finally:
+    server.server_close()
     print("HTTP服务器已停止")
 
 # %%
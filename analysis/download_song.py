@@ -1,8 +1,18 @@
 # %%
 # 从网易云音乐搜索并下载歌曲
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 复用连接（keep-alive 连接池），避免每次请求都重新 DNS + TCP + TLS 握手
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                       max_retries=Retry(total=3, backoff_factor=0.3))
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
 # %%
 
 
@@ -47,7 +57,7 @@ def parse_song_info(data: dict) -> Song:
 
 def search_song(content: str, limit: int = 10) -> list[Song]:
   search_url = f'https://music.163.com/api/search/get/web?csrf_token=hlpretag=&hlposttag=&s={content}&type=1&offset=0&total=true&limit={limit}'
-  response = requests.get(search_url)
+  response = _session.get(search_url)
   data = response.json()
   songs_data = data['result']['songs']
   songs = [parse_song_info(data) for data in songs_data]
@@ -61,15 +71,16 @@ def download_song(song: Song, path: Path):
     print(f"Song '{song}' is not available for download due to copyright restrictions.")
     return
   mp3_url = get_mp3url(song.id)
-  response = requests.get(mp3_url)
   path.parent.mkdir(parents=True, exist_ok=True)
-  with open(path, 'wb') as f:
-    f.write(response.content)
+  # 流式写入磁盘，不在内存中保留整个 mp3
+  with _session.get(mp3_url, stream=True) as response, open(path, 'wb') as f:
+    for chunk in response.iter_content(1 << 16):
+      f.write(chunk)
 
 
 def download_lyric(song: Song, path: Path):
   lrc_url = get_lrc_url(song.id)
-  response = requests.get(lrc_url)
+  response = _session.get(lrc_url)
   data = response.json()
   if 'lrc' in data and 'lyric' in data['lrc']:
     lyric = data['lrc']['lyric']
@@ -80,6 +91,16 @@ def download_lyric(song: Song, path: Path):
     print(f"No lyrics found for song: {song}")
 
 
+def download_songs(songs: list[Song], out_dir: Path, max_workers: int = 8):
+  """并发下载多首歌曲及歌词，文件名为 <name>-<id>.mp3 / .lrc"""
+  def download_one(song: Song):
+    download_song(song, out_dir.joinpath(f"{song.name}-{song.id}.mp3"))
+    download_lyric(song, out_dir.joinpath(f"{song.name}-{song.id}.lrc"))
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    list(executor.map(download_one, songs))
+
+
 # %%
 # RES_DIR = Path(__file__).parent.parent / "res/songs"
 # # %%
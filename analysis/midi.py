@@ -4,8 +4,13 @@
 
 from dataclasses import dataclass
 from plottings import plot_notes
+try:
+  from notes import NOTE_NAMES
+except ImportError:
+  from .notes import NOTE_NAMES
 
 import mido
+import numpy as np
 import matplotlib.pyplot as plt
 
 TEMPO = 500000  # 默认微秒/四分音符
@@ -21,76 +26,79 @@ class Note:
 
 def note_number_to_name(n: int) -> str:
   """将 MIDI 音符编号转换为名称，例如 60 -> C4。"""
-  names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-  octave = (n // 12) - 1
-  name = names[n % 12]
-  return f"{name}{octave}"
+  return NOTE_NAMES[n]
+
+
+_OTHER, _NOTE_ON, _NOTE_OFF = 0, 1, 2
 
 
 def extract_notes(mid: mido.MidiFile, start_sec: float | None = None, end_sec: float | None = None) -> list[Note]:
   """解析 MIDI，返回在时间段内的音符列表。
 
-  每个音符用 dict 表示：{'note': int, 'name': str, 'start': float, 'end': float, 'velocity': int, 'channel': int}
-
   算法：
-  - 将所有 track 的消息展开为 (abs_tick, msg)
-  - 按 abs_tick 排序，并在遍历时使用当前 tempo 动态将 tick 转为秒
-  - 跟踪正在按下的 note (channel, note) 对，遇到 note_off 或 note_on with vel==0 则结束该 note
+  - 一次遍历所有 track，把消息的绝对 tick、类型、channel、音高、力度写入预分配的 numpy 数组
+  - 按绝对 tick 稳定排序，确保多 track 的消息按时间线性处理
+  - 用 (16, 128, 2) 的数组跟踪正在按下的 note (channel, note) -> (start_tick, velocity)，
+    遇到 note_off 或 note_on with vel==0 则结束该 note
   """
-  ticks_per_beat = mid.ticks_per_beat
-
-  events: list[tuple[int, mido.Message]] = []
+  total = sum(len(track) for track in mid.tracks)
+  abs_ticks = np.empty(total, dtype=np.int64)
+  kinds = np.zeros(total, dtype=np.int8)
+  channels = np.zeros(total, dtype=np.int8)
+  pitches = np.zeros(total, dtype=np.int16)
+  velocities = np.zeros(total, dtype=np.int16)
+
+  i = 0
   for track in mid.tracks:
     abs_tick = 0
     for msg in track:
       abs_tick += msg.time
-      events.append((abs_tick, msg))
-
-  # 按绝对 tick 排序，确保多 track 的消息按时间线性处理
-  events.sort(key=lambda x: x[0])
-
-  notes: list[Note] = []
-  ongoing: list[tuple[int, int], dict] = {}  # (channel, note) -> {'start': float, 'velocity': int}
-
-  last_tick = 0
-  current_tick = 0
-  tempo = 500000  # 默认微秒/四分音符
-
-  for abs_tick, msg in events:
-    delta_ticks = abs_tick - last_tick
-    if delta_ticks:
-      seconds = mido.tick2second(delta_ticks, ticks_per_beat, tempo)
-      current_tick += delta_ticks
-      last_tick = abs_tick
-
-    if msg.is_meta and msg.type == 'set_tempo':
-      tempo = msg.tempo
+      abs_ticks[i] = abs_tick
+      # 只关心 note_on / note_off
+      if msg.type == 'note_on' or msg.type == 'note_off':
+        kinds[i] = _NOTE_ON if msg.type == 'note_on' and msg.velocity > 0 else _NOTE_OFF
+        channels[i] = msg.channel
+        pitches[i] = msg.note
+        velocities[i] = msg.velocity
+      i += 1
+
+  order = np.argsort(abs_ticks, kind='stable')
+  order = order[kinds[order] != _OTHER]
+
+  # (channel, note) -> (start_tick, velocity)，start_tick == -1 表示未按下
+  ongoing = np.full((16, 128, 2), -1, dtype=np.int64)
+  note_idx: list[int] = []
+  note_start: list[int] = []
+  note_velocity: list[int] = []
+  for j, tick, kind, channel, pitch, velocity in zip(
+      order.tolist(), abs_ticks[order].tolist(), kinds[order].tolist(),
+      channels[order].tolist(), pitches[order].tolist(), velocities[order].tolist()):
+    if kind == _NOTE_ON:
+      # 如果该 note 已经存在（重叠按新开始覆盖）
+      ongoing[channel, pitch] = (tick, velocity)
       continue
-
-    # 只关心 note_on / note_off
-    if not hasattr(msg, 'type'):
+    start, vel = ongoing[channel, pitch].tolist()
+    if start < 0:
+      # 未发现对应的开始，跳过
       continue
-
-    if msg.type == 'note_on' and msg.velocity > 0:
-      key = (getattr(msg, 'channel', 0), msg.note)
-      # 如果该 note 已经存在（重叠按新开始覆盖）
-      ongoing[key] = {'start': current_tick, 'velocity': msg.velocity}
-
-    elif msg.type == 'note_off' or (msg.type == 'note_on' and getattr(msg, 'velocity', 0) == 0):
-      key = (getattr(msg, 'channel', 0), msg.note)
-      info = ongoing.pop(key, None)
-      if info is None:
-        # 未发现对应的开始，跳过
-        continue
-      note = Note(
-          note=msg.note,
-          name=note_number_to_name(msg.note),
-          start=info['start'],
-          duration=current_tick-info['start'],
-          velocity=info.get('velocity', 0),
-          channel=key[0],
+    ongoing[channel, pitch, 0] = -1
+    note_idx.append(j)
+    note_start.append(start)
+    note_velocity.append(vel)
+
+  notes = [
+      Note(
+          note=pitch,
+          name=note_number_to_name(pitch),
+          start=start,
+          duration=end - start,
+          velocity=vel,
+          channel=channel,
       )
-      notes.append(note)
+      for pitch, channel, end, start, vel in zip(
+          pitches[note_idx].tolist(), channels[note_idx].tolist(), abs_ticks[note_idx].tolist(),
+          note_start, note_velocity)
+  ]
 
   # 过滤时间段
   if start_sec is None and end_sec is None:
@@ -106,18 +114,19 @@ def extract_notes(mid: mido.MidiFile, start_sec: float | None = None, end_sec: f
   return filtered
 
 
-def hist_notes(mid: list[Note]) -> dict[int, int]:
-  """统计 MIDI 文件中每个音符出现的次数，返回 {note_number: count}。"""
-  counts: dict[int, int] = {}
-  for n in mid:
-    counts[n.note] = counts.get(n.note, 0) + n.duration
+def hist_notes(mid: list[Note]) -> np.ndarray:
+  """统计每个音高的总时长（tick），返回长度 128 的数组，下标为 MIDI 音符编号。"""
+  pitches = np.fromiter((n.note for n in mid), dtype=np.int64, count=len(mid))
+  durations = np.fromiter((n.duration for n in mid), dtype=np.float64, count=len(mid))
+  counts = np.bincount(pitches, weights=durations, minlength=128)
   plt.figure()
-  plt.hist(list(counts.keys()), weights=list(counts.values()), align='left', rwidth=0.8, )
+  plt.bar(np.arange(counts.shape[0]), counts, width=0.8)
   plt.xlabel('MIDI Note Number')
   plt.ylabel('Count')
   plt.title('MIDI Note Histogram')
   plt.grid(axis='y', linestyle='--', alpha=0.7)
   plt.show()
+  return counts
 
 # %%
 if __name__ == "__main__":
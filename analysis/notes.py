@@ -0,0 +1,6 @@
+"""MIDI 音符编号与名称的对照表，analysis/midi.py 与 analysis/capture_voice.py 共用。
+"""
+
+PITCH_CLASSES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+# 0-127 号音符的名称（科学音高记号，60 -> 'C4'，69 -> 'A4'），升号统一写作 ASCII 的 '#'
+NOTE_NAMES = tuple(f"{PITCH_CLASSES[n % 12]}{n // 12 - 1}" for n in range(128))
@@ -1,9 +1,23 @@
 # %%
 # 音高分析
+import contextlib
+import functools
+import hashlib
+import inspect
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import librosa
+import librosa.sequence
+import numba
 import numpy as np
-from pathlib import Path
-from mido import MidiFile, MidiTrack, Message
+import soundfile as sf
+from mido import MidiFile, Message
 import mido
 
 try:
@@ -14,23 +28,384 @@ except ImportError:
 # %%
 # 获取音频信息
 
+@functools.lru_cache(maxsize=8)
+def _load_audio_cached(path: str, sr: int | None, mtime_ns: int) -> tuple[np.ndarray, float]:
+  try:
+    # libsndfile 能读的格式（wav/flac/ogg/mp3）直接解码，省掉 librosa.load 的一层包装（约 10%）；
+    # 混音与重采样方式同 librosa.load，结果逐样本一致
+    y, native_sr = sf.read(path, dtype='float32', always_2d=True)
+  except sf.SoundFileRuntimeError:
+    y, sr = librosa.load(path, sr=sr)
+  else:
+    y = y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+    if sr is not None and sr != native_sr:
+      y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+    else:
+      sr = native_sr
+  # 同一数组会被多个调用方共享，禁止原地修改
+  y.setflags(write=False)
+  return y, sr
+
+
+def load_audio(audio_path: Path | str, sr: int | None = None) -> tuple[np.ndarray, float]:
+  """带缓存的 librosa.load：同一进程内相同 (路径, sr) 只解码一次，文件被改写后重新解码。
+
+  返回的 y 是只读的共享数组，需要修改时先 copy()。
+  """
+  path = str(audio_path)
+  return _load_audio_cached(path, sr, os.stat(path).st_mtime_ns)
+
+
+# pyin 结果缓存为单个结构化 .npy：一次 mmap 覆盖四个数组，免去 npz 的 zip 解析与拷贝。
+# 全部用 float32（每帧 13 字节而非 21），f32 的精度远高于 MIDI 取整所需的 1 音分
+PITCH_CACHE_DTYPE = np.dtype([('pitches', 'f4'), ('voiced_flag', '?'), ('voiced_prob', 'f4'), ('rms', 'f4')])
+
 
 def _load_pitch_analysis(cache_path: Path) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-  data = np.load(cache_path)
-  # older caches may not contain rms; provide zeros in that case
-  pitches = data['pitches']
-  voiced_flag = data['voiced_flag']
-  voiced_prob = data['voiced_prob']
-  rms = data['rms'] if 'rms' in data else np.zeros_like(pitches)
-  return pitches, voiced_flag, voiced_prob, rms
+  # 只读 mmap，各字段为视图，按需从页缓存读入
+  data = np.load(cache_path, mmap_mode='r')
+  return data['pitches'], data['voiced_flag'], data['voiced_prob'], data['rms']
 
 
 def _save_pitch_analysis(pitches: np.ndarray, voiced_flag: np.ndarray, voiced_prob: np.ndarray, rms: np.ndarray, cache_path: Path):
-  np.savez(cache_path, pitches=pitches,
-           voiced_flag=voiced_flag, voiced_prob=voiced_prob, rms=rms)
+  n = min(len(pitches), len(rms))
+  data = np.empty(n, dtype=PITCH_CACHE_DTYPE)
+  data['pitches'] = pitches[:n]
+  data['voiced_flag'] = voiced_flag[:n]
+  data['voiced_prob'] = voiced_prob[:n]
+  data['rms'] = rms[:n]
+  # 先写临时文件再改名，中断或并发运行时不会留下半个缓存
+  tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp.npy")
+  np.save(tmp_path, data)
+  os.replace(tmp_path, cache_path)
+
+
+def _pitch_cache_prefix(audio_path: Path, hop_length: int, k: int) -> str:
+  """同一文件、同一分析参数的缓存文件名前缀；降采样分析（k > 1）与全采样率的结果分开缓存。"""
+  return f"{audio_path.stem}_pyin_h{hop_length}" + (f"_d{k}" if k > 1 else "")
+
+
+def _pitch_cache_path(audio_path: Path, hop_length: int, y: np.ndarray | None = None, k: int = 1,
+                      cache_key: str | None = None) -> Path:
+  """缓存文件名带上 hop_length、降采样倍数 k 与内容的 blake2b 摘要：重新分离出的人声或换了参数都不会命中旧结果。
+
+  给出 cache_key 时摘要取自它（调用方保证它随内容变化）；否则给出 y 时取自已解码的样本，
+  不读文件（文件可能还在后台写出）；都没有时取自文件内容。
+  """
+  if cache_key is not None:
+    digest = hashlib.blake2b(cache_key.encode(), digest_size=8).hexdigest()
+  elif y is not None:
+    digest = hashlib.blake2b(np.ascontiguousarray(y), digest_size=8).hexdigest()
+  else:
+    with open(audio_path, 'rb') as f:
+      digest = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=8)).hexdigest()
+  return audio_path.with_name(f"{_pitch_cache_prefix(audio_path, hop_length, k)}_{digest}.npy")
+
+
+PYIN_FMIN = librosa.note_to_hz('C2')  # 最低检测音高
+PYIN_FMAX = librosa.note_to_hz('C6')  # 最高检测音高
+PYIN_FRAME_LENGTH = 2048  # 原始采样率下的帧长，与 librosa.pyin 默认值一致
+
+
+# pyin 的 Viterbi 解码约占其 40% 耗时。转移矩阵是 kron(浊/清切换, 带状音高转移)，每个状态约 150 个前驱。
+# librosa 的内核按状态逐个遍历前驱列表；这里改为按转移矩阵的对角线遍历，最内层循环沿目标状态连续、无分支，
+# 可以向量化。同一目标状态的前驱仍按编号从小到大比较、取严格更大者，结果与 librosa 完全一致
+@numba.njit(cache=True, nogil=True)
+def _viterbi_diagonals(log_prob, offsets, lo, hi, diag_trans, log_p_init, ptr):
+  """diag_trans[i, j] = log_trans[j + offsets[i], j]，只在 [lo[i], hi[i]) 内有效（阈值以下为 -inf）。
+  ptr: 形状同 log_prob 的 int32 回溯表，由调用方提供（内容无需初始化）。"""
+  n_steps, n_states = log_prob.shape
+  state = np.zeros(n_steps, dtype=np.uint16)
+  value = log_prob[0] + log_p_init
+  best = np.empty(n_states)
+  arg = np.empty(n_states, dtype=np.int32)
+  for t in range(1, n_steps):
+    best[:] = -np.inf
+    for i in range(offsets.shape[0]):
+      d = offsets[i]
+      src = value[lo[i] + d:hi[i] + d]
+      trans = diag_trans[i, lo[i]:hi[i]]
+      b = best[lo[i]:hi[i]]
+      a = arg[lo[i]:hi[i]]
+      for n in range(b.shape[0]):
+        cost = src[n] + trans[n]
+        better = cost > b[n]
+        b[n] = cost if better else b[n]
+        a[n] = np.int32(lo[i] + n + d) if better else a[n]
+    ptr[t] = arg
+    for j in range(n_states):
+      value[j] = log_prob[t, j] + best[j]
+  state[-1] = np.argmax(value)
+  for t in range(n_steps - 2, -1, -1):
+    state[t] = ptr[t + 1, state[t + 1]]
+  return state, value[state[-1]:state[-1] + 1].copy()
+
+
+_librosa_viterbi = getattr(librosa.sequence, '_viterbi', None)
+
+
+def _scratch_array(scratch: dict, name: str, shape: int | tuple[int, ...], dtype) -> np.ndarray:
+  """scratch[name] 中取一块形状为 shape 的数组（内容未初始化）。容量只增不减：
+  不够时按本次大小重新分配，否则返回已有缓冲区的视图，批量处理长度相近的音频时不再反复申请。"""
+  size = int(np.prod(shape))
+  buf = scratch.get(name)
+  if buf is None or buf.size < size or buf.dtype != dtype:
+    buf = scratch[name] = np.empty(size, dtype=dtype)
+  return buf[:size].reshape(shape)
+
+
+# 每个线程各自复用一张 Viterbi 回溯表（帧数 × 状态数的 int32，一首歌数十 MB）
+_viterbi_scratch = threading.local()
+
+
+def _fast_viterbi(log_prob: np.ndarray, log_trans: np.ndarray, log_p_init: np.ndarray, log_trans_threshold: float):
+  """librosa.sequence._viterbi 的替代实现，参数与返回值相同。"""
+  n_states = log_trans.shape[0]
+  feasible = log_trans >= log_trans_threshold  # feasible[k, j]: 考虑 k -> j 的转移
+  if not feasible.any(axis=0).all():
+    # 有状态没有前驱，交给 librosa 报错
+    return _librosa_viterbi(log_prob, log_trans, log_p_init, log_trans_threshold)
+  k, j = np.nonzero(feasible)
+  offsets = np.unique(k - j)
+  lo = np.empty(len(offsets), dtype=np.int64)
+  hi = np.empty(len(offsets), dtype=np.int64)
+  diag_trans = np.full((len(offsets), n_states), -np.inf)
+  for i, d in enumerate(offsets):
+    j = np.arange(max(0, -d), min(n_states, n_states - d))
+    j = j[feasible[j + d, j]]
+    diag_trans[i, j] = log_trans[j + d, j]
+    lo[i], hi[i] = j[0], j[-1] + 1
+  scratch = _viterbi_scratch.__dict__
+  ptr = _scratch_array(scratch, 'ptr', log_prob.shape, np.int32)
+  return _viterbi_diagonals(np.ascontiguousarray(log_prob), offsets, lo, hi, diag_trans, log_p_init, ptr)
+
+
+def _viterbi_supported() -> bool:
+  """只认 librosa 1.0 的 _viterbi(log_prob, log_trans, log_p_init, log_trans_threshold)。"""
+  return _librosa_viterbi is not None and list(inspect.signature(_librosa_viterbi).parameters) == [
+      'log_prob', 'log_trans', 'log_p_init', 'log_trans_threshold']
+
+
+# 进入了 fast_viterbi(True) 的线程
+_viterbi_state = threading.local()
+_viterbi_patch_lock = threading.Lock()
+_viterbi_patch_depth = 0
+
+
+def _viterbi_dispatch(log_prob, log_trans, log_p_init, log_trans_threshold):
+  """替换期间 librosa 调用的 _viterbi：只有在 fast_viterbi(True) 块内的线程走对角线内核。"""
+  kernel = _fast_viterbi if getattr(_viterbi_state, 'enabled', False) else _librosa_viterbi
+  return kernel(log_prob, log_trans, log_p_init, log_trans_threshold)
+
+
+@contextlib.contextmanager
+def fast_viterbi(enabled: bool = True):
+  """with 块内本线程的 pyin 用上面的 Viterbi 内核（结果与 librosa 的完全一致），enabled=False 时用 librosa 自带的。
+
+  librosa.sequence._viterbi 只在有 with 块活跃时换成按线程分派的函数，最后一个块退出时恢复原样；
+  其他线程与块外的代码不受影响。librosa 版本不认识时什么也不做。
+  """
+  global _viterbi_patch_depth
+  if not _viterbi_supported():
+    yield
+    return
+  with _viterbi_patch_lock:
+    if _viterbi_patch_depth == 0:
+      librosa.sequence._viterbi = _viterbi_dispatch
+    _viterbi_patch_depth += 1
+  previous = getattr(_viterbi_state, 'enabled', False)
+  _viterbi_state.enabled = enabled
+  try:
+    yield
+  finally:
+    _viterbi_state.enabled = previous
+    with _viterbi_patch_lock:
+      _viterbi_patch_depth -= 1
+      if _viterbi_patch_depth == 0:
+        librosa.sequence._viterbi = _librosa_viterbi
+
+
+_pyin_warmup: threading.Thread | None = None
+_pyin_warmup_lock = threading.Lock()
+
+
+def _prime_pyin_cache():
+  """用一小段静音跑一次 pyin：触发 librosa 的惰性导入（scipy.stats 等）与 numba 编译/缓存加载，
+  首次真正分析时不再额外付出约 1 秒。"""
+  librosa.pyin(np.zeros(4096, dtype=np.float32), fmin=32, fmax=2000, sr=16000, hop_length=256, center=False)
+
+
+def start_warmup() -> threading.Thread:
+  """在后台线程里跑 _prime_pyin_cache，不阻塞调用方；之后的 pyin 分析会先等它结束。
+  只启动一次，返回该线程。"""
+  global _pyin_warmup
+  with _pyin_warmup_lock:
+    if _pyin_warmup is None:
+      _pyin_warmup = threading.Thread(target=_prime_pyin_cache, name="pyin-warmup")
+      _pyin_warmup.start()
+  return _pyin_warmup
+
+
+# 降采样倍数的上限。降采样并非无损：与全采样率的 pyin 相比，44.1 kHz 的歌曲在 k=8 时有
+# 约 9% 的帧浊音判定不同，k=4 时约 3%，所以默认不降采样（见 _pyin_decimation 的 decimate）
+PYIN_MAX_DECIMATION = 4
+
+
+def _pyin_decimation(sr: float, hop_length: int, decimate: bool = False) -> int:
+  """降采样倍数 k：decimate 为 False 时为 1（与 librosa.pyin 逐帧一致）；否则取能整除 hop_length、
+  不超过 PYIN_MAX_DECIMATION 的最大 2 的幂，且 sr/k 仍不低于 4*fmax。"""
+  k = 1
+  while (decimate and 2 * k <= PYIN_MAX_DECIMATION and hop_length % (2 * k) == 0
+         and PYIN_FRAME_LENGTH % (2 * k) == 0 and sr / (2 * k) >= 4 * PYIN_FMAX):
+    k *= 2
+  return k
+
+
+def _pyin(y: np.ndarray, sr: float, hop_length: int, k: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """跑 pyin，k > 1 时在按 k 倍降采样后的信号上跑（见 _pyin_decimation）。
+
+  fmax 只有 C6≈1047 Hz，远低于原始 Nyquist；pyin 中 YIN 差分函数的代价与帧长（∝ sr）成正比，
+  按整数倍 k 降采样后帧长与 hop 同比缩小，帧时间轴与原始 hop_length 完全对齐，但结果与全采样率略有差别。
+  """
+  if _pyin_warmup is not None:
+    # 预热未完成时等它结束，避免两个线程同时编译同一批 numba 函数
+    _pyin_warmup.join()
+  # 与原始信号上 center=True 的帧数（即 rms 的帧数）一致
+  n_frames = 1 + len(y) // hop_length
+  if k > 1:
+    y = librosa.resample(y, orig_sr=sr, target_sr=sr / k)
+  pitches, voiced_flag, voiced_prob = librosa.pyin(
+      y,
+      fmin=PYIN_FMIN,
+      fmax=PYIN_FMAX,
+      sr=sr / k,
+      frame_length=PYIN_FRAME_LENGTH // k,
+      hop_length=hop_length // k,
+  )
+  # 降采样后长度取整可能使帧数差一，截断或补齐到原始帧数
+  return _fit_frames(pitches, np.nan, n_frames), _fit_frames(voiced_flag, False, n_frames), _fit_frames(voiced_prob, 0.0, n_frames)
+
+
+def _fit_frames(x: np.ndarray, fill, n_frames: int) -> np.ndarray:
+  if len(x) >= n_frames:
+    return x[:n_frames]
+  return np.concatenate([x, np.full(n_frames - len(x), fill, dtype=x.dtype)])
+
+
+# 分块流式分析时每块两侧额外带上的样本数（原始采样率），吸收重采样滤波器在块边缘的过渡
+PYIN_BLOCK_MARGIN = 4096
+
+
+def _pyin_block(seg: np.ndarray, sr: float, hop_length: int, n_frames: int, k: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+  """对一块带上下文的信号跑 pyin 与 rms（center=False），k 同 _pyin。
+
+  seg 的布局为 [PYIN_BLOCK_MARGIN + PYIN_FRAME_LENGTH//2 个上下文 | 块本身 | 同样长的上下文]，
+  第 j 帧以块内第 j*hop_length 个样本为中心，与整段 center=True 分析的帧位置一致。
+  """
+  if _pyin_warmup is not None:
+    _pyin_warmup.join()
+  y = librosa.resample(seg, orig_sr=sr, target_sr=sr / k) if k > 1 else seg
+  pitches, voiced_flag, voiced_prob = librosa.pyin(
+      y[PYIN_BLOCK_MARGIN // k:],
+      fmin=PYIN_FMIN,
+      fmax=PYIN_FMAX,
+      sr=sr / k,
+      frame_length=PYIN_FRAME_LENGTH // k,
+      hop_length=hop_length // k,
+      center=False,
+  )
+  rms = librosa.feature.rms(y=seg[PYIN_BLOCK_MARGIN:], frame_length=PYIN_FRAME_LENGTH, hop_length=hop_length, center=False)[0]
+  return pitches[:n_frames], voiced_flag[:n_frames], voiced_prob[:n_frames], rms[:n_frames]
+
+
+def _stream_pitch_analysis(f: sf.SoundFile, hop_length: int, block_seconds: float, k: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+  """按块读取、逐块分析，不把整首歌解码进内存。块大小为 hop_length 的整数倍，
+  各块之间 pyin 的 Viterbi 平滑相互独立，只在块边界附近与整段分析略有差别。"""
+  sr = f.samplerate
+  n_frames = 1 + f.frames // hop_length
+  block_frames = max(1, int(block_seconds * sr / hop_length))
+  block = block_frames * hop_length
+  context = PYIN_BLOCK_MARGIN + PYIN_FRAME_LENGTH // 2
+  # buf 从块起点前 context 个样本开始；文件头之前与文件尾之后都按 0 处理（同 center=True 的常数填充）
+  buf = np.zeros(context, dtype=np.float32)
+  parts = []
+  for first_frame in range(0, n_frames, block_frames):
+    need = block + 2 * context - len(buf)
+    data = f.read(need, dtype='float32', always_2d=True).mean(axis=1) if need > 0 else np.zeros(0, np.float32)
+    buf = np.concatenate([buf, data, np.zeros(max(0, need - len(data)), dtype=np.float32)])
+    parts.append(_pyin_block(buf[:block + 2 * context], sr, hop_length, min(block_frames, n_frames - first_frame), k))
+    buf = buf[block:]
+  return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def get_file_pitches(audio_path: Path, hop_length: int = 512, block_seconds: float = 30.0, cache: bool = True, decimate: bool = False,
+                     cache_key: str | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]:
+  """
+  直接从音频文件分析音高，返回 (pitches, voiced_flag, voiced_prob, rms, sr)，含义同 get_audio_pitches。
+  用 soundfile 以 block_seconds 为块流式解码并逐块分析，峰值内存与歌曲长度无关；
+  soundfile 读不了的格式退回 librosa.load 整段分析。
+  cache: 结果按文件内容与 hop_length 缓存在音频旁边，命中时不再解码与分析。
+  decimate: 降采样后再跑 pyin（见 _pyin_decimation），更快但与全采样率结果略有差别。
+  cache_key: 代替文件内容作为缓存键，同 get_audio_pitches。
+  """
+  cache_path = Path(audio_path) if cache else None
+  try:
+    f = sf.SoundFile(str(audio_path))
+  except sf.SoundFileRuntimeError:
+    y, sr = load_audio(audio_path)
+    return (*get_audio_pitches(y, sr, hop_length=hop_length, audio_path=cache_path, decimate=decimate,
+                               cache_key=cache_key), sr)
+  with f:
+    sr = f.samplerate
+    k = _pyin_decimation(sr, hop_length, decimate)
+    result = _cached_pitch_analysis(cache_path, hop_length, lambda: _stream_pitch_analysis(f, hop_length, block_seconds, k),
+                                    k=k, cache_key=cache_key)
+  _plot_pitch_analysis(result, sr, hop_length)
+  return (*result, sr)
+
+
+def _cached_pitch_analysis(audio_path: Path | None, hop_length: int, compute, y: np.ndarray | None = None, k: int = 1,
+                           cache_key: str | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+  cache_path = audio_path and _pitch_cache_path(audio_path, hop_length, y, k, cache_key)
+  if cache_path and cache_path.exists():
+    return _load_pitch_analysis(cache_path)
+  pitches, voiced_flag, voiced_prob, rms = compute()
+  # 新算出的结果与缓存读出的结果保持同样的精度，首次运行与之后的运行得到相同的音符
+  pitches, voiced_prob, rms = (np.asarray(x, dtype=np.float32) for x in (pitches, voiced_prob, rms))
+  voiced_flag = np.asarray(voiced_flag, dtype=np.bool_)
+  if cache_path:
+    _remove_stale_pitch_caches(audio_path, hop_length, k)
+    _save_pitch_analysis(pitches, voiced_flag, voiced_prob, rms, cache_path)
+  return pitches, voiced_flag, voiced_prob, rms
 
 
-def get_audio_pitches(y: np.ndarray, sr: int, hop_length: int = 512, audio_path: Path | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+def _remove_stale_pitch_caches(audio_path: Path, hop_length: int, k: int):
+  """清掉同一文件、同一分析参数下、写于音频文件最近一次改动之前的缓存：它们分析的是旧内容。
+
+  键没命中并不说明已有的缓存失效（同一份内容可能以别的键缓存过），所以只看修改时间。
+  摘要固定 16 位十六进制，不会匹配到其他 k 的缓存。
+  """
+  try:
+    source_mtime = audio_path.stat().st_mtime_ns
+  except FileNotFoundError:
+    return
+  for cached in audio_path.parent.glob(f"{_pitch_cache_prefix(audio_path, hop_length, k)}_{'[0-9a-f]' * 16}.npy"):
+    try:
+      if cached.stat().st_mtime_ns < source_mtime:
+        cached.unlink()
+    except FileNotFoundError:
+      pass
+
+
+def _plot_pitch_analysis(result, sr: int, hop_length: int):
+  pitches, voiced_flag, voiced_prob, rms = result
+  plot_y_time(pitches, sr=sr/hop_length, name="音高 (Hz)")
+  plot_y_time(voiced_prob, sr=sr/hop_length, name="音高置信度")
+  plot_y_time(rms, sr=sr/hop_length, name="RMS 能量")
+
+
+def get_audio_pitches(y: np.ndarray, sr: int, hop_length: int = 512, audio_path: Path | None = None, decimate: bool = False,
+                      cache_key: str | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
   """
   返回 (pitches, voiced_flag, voiced_prob, rms, sr, duration)
   pitches: 每帧频率(Hz)或 NaN
@@ -39,66 +414,141 @@ def get_audio_pitches(y: np.ndarray, sr: int, hop_length: int = 512, audio_path:
   rms: 每帧能量（可用作 velocity 来源），与 pitches 对齐
   sr: 采样率
   duration: 音频总时长（秒）
+  audio_path: 给出时按 y 的内容与 hop_length 把结果缓存在该文件旁边
+  decimate: 降采样后再跑 pyin（见 _pyin_decimation），更快但与全采样率结果略有差别
+  cache_key: 代替 y 的内容作为缓存键。同一份人声先在内存里分析、之后又从写出的文件分析时，
+    两边的样本并不逐位相同（如经过 mp3 编码），传入同一个 cache_key 才能命中同一个缓存
   """
-  cache_path = audio_path and audio_path.with_name(audio_path.stem + "_pyin.npz")
-  if cache_path and cache_path.exists():
-    pitches, voiced_flag, voiced_prob, rms = _load_pitch_analysis(cache_path)
-  else:
-    pitches, voiced_flag, voiced_prob = librosa.pyin(
-        y,
-        fmin=librosa.note_to_hz('C2'),  # 最低检测音高
-        fmax=librosa.note_to_hz('C6'),  # 最高检测音高
-        sr=sr,
-        hop_length=hop_length,
-    )
-    # 计算与 frames 对齐的 rms（使用相同 hop_length）
+  k = _pyin_decimation(sr, hop_length, decimate)
+  def compute():
+    pitches, voiced_flag, voiced_prob = _pyin(y, sr, hop_length, k)
+    # 计算与 frames 对齐的 rms（使用原始采样率与相同 hop_length）
     rms = librosa.feature.rms(y=y, hop_length=hop_length).flatten()
-    _save_pitch_analysis(pitches, voiced_flag, voiced_prob, rms, cache_path)
+    return pitches, voiced_flag, voiced_prob, rms
 
-  plot_y_time(pitches, sr=sr/hop_length, name="音高 (Hz)")
-  plot_y_time(voiced_prob, sr=sr/hop_length, name="音高置信度")
-  plot_y_time(rms, sr=sr/hop_length, name="RMS 能量")
+  pitches, voiced_flag, voiced_prob, rms = _cached_pitch_analysis(audio_path, hop_length, compute, y, k, cache_key)
+  _plot_pitch_analysis((pitches, voiced_flag, voiced_prob, rms), sr, hop_length)
   return pitches, voiced_flag, voiced_prob, rms
 
 
 # %%
 
 
-def pitch_to_midi_notes(pitches: np.ndarray, rms: np.ndarray, sr: int, hop_length: int = 512):
+_LOG2_A4 = np.log2(440.0)
+
+
+@numba.njit(cache=True, nogil=True)
+def _segment_notes(key, vel, out_start, out_end, out_note, out_vel):
+  """把逐帧的 midi（-1 为无效帧）切成连续同音高的段，写入预分配的输出数组（长度 >= 帧数）。
+
+  段为帧区间 [out_start, out_end)，velocity 取段内最大值；返回段数。
+  """
+  k = 0
+  cur = -1
+  for i in range(key.shape[0]):
+    note = key[i]
+    if note != cur:
+      if cur != -1:
+        out_end[k] = i
+        k += 1
+      if note != -1:
+        out_start[k] = i
+        out_note[k] = note
+        out_vel[k] = vel[i]
+      cur = note
+    elif note != -1 and vel[i] > out_vel[k]:
+      out_vel[k] = vel[i]
+  if cur != -1:
+    out_end[k] = key.shape[0]
+    k += 1
+  return k
+
+
+def pitch_to_midi_notes(pitches: np.ndarray, rms: np.ndarray, sr: int, hop_length: int = 512,
+                        merge: bool = False, scratch: dict | None = None) -> list[tuple[float, float, int, int]]:
   """
   将帧级别的频率数组转换为带持续时间和 velocity 的 MIDI 音符列表。
   返回列表项为 (start_time, end_time, midi_note, velocity)
 
+  merge=True 时把连续、音高相同的有声帧合并为一个音符（velocity 取段内最大值），
+  默认每帧一个 note。
+  scratch: 逐帧中间数组的缓冲区，多次调用传同一个 dict 即可复用（见 _scratch_array）
   """
-  notes: list[tuple[float, float, int, int]] = []
-  times = librosa.times_like(pitches, sr=sr, hop_length=hop_length)
+  scratch = {} if scratch is None else scratch
+  n = min(len(pitches), len(rms))
   frame_duration = hop_length / sr
 
-  for t, pitch, r in zip(times, pitches, rms):
-    if np.isnan(pitch):
-      continue
-
-    midi_note = int(round(librosa.hz_to_midi(pitch)))
-    if not (21 <= midi_note <= 108):
-      continue
-
-    # 以 rms 作为 velocity 的估计（映射到 1-127）
-    # 先使用 r / rms_scale 再裁剪到 [0,1]
-    try:
-      r_val = 0.0 if r is None or np.isnan(r) else float(r)
-    except Exception:
-      r_val = 0.0
-    normalized = float(r_val)
-    normalized = np.clip(normalized, 0.0, 1.0)
-    vel = int(np.clip(round(normalized * 127), 1, 127))
-
-    start = t
-    end = t + frame_duration
-
-    # 不合并相邻帧，直接作为单独的 note 记录（每帧一个 note）
-    notes.append((start, end, midi_note, vel))
-
-  return notes
+  # 整段一次换算：hz -> midi 并取整，NaN（无声帧）与超出钢琴音域 (21..108) 的帧剔除。
+  # 不用 np.searchsorted 查边界表：pyin 的频率落在 0.1 半音的网格上，大量帧恰好位于
+  # 两个音的分界处，只有与 librosa.hz_to_midi 相同的算式才能得到一致的取整；
+  # 而且对无序数据，二分查找比向量化的 log2 还慢约 10 倍
+  midi = _scratch_array(scratch, 'midi', n, np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    np.log2(np.asarray(pitches)[:n], out=midi, dtype=np.float64)
+  midi -= _LOG2_A4
+  midi *= 12
+  midi += 69
+  np.round(midi, out=midi)
+  valid = np.isfinite(midi) & (midi >= 21) & (midi <= 108)
+  idx = np.flatnonzero(valid)
+
+  # 以 rms 作为 velocity 的估计（裁剪到 [0,1] 后映射到 1-127），NaN 视为 0；
+  # 只取有效帧，一次性处理 NaN，不再逐帧判断
+  r = np.nan_to_num(np.asarray(rms)[idx], nan=0.0)
+  vel = np.clip(np.round(np.clip(r, 0.0, 1.0) * 127), 1, 127).astype(np.int64)
+
+  if merge:
+    # 游程编码：无效帧记为 -1，逐帧扫描一次切出音高不变的段
+    key = _scratch_array(scratch, 'key', n, np.int64)
+    key.fill(-1)
+    key[idx] = midi[idx]
+    frame_vel = _scratch_array(scratch, 'frame_vel', n, np.int64)
+    frame_vel.fill(0)
+    frame_vel[idx] = vel
+    seg_start, seg_end, seg_note, seg_vel = _scratch_array(scratch, 'segments', (4, n), np.int64)
+    k = _segment_notes(key, frame_vel, seg_start, seg_end, seg_note, seg_vel)
+    return list(zip((seg_start[:k] * hop_length / sr).tolist(),
+                    ((seg_end[:k] - 1) * hop_length / sr + frame_duration).tolist(),
+                    seg_note[:k].tolist(), seg_vel[:k].tolist()))
+
+  starts = idx * hop_length / sr
+  # 不合并相邻帧，直接作为单独的 note 记录（每帧一个 note）
+  return list(zip(starts.tolist(), (starts + frame_duration).tolist(),
+                  midi[idx].astype(np.int64).tolist(), vel.tolist()))
+
+
+@numba.njit(cache=True, nogil=True)
+def _write_variable_int(out, k, value):
+  """MIDI 变长整数（每字节 7 位，高位在前，除最后一字节外最高位置 1），写在 out[k:]，返回新的 k。"""
+  n = 1
+  v = value >> 7
+  while v:
+    n += 1
+    v >>= 7
+  for b in range(n - 1, -1, -1):
+    out[k] = ((value >> (7 * b)) & 0x7f) | (0x80 if b else 0)
+    k += 1
+  return k
+
+
+@numba.njit(cache=True, nogil=True)
+def _encode_note_events(note, velocity, on_ticks, off_ticks, out):
+  """把每个音符编码成 [delta, 0x90, note, vel] [delta, 0x80, note, vel] 写入 out，返回字节数。
+
+  note_on/note_off 交替出现，状态字节每次都与上一条不同，mido 写文件时也不会用到 running status。
+  """
+  k = 0
+  for i in range(note.shape[0]):
+    k = _write_variable_int(out, k, on_ticks[i])
+    out[k] = 0x90
+    out[k + 1] = note[i]
+    out[k + 2] = velocity[i]
+    k = _write_variable_int(out, k + 3, off_ticks[i])
+    out[k] = 0x80
+    out[k + 1] = note[i]
+    out[k + 2] = velocity[i]
+    k += 3
+  return k
 
 
 def notes_to_midi(notes: list[tuple[float, float, int, int]], output_path: Path, tempo=500000):
@@ -106,62 +556,87 @@ def notes_to_midi(notes: list[tuple[float, float, int, int]], output_path: Path,
 
   notes 项可为 (start, end, note) 或 (start, end, note, velocity)
   """
+  # 文件格式与 mido.MidiFile().save 完全相同（type 1、单轨、480 tick/拍），
+  # 只是音符事件不再逐条构造、校验 mido.Message（一首歌上万条，占了约 95% 的时间），而是整段编码成字节
   mid = MidiFile()
-  track = MidiTrack()
-  mid.tracks.append(track)
+  # 设置速度 (微秒/拍)，0 = 钢琴音色
+  head = [mido.MetaMessage('set_tempo', tempo=tempo), Message('program_change', program=0, time=0)]
+  track = bytearray(b''.join(b'\x00' + bytes(msg.bytes()) for msg in head))
 
-  # 设置速度 (微秒/拍)
-  track.append(mido.MetaMessage('set_tempo', tempo=tempo))
-  track.append(Message('program_change', program=0, time=0))  # 0 = 钢琴音色
-
-  prev_time = 0.0
-  for item in notes:
+  if notes:
     # 支持两种格式: (start,end,note) 或 (start,end,note,velocity)
-    if len(item) == 3:
-      start, end, note = item
-      velocity = 64
-    else:
-      start, end, note, velocity = item
+    starts = np.array([item[0] for item in notes], dtype=np.float64)
+    ends = np.array([item[1] for item in notes], dtype=np.float64)
+    pitches = np.array([item[2] for item in notes], dtype=np.int64)
+    velocities = np.array([item[3] if len(item) > 3 else 64 for item in notes], dtype=np.int64)
+    if pitches.min() < 0 or pitches.max() > 127 or velocities.min() < 0 or velocities.max() > 127:
+      raise ValueError('note and velocity must be in range 0..127')
+
+    # 一次算出所有 delta tick（与 mido.second2tick 相同的取整方式）
+    scale = tempo * 1e-6 / mid.ticks_per_beat  # 秒/tick
+    # note_on: 距上一个音符结束的时间
+    prev_ends = np.concatenate(([0.0], ends[:-1]))
+    on_ticks = np.round(np.maximum(0.0, starts - prev_ends) / scale).astype(np.int64)
+    # note_off: 音符时长，至少 1 tick 保证可闻
+    off_ticks = np.maximum(np.round(np.maximum(0.0, ends - starts) / scale).astype(np.int64), 1)
+
+    # 每个事件最多 10 字节的变长 delta（int64）加 3 字节消息
+    events = np.empty(len(notes) * 2 * 13, dtype=np.uint8)
+    n = _encode_note_events(pitches, velocities, on_ticks, off_ticks, events)
+    track += events[:n].tobytes()
+
+  track += b'\x00' + bytes(mido.MetaMessage('end_of_track').bytes())
+  with open(output_path, 'wb') as f:
+    f.write(b'MThd' + struct.pack('>Ihhh', 6, mid.type, 1, mid.ticks_per_beat))
+    f.write(b'MTrk' + struct.pack('>I', len(track)) + track)
+  return output_path
+
+def mp3_to_midi(audio_path: Path) -> Path:
+  with fast_viterbi():
+    pitches, _, _, rms, sr = get_file_pitches(audio_path)
+  notes = pitch_to_midi_notes(pitches, rms, sr)
+  midi_path = audio_path.with_suffix('.mid')
+  return notes_to_midi(notes, midi_path)
 
-    # delta from previous event to this note_on (in seconds)
-    delta = max(0.0, start - prev_time)
-    ticks = int(mido.second2tick(delta, mid.ticks_per_beat, tempo))
 
-    # note_on
-    track.append(Message('note_on', note=int(note), velocity=int(velocity), time=ticks))
+def limit_worker_threads(n: int = 1):
+  """进程池的 initializer：本进程的 BLAS/OpenMP、numba（以及已导入的 torch）各用 n 个线程，
+  图表用不弹窗口的 Agg 后端。
 
-    # note_off after duration
-    duration = max(0.0, end - start)
-    off_ticks = int(mido.second2tick(duration, mid.ticks_per_beat, tempo))
-    # ensure at least 1 tick for audible note
-    if off_ticks <= 0:
-      off_ticks = 1
-    track.append(Message('note_off', note=int(note), velocity=int(velocity), time=off_ticks))
+  工作进程本身就是并行度，避免 进程数 × 线程数 的超额订阅；只作用于调用它的进程，不改父进程的环境变量。
+  """
+  import matplotlib
+  import scipy.linalg  # noqa: F401  先载入 scipy 自带的 BLAS，下面的限制才管得到它
+  from threadpoolctl import threadpool_limits
+  threadpool_limits(limits=n)
+  numba.set_num_threads(n)
+  if 'torch' in sys.modules:
+    sys.modules['torch'].set_num_threads(n)
+  matplotlib.use('Agg')
 
-    prev_time = end
 
-  mid.save(output_path)
-  return output_path
+def batch_mp3_to_midi(paths: list[Path], max_workers: int | None = None) -> list[Path]:
+  """多进程批量转换（pyin 大部分时间持有 GIL，线程无法并行），返回各自的 MIDI 路径。
 
-def mp3_to_midi(audio_path: Path):
-  y, sr = librosa.load(str(audio_path), sr=None)
-  pitches, _, _, rms = get_audio_pitches(y, sr, name=audio_path.name)
-  notes = pitch_to_midi_notes(pitches, rms, sr)
-  midi_path = audio_path.with_suffix('.mid')
-  notes_to_midi(notes, midi_path)
+  已有 pyin 缓存（_pyin_h*.npy）的文件几乎不耗时。
+  """
+  ctx = multiprocessing.get_context('spawn')
+  with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx, initializer=limit_worker_threads) as executor:
+    return list(executor.map(mp3_to_midi, paths))
 
 if __name__ == "__main__":
   workspace_dir = Path(__file__).parent.parent
   audio_base_name = "我的一个道姑朋友"
   audio_vocals_path = workspace_dir / f"res/{audio_base_name}_vocals.mp3"
   # Demo/testing code when run as script
-  y, sr = librosa.load(str(audio_vocals_path), sr=None)
+  y, sr = load_audio(audio_vocals_path)
   print(f"音频加载完成 - 采样率: {sr} Hz, 时长: {librosa.get_duration(y=y, sr=sr):.2f} 秒")
 
   plot_y_time(y, sr=sr, name=audio_vocals_path.name)
 
   # Get audio info for demo
-  pitches, voiced_flag, voiced_prob, rms = get_audio_pitches(y, sr, audio_path=audio_vocals_path)
+  with fast_viterbi():
+    pitches, voiced_flag, voiced_prob, rms = get_audio_pitches(y, sr, audio_path=audio_vocals_path)
   hop_length = 512
 
   show_pitch(pitches, sr=sr/hop_length)
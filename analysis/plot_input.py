@@ -3,8 +3,9 @@ from pathlib import Path
 workspace_dir = Path(__file__).parent.parent
 
 import sounddevice as sd
+import numba
 import numpy as np
-import queue
+import scipy.signal
 import threading
 
 
@@ -37,40 +38,68 @@ RATE = 44100
 CHANNELS = 1
 CHUNK = 4096
 BUFFER_MILLISECONDS = 10000
+DEBUG = False  # 打印缓冲区统计（describe_np 每次都要对整段数据做多次归约）
 
 class AudioStream:
+  """麦克风输入的单生产者/单消费者环形缓冲。
+
+  音频回调（生产者）直接把样本写进预分配的 _raw，写完后再推进 total_samples；
+  读取方先取 total_samples 快照再按模运算拷出最近的样本。没有队列、没有锁，
+  回调里只有一次 memcpy。_raw 为可读窗口的两倍长，读取方拷贝期间回调还能
+  写入 buffer_len 个样本而不覆盖正在读的数据。
+
+  _raw 按 (样本, 声道) 存放，与 sounddevice 给出的 indata 布局一致，回调追加的是
+  一整段连续内存；对外接口仍返回 (channels, n)，是拷贝结果的转置视图。
+  """
   def __init__(self, samplerate=RATE, channels=CHANNELS, buffer_milliseconds=BUFFER_MILLISECONDS, downsample=1, blocksize=CHUNK):
     self.buffer_len = int(samplerate * buffer_milliseconds / (1000 * downsample))
-    self.ring_buffer_lock = threading.Lock()
-    self._ring_buffer = np.zeros((channels, self.buffer_len), dtype='float32')
+    self._raw_len = 2 * self.buffer_len
+    self._raw = np.zeros((self._raw_len, channels), dtype='float32')
+    # 累计写入的样本数，即缓冲末尾的绝对样本位置；只由回调线程写（int 赋值在 GIL 下是原子的）
+    self.total_samples = 0
     self.samplerate = samplerate
     self.channels = channels
     self.blocksize = blocksize
     self.downsample = downsample
-    self.q = queue.Queue()
 
-  def _sync_ring_buffer(self):
-    # print("sync_ring_buffer", self.q.qsize(), self.q.empty())
-    assert self.ring_buffer_lock.locked()
-    all_data = []
-    while not self.q.empty():
-      try:
-        data = self.q.get_nowait() # type: np.ndarray
-        all_data.append(data)
-      except queue.Empty:
-        break
-    if not all_data: return
-    data = np.concatenate(all_data, axis=1)
-    shift = data.shape[1]
-    # print("sync_ring_buffer", self.q.qsize(), len(all_data), data.shape, self._ring_buffer.shape)
-    # print("sync_ring_buffer got data:", describe_np(data), "shift:", shift)
-    if shift >= self.buffer_len:
-      # assert False, "Unexpected large shift"
-      self._ring_buffer = data[:, -self.buffer_len:]
+  def _write(self, data: np.ndarray):
+    """生产者：写入 (n, channels) 的新样本，跨越末尾时分两段写。"""
+    shift = data.shape[0]
+    if shift > self._raw_len:
+      data = data[-self._raw_len:]
+    n = data.shape[0]
+    # 被截掉的旧样本也计入位置
+    w = (self.total_samples + shift - n) % self._raw_len
+    first = self._raw_len - w
+    if n <= first:
+      self._raw[w:w + n] = data
     else:
-      new_ring = np.roll(self._ring_buffer, -shift, axis=1)
-      new_ring[:, -shift:] = data
-      self._ring_buffer = new_ring
+      self._raw[w:] = data[:first]
+      self._raw[:n - first] = data[first:]
+    # 数据写完后才发布新位置
+    self.total_samples += shift
+
+  def _write_downsampled(self, indata: np.ndarray):
+    """生产者：把原始采样率的 (frames, channels) 块平均降采样后直接写进 _raw。"""
+    m = _write_ring_downsampled(self._raw, self.total_samples, indata, self.downsample)
+    self.total_samples += m
+
+  def _latest(self, num_samples: int, copy: bool = True) -> tuple[np.ndarray, int]:
+    """消费者：按时间顺序取出最近 num_samples 个样本 (channels, num_samples)，以及其末尾的绝对样本位置。
+
+    copy=False 时，不跨越 _raw 末尾的窗口直接返回只读视图（跨越时仍需拼接拷贝）。视图在生产者
+    再写入 _raw_len - num_samples 个样本之前保持有效，只适合立即消费的调用方。
+    """
+    end = self.total_samples
+    w = end % self._raw_len
+    start = w - num_samples
+    if start >= 0:
+      view = self._raw[start:w]
+      if copy:
+        return view.copy().T, end
+      view.flags.writeable = False
+      return view.T, end
+    return np.concatenate((self._raw[start:], self._raw[:w])).T, end
 
   @property
   def sr(self):
@@ -78,17 +107,20 @@ class AudioStream:
 
   @property
   def ring_buffer(self):
-    with self.ring_buffer_lock:
-      self._sync_ring_buffer()
-      return self._ring_buffer
+    return self._latest(self.buffer_len)[0]
 
   def get_buffer(self, duration_ms: int) -> np.ndarray:
     """Get the most recent audio buffer of specified duration in milliseconds."""
-    with self.ring_buffer_lock:
-      self._sync_ring_buffer()
-      num_samples = int(self.samplerate * duration_ms / (1000 * self.downsample))
-      num_samples = min(num_samples, self._ring_buffer.shape[1])
-      return self._ring_buffer[:, -num_samples:]
+    return self.get_latest(duration_ms)[0]
+
+  def get_latest(self, duration_ms: int, copy: bool = True) -> tuple[np.ndarray, int]:
+    """Like get_buffer, also returning the absolute sample position of the buffer's end.
+
+    With copy=False the result may be a read-only view into the ring (see _latest).
+    """
+    num_samples = int(self.samplerate * duration_ms / (1000 * self.downsample))
+    num_samples = min(num_samples, self.buffer_len)
+    return self._latest(num_samples, copy=copy)
 
   def __enter__(self):
     # https://python-sounddevice.readthedocs.io/en/0.5.1/examples.html#plot-microphone-signal-s-in-real-time
@@ -96,18 +128,14 @@ class AudioStream:
       # print("callback", indata.shape, describe_np(indata))
       if status:
         print('Audio status:', status)
-      data = indata[::self.downsample, :].T.copy()
-      try:
-        self.q.put_nowait(data)
-        return
-      except Exception as e:
-        pass
-      # queue full, drop oldest
-      try:
-        self.q.get_nowait()
-        self.q.put_nowait(data)
-      except Exception as e:
-        pass
+      if self.downsample > 1:
+        self._write_downsampled(indata)
+      else:
+        self._write(indata)
+    # 先用同类型的数据触发一次编译（或加载磁盘缓存），免得第一个真实回调付出 JIT 开销
+    if self.downsample > 1:
+      _write_ring_downsampled(np.zeros((1, self.channels), np.float32), 0,
+                              np.zeros((self.downsample, self.channels), np.float32), self.downsample)
     self.stream = sd.InputStream(samplerate=self.samplerate, channels=self.channels, dtype='float32', blocksize=self.blocksize, callback=audio_callback)
     self.stream.__enter__()
     return self
@@ -116,19 +144,136 @@ class AudioStream:
     self.stream.__exit__(exc_type, exc_value, traceback)
 
 
+@numba.njit(cache=True, nogil=True)
+def _write_ring_downsampled(raw, total, indata, downsample):
+  """块平均降采样并写入环形缓冲 raw (raw_len, channels)，从绝对位置 total 开始，返回写入的样本数。
+
+  块平均相当于一个 boxcar 低通再抽取，比直接 [::downsample] 少了混叠；块尾不足 downsample
+  的样本丢弃（blocksize 通常是其整数倍）。平均与跨越末尾的写入在同一个循环里完成，
+  不产生中间数组，执行期间释放 GIL。
+  """
+  raw_len = raw.shape[0]
+  m = indata.shape[0] // downsample
+  skip = max(m - raw_len, 0)  # 超过一整圈的样本会被随后的样本覆盖，直接跳过
+  w = (total + skip) % raw_len
+  for i in range(skip, m):
+    for c in range(indata.shape[1]):
+      acc = np.float32(0.0)
+      for j in range(i * downsample, (i + 1) * downsample):
+        acc += indata[j, c]
+      raw[w, c] = acc / np.float32(downsample)
+    w += 1
+    if w == raw_len:
+      w = 0
+  return m
+
+
 def describe_np(array: np.ndarray) -> str:
   return f"shape: {array.shape}, dtype: {array.dtype}, min: {np.min(array)}, max: {np.max(array)}, mean: {np.mean(array):.4f}, std: {np.std(array):.4f}"
 
+# %%
+AMIN = 1e-10  # 与 librosa.power_to_db 的默认 amin 相同
+TOP_DB = 80.0  # to_db 的动态范围，结果落在 [-TOP_DB, 0]
+
+class StreamingMel:
+  """增量 mel 频谱：只对新到达的样本计算 STFT 帧，已算好的列左移复用。
+
+  帧按绝对样本位置对齐（第 j 帧覆盖 [j*hop_length, j*hop_length+n_fft)，center=False），
+  同一帧无论何时计算结果都相同。S 的形状为 (channels, n_mels, n_frames)，
+  n_frames 取 (n_samples - n_fft) // hop_length，保证窗口内的所有帧都落在 buffer 里。
+  """
+  def __init__(self, sr, n_samples, channels, n_mels=64, fmax=8000, n_fft=2048, hop_length=512):
+    self.n_samples = n_samples
+    self.n_fft = n_fft
+    self.hop_length = hop_length
+    # 滤波器组与窗函数只生成一次，每次刷新不再重新推导
+    self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmax=fmax, dtype=np.float32)
+    self.window = scipy.signal.get_window('hann', n_fft).astype(np.float32)
+    # 三角滤波器大部分为 0，记下每个 mel 带非零频点的范围 [lo, hi)，融合核只累加这一段
+    nonzero = self.mel_basis != 0
+    has_any = nonzero.any(axis=1)
+    self.band_lo = np.where(has_any, nonzero.argmax(axis=1), 0)
+    self.band_hi = np.where(has_any, nonzero.shape[1] - nonzero[:, ::-1].argmax(axis=1), 0)
+    self.n_frames = max((n_samples - n_fft) // hop_length, 1)
+    self.S = np.zeros((channels, n_mels, self.n_frames), dtype=np.float32)
+    # 每列的 10*log10(max(S, AMIN))，与 S 同步左移，只为新列计算对数
+    self.log_S = np.full_like(self.S, 10 * np.log10(AMIN))
+    self._last_frame = None  # S 最右一列对应的绝对帧号
+
+  def update(self, buffer: np.ndarray, end: int) -> np.ndarray:
+    """buffer: 最近 n_samples 个样本 (channels, n_samples)；end: buffer 末尾的绝对样本位置。"""
+    assert buffer.shape[1] == self.n_samples
+    last = (end - self.n_fft) // self.hop_length  # 最后一个完整帧
+    k = self.n_frames if self._last_frame is None else min(last - self._last_frame, self.n_frames)
+    if k <= 0:
+      return self.S
+    # 新帧 last-k+1 .. last 在 buffer 中的起点
+    offset = (last - k + 1) * self.hop_length - (end - self.n_samples)
+    seg = buffer[:, offset:offset + (k - 1) * self.hop_length + self.n_fft]
+    # (channels, k, n_fft)：每帧连续存放，rfft 与后面的融合核都沿最后一维顺序访问
+    frames = librosa.util.frame(seg, frame_length=self.n_fft, hop_length=self.hop_length, axis=-1).swapaxes(-1, -2)
+    spec = np.fft.rfft(frames * self.window, axis=-1)
+    power = np.square(spec.real) + np.square(spec.imag)
+    if k < self.n_frames:
+      self.S[..., :-k] = self.S[..., k:]
+      self.log_S[..., :-k] = self.log_S[..., k:]
+    _mel_log_power(power, self.mel_basis, self.band_lo, self.band_hi, self.S[..., -k:], self.log_S[..., -k:])
+    self._last_frame = last
+    return self.S
+
+  def to_db(self, top_db: float = TOP_DB, out: np.ndarray | None = None) -> np.ndarray:
+    """等价于 librosa.power_to_db(S, ref=np.max, top_db=top_db)，但复用已缓存的对数列。
+
+    结果原地计算，只分配（或写入 out）一个与 S 同形的数组。
+    """
+    log_S = self.log_S
+    out = np.subtract(log_S, log_S.max(), out=out)
+    return np.maximum(out, -top_db, out=out)
+
+
+@numba.njit(cache=True)
+def _mel_log_power(power, mel_basis, band_lo, band_hi, out_S, out_log_S):
+  """mel 投影与取对数融合为一次遍历：out_S = mel_basis @ power，out_log_S = 10*log10(max(out_S, AMIN))。
+
+  power: (channels, k, n_fft//2+1)；mel_basis: (n_mels, n_fft//2+1)，第 m 行只在 [band_lo[m], band_hi[m]) 非零；
+  输出: (channels, n_mels, k)。
+  """
+  for c in range(power.shape[0]):
+    for t in range(power.shape[1]):
+      for m in range(mel_basis.shape[0]):
+        acc = np.float32(0.0)
+        for f in range(band_lo[m], band_hi[m]):
+          acc += mel_basis[m, f] * power[c, t, f]
+        out_S[c, m, t] = acc
+        out_log_S[c, m, t] = 10 * np.log10(max(acc, AMIN))
+
 # %%
 import time
+from fractions import Fraction
+
+POLY_MAX_RATE = 100  # 多相重采样允许的最大 max(up, down)
+# 实时预览的 STFT 参数：n_fft 取 1024 而不是 librosa 默认的 2048，帧数（图像列数）不变，
+# 每帧的 FFT 与 mel 投影约减半；44.1kHz 下 64 个 mel 带仍然没有空滤波器
+PREVIEW_N_FFT = 1024
+PREVIEW_HOP_LENGTH = 512
+
 class AudioStreamInfo:
-  def __init__(self, stream: AudioStream, duration_ms=5000, resample=882, n_mels=64, max_freq=8000):
+  """波形每次 update 都刷新；mel 频谱变化慢，最多每 feature_interval 秒重算一次。"""
+  def __init__(self, stream: AudioStream, duration_ms=5000, resample=882, n_mels=64, max_freq=8000, feature_interval=0.5,
+               n_fft=PREVIEW_N_FFT, hop_length=PREVIEW_HOP_LENGTH):
     self.stream = stream
     self.duration_ms = duration_ms
     self.resample = resample
     self.n_mels = n_mels
     self.max_freq = max_freq
+    self.n_fft = n_fft
+    self.hop_length = hop_length
+    self.feature_interval = feature_interval
     self.last_update = 0
+    self._last_features = -np.inf  # 上次重算 mel 的 time.monotonic()
+    self._mel = None # type: StreamingMel | None
+    self._mel_key = None  # 生成 _mel 时的 (sr, n_samples, channels, n_mels, max_freq, n_fft, hop_length)
+    self._fir_key = None  # 生成 _fir 时的 (sr, resample)
     self.update()
 
   def _update(self):
@@ -138,17 +283,67 @@ class AudioStreamInfo:
   def update(self):
     # print("update info at time:", time.time(), self.last_update)
     sr = self.stream.sr
-    self._buffer = self.stream.get_buffer(self.duration_ms)
+    # buffer 只在本次 update 内被读取（重采样、mel 都生成新数组），可以直接用环形缓冲的视图
+    buffer, end = self.stream.get_latest(self.duration_ms, copy=False)
 
     if self.resample:
-      self._y = librosa.resample(self._buffer, orig_sr=sr, target_sr=self.resample, axis=1)
+      poly = self._resampler(sr)
+      if poly is not None:
+        up, down, fir = poly
+        y = scipy.signal.resample_poly(buffer, up, down, axis=1, window=fir)
+      else:
+        y = librosa.resample(buffer, orig_sr=sr, target_sr=self.resample, axis=1)
     else:
-      self._y = None
-
-    self._S = librosa.feature.melspectrogram(y=self._buffer, sr=sr, n_mels=self.n_mels, fmax=self.max_freq)
-    self._S_dB = librosa.power_to_db(self._S, ref=np.max)
+      y = buffer
+
+    # 滤波器组只在参数变化时重建，其余时候沿用已缓存的 StreamingMel
+    key = (sr, buffer.shape[1], buffer.shape[0], self.n_mels, self.max_freq, self.n_fft, self.hop_length)
+    now = time.monotonic()
+    if key != self._mel_key or now - self._last_features >= self.feature_interval:
+      if key != self._mel_key:
+        self._mel = StreamingMel(sr, buffer.shape[1], buffer.shape[0], n_mels=self.n_mels, fmax=self.max_freq,
+                                 n_fft=self.n_fft, hop_length=self.hop_length)
+        self._mel_key = key
+      S = self._mel.update(buffer, end).mean(0)
+      # to_db 每次返回新数组（快照与 UI 线程共享，不能原地复用），单声道时直接取视图，省去求平均的拷贝
+      S_dB = self._mel.to_db()
+      S_dB = S_dB[0] if S_dB.shape[0] == 1 else S_dB.mean(0)
+      self._last_features = now
+    else:
+      # 沿用上次的频谱（同一个数组对象，Plotting 据此判断是否需要重绘）
+      _, _, S, S_dB = self._snapshot
+    # 一次性发布（引用赋值是原子的）：后台线程刷新时，UI 线程读到的 y 与 S_dB 总来自同一次 update
+    self._snapshot = (buffer, y, S, S_dB)
     self.last_update = time.time()
 
+  def _resampler(self, sr):
+    """多相重采样的 (up, down, fir)。比例与抗混叠滤波器只在 sr/resample 变化时重新设计。
+
+    只用于比例简单的情况（如 44100→882 = 1/50）；像 48000→882 = 147/8000 这样的比例
+    滤波器过长，反而比 soxr 慢，返回 None 交给 librosa.resample。
+    """
+    key = (sr, self.resample)
+    if key != self._fir_key:
+      self._fir = None
+      if float(sr).is_integer():
+        ratio = Fraction(int(self.resample), int(sr))
+        up, down = ratio.numerator, ratio.denominator
+        max_rate = max(up, down)
+        if max_rate <= POLY_MAX_RATE:
+          # 与 resample_poly 默认设计相同：截止 1/max_rate，kaiser(5.0) 窗，半长 10*max_rate
+          fir = scipy.signal.firwin(20 * max_rate + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+          self._fir = (up, down, fir)
+      self._fir_key = key
+    return self._fir
+
+  def snapshot(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(buffer, y, S, S_dB)，S/S_dB 已对声道取平均。
+
+    buffer（以及 resample=None 时的 y）可能是环形缓冲的只读视图，长期保存前先 copy()。
+    """
+    self._update()
+    return self._snapshot
+
   @property
   def sr(self):
     return self.stream.sr
@@ -159,37 +354,31 @@ class AudioStreamInfo:
 
   @property
   def buffer(self):
-    return self._update() or self._buffer
+    return self.snapshot()[0]
 
   @property
   def y(self):
-    return self._update() or (self._y if self._y is not None else self._buffer)
+    return self.snapshot()[1]
 
   @property
   def S(self):
-    return self._update() or self._S.mean(0)
+    return self.snapshot()[2]
 
   @property
   def S_dB(self):
-    return self._update() or self._S_dB.mean(0)
+    return self.snapshot()[3]
 
 # %%
 
 import matplotlib
 # matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 from matplotlib.axes import Axes
-plt.rcParams['font.sans-serif'] = [
-  'SimHei',            # common on many systems
-  'PingFang SC',       # macOS modern Chinese font
-  'Heiti SC',
-  'Noto Sans CJK SC',  # Google Noto CJK
-  'Arial Unicode MS',
-  'DejaVu Sans'
-]
-plt.rcParams['font.family'] = 'sans-serif'
-plt.rcParams['axes.unicode_minus'] = False
+try:
+  from plottings import setup_fonts
+except ImportError:
+  from .plottings import setup_fonts
+setup_fonts()
 
 # lazy import to avoid hard dependency at module import time
 import librosa
@@ -202,9 +391,14 @@ class Plotting:
     fig, axes = plt.subplots(2, 1)
     self.figure = fig
     self.axes = axes # type: Axes
-    self.lines = Plotting.plot_line(axes[0], self.stream.y, sr=stream.y_sr)
+    # 初始图像同样取自一次快照
+    _, y, _, S_dB = self.stream.snapshot()
+    self.lines = Plotting.plot_line(axes[0], y, sr=stream.y_sr)
+    # Line2D 自己持有的 y 数组；刷新时原地写入，避免 set_ydata 每帧整段拷贝一次
+    self._line_y = [line.get_ydata(orig=True) for line in self.lines]
     # Mel spectrogram image artist (initialize with current buffer)
-    self.mel_im = Plotting.plot_mel(axes[1], self.stream.S_dB, sr=stream.sr)
+    self.mel_im = Plotting.plot_mel(axes[1], S_dB, sr=stream.sr)
+    self._shown_S_dB = S_dB  # 上次画到 mel_im 上的数组
     self.figure.tight_layout(pad=0)
 
   @staticmethod
@@ -224,24 +418,25 @@ class Plotting:
     Returns the AxesImage so it can be updated later via set_data.
     """
     # display with imshow for easy updates
-    img = ax.imshow(S_dB, aspect='auto', origin='lower', interpolation='nearest')
+    # 以最大值为参考的 dB 固定在 [-TOP_DB, 0]，色标定死，刷新时无需 set_clim
+    img = ax.imshow(S_dB, aspect='auto', origin='lower', interpolation='nearest', vmin=-TOP_DB, vmax=0)
     ax.set_ylabel('Mel bin')
     ax.set_xlabel('Frame')
     ax.set_title('Mel Spectrogram')
     return img
 
-  def update_line(self):
-    for (line, data) in zip(self.lines, self.stream.y):
-      line.set_ydata(data[-len(line.get_ydata()):])
+  def update_line(self, data: np.ndarray):
+    for (line, y, data) in zip(self.lines, self._line_y, data):
+      np.copyto(y, data[-len(y):])
+      line.recache_always()
+      line.stale = True
     return self.lines
 
-  def update_mel(self):
-    S_dB = self.stream.S_dB
+  def update_mel(self, S_dB: np.ndarray):
 
-    # update the image data and rescale color limits
+    # update the image data
     try:
       self.mel_im.set_data(S_dB)
-      self.mel_im.set_clim(vmin=S_dB.min(), vmax=S_dB.max())
     except Exception:
       # If the image artist was not created for any reason, recreate it on the axes
       ax = self.axes[1] # type: Axes
@@ -250,14 +445,74 @@ class Plotting:
     return [self.mel_im]
 
   def update_plot(self, frames):
-    # self.stream.update()
-    # print("update_plot", describe_np(self.stream.buffer))
+    # 每帧只取一次快照，波形与频谱来自同一次 update
+    _, y, _, S_dB = self.stream.snapshot()
+    if DEBUG:
+      print("update_plot", describe_np(y))
     artists = []
-    artists.extend(self.update_line())
-    artists.extend(self.update_mel())
+    artists.extend(self.update_line(y))
+    # 频谱没有重算时不返回 mel_im，blit 只重绘波形所在的坐标轴
+    if S_dB is not self._shown_S_dB:
+      artists.extend(self.update_mel(S_dB))
+      self._shown_S_dB = S_dB
     # return artists for blitting: lines and mel image
     return artists
 
+class BlitManager:
+  """按坐标轴 blit：只恢复并重绘有 artist 变化的坐标轴。
+
+  代替 FuncAnimation(blit=True)，省去动画层每帧的事件处理与 artist 记账。
+  背景在每次完整重绘（draw_event，包括窗口缩放）后重新截取。
+  """
+  def __init__(self, canvas, animated_artists=()):
+    self.canvas = canvas
+    self._artists = []
+    self._backgrounds = {}  # Axes -> copy_from_bbox 截取的背景
+    for artist in animated_artists:
+      self.add_artist(artist)
+    self._cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+  def add_artist(self, artist):
+    artist.set_animated(True)
+    self._artists.append(artist)
+
+  def on_draw(self, event):
+    # 完整重绘不包含 animated artist，此时的画面即干净的背景
+    self._backgrounds = {ax: self.canvas.copy_from_bbox(ax.bbox) for ax in {a.axes for a in self._artists}}
+    for artist in self._artists:
+      artist.axes.draw_artist(artist)
+
+  def update(self, changed):
+    """changed: 本帧更新过的 artist（Plotting.update_plot 的返回值）。"""
+    if not self._backgrounds:
+      return  # 窗口尚未完成第一次绘制
+    for artist in changed:
+      if artist not in self._artists:
+        self.add_artist(artist)  # 例如 update_mel 重建了图像
+    for ax in {a.axes for a in changed}:
+      self.canvas.restore_region(self._backgrounds[ax])
+      for artist in self._artists:
+        if artist.axes is ax:
+          ax.draw_artist(artist)
+      self.canvas.blit(ax.bbox)
+    self.canvas.flush_events()
+
+
+class FrameCounter:
+  """每秒打印一次实际刷新帧率（DEBUG 时使用）。"""
+  def __init__(self):
+    self.frames = 0
+    self.start = time.perf_counter()
+
+  def tick(self):
+    self.frames += 1
+    elapsed = time.perf_counter() - self.start
+    if elapsed >= 1:
+      print(f"fps: {self.frames / elapsed:.1f}")
+      self.frames = 0
+      self.start = time.perf_counter()
+
+
 if __name__ == "__main__":
   device_info = sd.query_devices(None, 'input')
   print("device_info:", device_info)
@@ -270,9 +525,18 @@ if __name__ == "__main__":
   plots = Plotting(info)
   # fig.tight_layout(pad=0)
 
-  ani = FuncAnimation(plots.figure, plots.update_plot, interval=50, blit=True)
+  blit = BlitManager(plots.figure.canvas, plots.lines + [plots.mel_im])
+  fps = FrameCounter() if DEBUG else None
+  def on_timer():
+    blit.update(plots.update_plot(None))
+    if fps:
+      fps.tick()
+  timer = plots.figure.canvas.new_timer(interval=50)
+  timer.add_callback(on_timer)
+  timer.start()
   with stream:
-    print("Initial ring_buffer:", describe_np(stream.ring_buffer))
+    if DEBUG:
+      print("Initial ring_buffer:", describe_np(stream.ring_buffer))
     plt.show()
   # stop background updater when the plotting window closes
   caller.stop()
@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
@@ -7,7 +9,7 @@ ArrayLike = np.ndarray | list[float]
 # PROMPT: fix missing from font(s) DejaVu Sans.
 # Prefer fonts that contain CJK glyphs to avoid "missing glyphs in DejaVu Sans" warnings.
 # This sets a fallback list; matplotlib will use the first available on the system.
-plt.rcParams['font.sans-serif'] = [
+CJK_FONTS = [
   'SimHei',            # common on many systems
   'PingFang SC',       # macOS modern Chinese font
   'Heiti SC',
@@ -15,8 +17,25 @@ plt.rcParams['font.sans-serif'] = [
   'Arial Unicode MS',
   'DejaVu Sans'
 ]
-plt.rcParams['font.family'] = 'sans-serif'
-plt.rcParams['axes.unicode_minus'] = False
+
+
+@functools.cache
+def setup_fonts() -> list[str]:
+  """Configure rcParams for CJK text once per process.
+
+  Only fonts actually installed are kept, so matplotlib doesn't look up (and warn
+  about) missing families each time a figure resolves its font.
+  """
+  from matplotlib import font_manager
+  installed = {f.name for f in font_manager.fontManager.ttflist}
+  fonts = [name for name in CJK_FONTS if name in installed] or CJK_FONTS[-1:]
+  plt.rcParams['font.sans-serif'] = fonts
+  plt.rcParams['font.family'] = 'sans-serif'
+  plt.rcParams['axes.unicode_minus'] = False
+  return fonts
+
+
+setup_fonts()
 
 
 def _mmss(x, pos=None):
@@ -97,11 +116,14 @@ def plot_notes(notes: list, sr: int, title: str | None = None) -> None:
 
   fig, ax = plt.subplots(figsize=(10, 4))
 
-  for n in notes:
-    ax.hlines(n.note, n.start / sr, (n.start + n.duration) / sr, linewidth=3, color='C0')
-    # 在段中点标注名称
-    # mid_t = (n.start + n.start + n.duration) / 2
-    # ax.text(mid_t, n.note + 0.15, n.name, fontsize=8, ha='center', va='bottom')
+  # 一次 hlines 调用生成单个 LineCollection，而不是每个音符一个 artist
+  pitch = np.fromiter((n.note for n in notes), dtype=np.float64, count=len(notes))
+  start = np.fromiter((n.start for n in notes), dtype=np.float64, count=len(notes))
+  duration = np.fromiter((n.duration for n in notes), dtype=np.float64, count=len(notes))
+  ax.hlines(pitch, start / sr, (start + duration) / sr, linewidth=3, color='C0')
+  # 在段中点标注名称
+  # mid_t = (n.start + n.start + n.duration) / 2
+  # ax.text(mid_t, n.note + 0.15, n.name, fontsize=8, ha='center', va='bottom')
 
   ax.set_xlabel('Time (s)')
   ax.set_ylabel('MIDI Note Number')
@@ -1,6 +1,8 @@
 # %%
 from pathlib import Path
 
+import numpy as np
+
 
 # %%
 def uc2mp3(uc_file_path, mp3_file_path):
@@ -8,9 +10,7 @@ def uc2mp3(uc_file_path, mp3_file_path):
   with open(uc_file, 'rb') as f:
     uc_data = f.read()
 
-  arr = bytearray(uc_data)
-  for i in range(len(arr)):
-    arr[i] ^= 0xa3
+  arr = np.frombuffer(uc_data, dtype=np.uint8) ^ np.uint8(0xa3)
 
   with open(mp3_file_path, 'wb') as f:
     f.write(arr)
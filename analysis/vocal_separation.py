@@ -1,10 +1,18 @@
 # %%
 # 人声分离
-# TODO: source - vocals?
 # TODO: other model? why mdx_extra?
 
 import librosa
+import functools
+import shutil
+import subprocess
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Iterator
+import numpy as np
+import soundfile as sf
+import soxr
 import torch
 try:
   from plottings import show_mel
@@ -12,54 +20,276 @@ except ImportError:
   from .plottings import show_mel
 
 # %%
-def separate_audio_impl(wav: torch.Tensor, model, device: str = "cpu", audio_path: Path = None, name: str = "demucs"):
+# fp16/bf16 走 autocast（MPS/CUDA 上用半精度算力），int8 为 CPU 上的动态量化
+PRECISIONS = ("fp32", "fp16", "bf16", "int8")
+
+# 已量化过的模型 -> 其 int8 副本，同一模型只量化一次
+_int8_models = weakref.WeakKeyDictionary()
+
+def quantize_int8(model):
+  """模型的 int8 动态量化副本，只有 CPU 内核；Demucs 的算力主要在 LSTM 与线性层。
+  同一模型只量化一次，已量化的模型原样返回。"""
+  if getattr(model, "int8_quantized", False):
+    return model
+  quantized = _int8_models.get(model)
+  if quantized is None:
+    quantized = torch.ao.quantization.quantize_dynamic(model.cpu(), {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    quantized.int8_quantized = True
+    _int8_models[model] = quantized
+  return quantized
+
+def _apply_model(model, mix: torch.Tensor, device: str, precision: str, segment: float | None = None, overlap: float = 0.25,
+                 shifts: int = 0, jobs: int = 0) -> torch.Tensor:
+  """mix: (tracks, channels, samples) -> (tracks, sources, channels, samples)。
+  多条音轨时每个窗口一次推理整批（短的音轨尾部补零），GPU 一次算满一批。"""
   from demucs.apply import apply_model
+  # 按 segment 秒的重叠窗口逐段推理再交叉淡化拼接，模型的中间激活只有一个窗口大小。
+  # shifts 次随机平移各推理一遍取平均（demucs 默认 1，即一次随机平移，结果不可复现）；
+  # jobs 个线程并行推理各窗口，demucs 只在 CPU 上用它
+  kwargs = dict(split=True, overlap=overlap, shifts=shifts, num_workers=jobs, progress=True)
+  if segment is not None:
+    kwargs['segment'] = segment
+  if precision == "int8":
+    # load_model(..., precision="int8") 已经量化好；传入的是浮点模型时量化一次并缓存
+    return apply_model(quantize_int8(model), mix.cpu(), device="cpu", **kwargs)
+  if precision in ("fp16", "bf16"):
+    dtype = torch.float16 if precision == "fp16" else torch.bfloat16
+    with torch.autocast(torch.device(device).type, dtype=dtype):
+      sources = apply_model(model, mix, device=device, **kwargs)
+    return sources.float()
+  return apply_model(model, mix, device=device, **kwargs)
+
+def default_device() -> str:
+  """有 CUDA 用 CUDA，其次 MPS，都没有时退回 CPU。"""
+  if torch.cuda.is_available():
+    return "cuda"
+  if torch.backends.mps.is_available():
+    return "mps"
+  return "cpu"
+
+# 显存不足时窗口长度逐次减半重试，短于此值（秒）就放弃
+MIN_SEGMENT = 1.0
+
+def _halve_segment(model, segment: float | None) -> float | None:
+  """segment 为 None 时从模型自带的窗口长度（模型组取最短的）开始减半；过短时返回 None。"""
+  if segment is None:
+    segment = min(float(m.segment) for m in getattr(model, "models", [model]))
+  segment /= 2
+  return segment if segment >= MIN_SEGMENT else None
+
+def _empty_device_cache(device: str):
+  """把缓存分配器里已释放的显存还给系统（CPU 上无事可做）。"""
+  kind = torch.device(device).type
+  if kind == "cuda":
+    torch.cuda.empty_cache()
+  elif kind == "mps":
+    torch.mps.empty_cache()
+
+def _apply_with_retry(model, mix: torch.Tensor, device: str, precision: str, segment: float | None, overlap: float,
+                      shifts: int, jobs: int) -> tuple[torch.Tensor, float | None]:
+  """_apply_model，CUDA 显存不足时窗口长度减半重试；返回 (sources, 最终用的 segment)。"""
+  while True:
+    try:
+      # 不记录 autograd 信息，中间激活用完即释放
+      with torch.inference_mode():
+        return _apply_model(model, mix, device, precision, segment=segment, overlap=overlap, shifts=shifts, jobs=jobs), segment
+    except torch.cuda.OutOfMemoryError:
+      segment = _halve_segment(model, segment)
+      if segment is None:
+        raise
+    # 离开 except 块后异常的栈帧已释放，其中引用的显存才能还回去
+    _empty_device_cache(device)
+    print(f"CUDA out of memory, retrying with segment={segment:.2f}s")
+
+def separate_audio_impl(wav: torch.Tensor, model, device: str = "cpu", audio_path: Path = None, name: str = "demucs", precision: str = "fp32",
+                        segment: float | None = None, overlap: float = 0.25, shifts: int = 0, jobs: int = 0, cache: bool = False):
   from demucs.repo import AnyModel
-  cache_path = audio_path and name and audio_path.with_name(audio_path.stem + f"_{name}.npz")
+  if precision not in PRECISIONS:
+    raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+  # 各声部原始结果的缓存默认关闭：分离后的声部已经写成音频文件，整份 float32 张量（4 分钟约 170 MB）没人再读。
+  # 开启时存为 .npy，读回走 copy-on-write mmap，不必整份拷贝；不同精度的结果分开缓存
+  suffix = name if precision == "fp32" else f"{name}_{precision}"
+  cache_path = cache and audio_path and name and audio_path.with_name(audio_path.stem + f"_{suffix}.npy")
   if cache_path and cache_path.exists():
-    import numpy as np
-    sources = np.load(cache_path)['sources']
-    return torch.Tensor(sources)
+    return torch.from_numpy(np.load(cache_path, mmap_mode='c'))
   wav = torch.Tensor(wav).to(device)
   model: AnyModel = model.to(device)
 
   ref_wav = wav.mean(0)
   wav -= ref_wav.mean()
   wav /= ref_wav.std()
-  sources = apply_model(model, wav[None], device=device, progress=True)[0]
+  sources, _ = _apply_with_retry(model, wav[None], device, precision, segment, overlap, shifts, jobs)
+  sources = sources[0]
 
   if cache_path:
-    import numpy as np
-    np.savez(cache_path, sources=sources.cpu().numpy())
+    np.save(cache_path, sources.cpu().numpy())
   return sources
 
+def warm_up(model, device: str = "cpu", precision: str = "fp32", segment: float | None = None, overlap: float = 0.25):
+  """在加速器上用一个窗口长的静音跑一次 Demucs：CUDA 上下文、cuBLAS/cuDNN 句柄与 MPS 内核都在这次里初始化，
+  第一份真正的音频不再为此停顿。CPU（含 int8）上没有这些开销，直接返回。"""
+  if torch.device(device).type == "cpu" or precision == "int8":
+    return
+  window = segment or min(float(m.segment) for m in getattr(model, "models", [model]))
+  mix = torch.zeros(1, model.audio_channels, int(window * model.samplerate), device=device)
+  model.to(device)
+  try:
+    _apply_with_retry(model, mix, device, precision, segment, overlap, shifts=0, jobs=0)
+  finally:
+    del mix
+    model.cpu()
+    _empty_device_cache(device)
+
+def load_model(model_name: str = "mdx_extra", precision: str = "fp32"):
+  """从磁盘加载 Demucs 预训练模型。处理多个文件时加载一次，交给 separate_with_model 复用。
+  precision 为 "int8" 时返回量化后的模型，每次推理不再重新量化。"""
+  from demucs.pretrained import get_model
+  model = get_model(model_name)
+  return quantize_int8(model) if precision == "int8" else model
+
 def separate_audio(audio_path: Path,
                    model_name: str = "mdx_extra",
                    device: str = "cpu",
                    two_stems: bool = True,
                    out_dir: Path | None = None,
-                   ext: str = "mp3"
+                   ext: str = "mp3",
+                   precision: str = "fp32",
+                   segment: float | None = None,
+                   overlap: float = 0.25,
+                   shifts: int = 0,
+                   jobs: int = 0,
+                   on_stem: Callable[[str, np.ndarray, int], None] | None = None,
+                   cache_sources: bool = False,
 ):
-  from demucs.separate import load_track
-  from demucs.pretrained import get_model
-  from demucs.audio import save_audio
   """Separate stems using Demucs model (inlined minimal flow).
 
   This uses demucs.get_model + demucs.apply.apply_model to perform separation
   and writes each source to disk under outdir / <base_name>_<source>.<ext>
+
+  precision: one of PRECISIONS. "fp16"/"bf16" run under torch.autocast on the
+  given device (bf16 is the safer choice for Demucs), "int8" dynamically
+  quantizes the model and always runs on CPU.
+  segment/overlap: window length in seconds (None = the model's own) and the
+  fraction by which windows overlap; smaller windows lower peak memory. On CUDA
+  out-of-memory the segment is halved and separation retried. Larger windows
+  and a lower overlap mean fewer, bigger model calls: faster where memory
+  allows, at some cost in quality at the window seams for low overlaps.
+  shifts: average the model over this many randomly shifted copies of the
+  input. Each shift is a full extra pass, for a small SDR gain; 0 (the
+  default, unlike demucs' 1) runs once, unshifted, and is reproducible.
+  jobs: threads running windows in parallel (CPU only; ignored on GPU).
+  on_stem: called as on_stem(name, wav, samplerate) for every written stem, with the
+  (channels, samples) float32 array exactly as handed to the encoder, while the files
+  are still being encoded. Lets callers keep working on the audio without decoding
+  the written file again.
+  cache_sources: also keep the raw separated sources next to the input as
+  <stem>_<model>.npy and reuse them on the next run (off by default).
   """
-  model = get_model(model_name)
+  return separate_with_model(load_model(model_name, precision), audio_path, model_name=model_name, device=device,
+                             two_stems=two_stems, out_dir=out_dir, ext=ext, precision=precision,
+                             segment=segment, overlap=overlap, shifts=shifts, jobs=jobs, on_stem=on_stem,
+                             cache_sources=cache_sources)
+
+def separate_with_model(model,
+                        audio_path: Path,
+                        model_name: str = "mdx_extra",
+                        device: str = "cpu",
+                        two_stems: bool = True,
+                        out_dir: Path | None = None,
+                        ext: str = "mp3",
+                        precision: str = "fp32",
+                        segment: float | None = None,
+                        overlap: float = 0.25,
+                        shifts: int = 0,
+                        jobs: int = 0,
+                        on_stem: Callable[[str, np.ndarray, int], None] | None = None,
+                        cache_sources: bool = False,
+                        submit_write: Callable[..., Future] | None = None,
+):
+  """Same as separate_audio, with a model already returned by load_model.
+
+  model_name only names the sources cache.
+  submit_write: an Executor.submit-like callable; when given, stem files are
+  encoded through it and this returns without waiting for them; the caller
+  waits on the futures its submit_write returned.
+  """
+  from demucs.separate import load_track
   # model.sources == ['drums', 'bass', 'other', 'vocals']
   wav = load_track(audio_path, model.audio_channels, model.samplerate)
 
   # run model (batch dimension)
-  sources = separate_audio_impl(wav, model, device=device, audio_path=audio_path, name=model_name)
+  sources = separate_audio_impl(wav, model, device=device, audio_path=audio_path, name=model_name, precision=precision,
+                                segment=segment, overlap=overlap, shifts=shifts, jobs=jobs, cache=cache_sources)
+  # 后续的混音相减与编码都在 CPU 上进行：结果拷回后把模型权重也移回 CPU，释放设备内存
+  sources = sources.cpu()
+  model.cpu()
+  _empty_device_cache(device)
+
+  _write_stems(model, wav, sources, audio_path, two_stems, out_dir, ext, on_stem, submit_write)
+  return sources.numpy()
+
+def separate_many_with_model(model,
+                             audio_paths: list[Path],
+                             batch_size: int = 4,
+                             device: str = "cpu",
+                             two_stems: bool = True,
+                             out_dir: Path | None = None,
+                             ext: str = "mp3",
+                             precision: str = "fp32",
+                             segment: float | None = None,
+                             overlap: float = 0.25,
+                             shifts: int = 0,
+                             jobs: int = 0,
+                             on_stem: Callable[[Path, str, np.ndarray, int], None] | None = None,
+                             submit_write: Callable[..., Future] | None = None,
+):
+  """separate_with_model over several files, batch_size tracks per Demucs call.
 
+  Every Demucs window then runs on batch_size tracks at once, which keeps a GPU
+  busy where one track's window alone would not. Tracks of a batch are zero
+  padded to the longest one, so similar lengths waste the least; the batch is
+  held in device memory together (lower batch_size, or segment, if it doesn't
+  fit). On a CPU this gains little over separating the files one by one.
+
+  on_stem: as in separate_audio, called as on_stem(audio_path, name, wav, samplerate).
+  The sources cache (cache_sources) isn't used here.
+  """
+  from demucs.separate import load_track
+  if precision not in PRECISIONS:
+    raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+  for i in range(0, len(audio_paths), batch_size):
+    group = audio_paths[i:i + batch_size]
+    wavs = [load_track(path, model.audio_channels, model.samplerate) for path in group]
+    lengths = [wav.shape[-1] for wav in wavs]
+    # 各音轨按自己的统计量归一化（同 separate_audio_impl），尾部补零到本批最长
+    mix = torch.zeros(len(wavs), model.audio_channels, max(lengths))
+    for j, wav in enumerate(wavs):
+      ref_wav = wav.mean(0)
+      mix[j, :, :lengths[j]] = (wav - ref_wav.mean()) / ref_wav.std()
+    model.to(device)
+    sources, segment = _apply_with_retry(model, mix.to(device), device, precision, segment, overlap, shifts, jobs)
+    sources = sources.cpu()
+    del mix
+    model.cpu()
+    _empty_device_cache(device)
+    for j, path in enumerate(group):
+      track_on_stem = on_stem and functools.partial(on_stem, path)
+      _write_stems(model, wavs[j], sources[j, ..., :lengths[j]], path, two_stems, out_dir, ext, track_on_stem, submit_write)
+
+def _write_stems(model, wav: torch.Tensor, sources: torch.Tensor, audio_path: Path, two_stems: bool, out_dir: Path | None,
+                 ext: str, on_stem: Callable[[str, np.ndarray, int], None] | None,
+                 submit_write: Callable[..., Future] | None):
+  """把一条音轨的分离结果（CPU 上、归一化尺度的 sources）写成各声部文件，参数含义同 separate_with_model。"""
+  from demucs.audio import prevent_clip
   vocals_idx = model.sources.index("vocals")
   if two_stems:
+    # 各声部之和就是混音，伴奏直接用混音减人声，不必取出其余三轨再求和。
+    # sources 在归一化后的尺度上，混音按 separate_audio_impl 同样的方式归一化
+    ref_wav = wav.mean(0)
+    mix = (wav - ref_wav.mean()) / ref_wav.std()
     output_sources = {
       "vocals": sources[vocals_idx],
-      "non_vocals": sources[[i for i in range(len(sources)) if i != vocals_idx]].sum(0),
+      "non_vocals": mix - sources[vocals_idx],
     }
   else:
     output_sources = {source: sources[i] for i, source in enumerate(model.sources)}
@@ -67,24 +297,214 @@ def separate_audio(audio_path: Path,
   base_name = audio_path.stem
   out_dir = out_dir or audio_path.parent
   out_dir.mkdir(parents=True, exist_ok=True)
+  def write(v: torch.Tensor, filename: Path):
+    save_stem(v, filename, model.samplerate)
+    print(f"wrote: {filename}")
+
+  # 各声部的编码互不依赖，并行写出（编码器在 C 扩展里运行）。
+  # 传入 submit_write 时编码交给调用方的线程池、这里不等待，调用方接着做的计算与编码重叠
+  with ThreadPoolExecutor(max_workers=len(output_sources)) as executor:
+    submit = submit_write or executor.submit
+    futures = []
+    for k, v in output_sources.items():
+      filename = out_dir / f"{base_name}_{k}.{ext}"
+      v = prevent_clip(v.contiguous(), mode='rescale')
+      futures.append(submit(write, v, filename))
+      if on_stem is not None:
+        on_stem(k, v.numpy(), model.samplerate)
+    if submit_write is None:
+      for future in futures:
+        future.result()
+
+def save_stem(wav: torch.Tensor | np.ndarray, filename: Path, samplerate: int):
+  """用 demucs 的 save_audio 写出一个 (channels, samples) 的声部（mp3 为 lameenc 320 kbps）。
+  分离结果与从缓存恢复的声部都经由这里写出，同样的样本得到同样的文件。"""
+  from demucs.audio import save_audio
   kwargs = {
-    'samplerate': model.samplerate,
+    'samplerate': samplerate,
     # 'bitrate': args.mp3_bitrate,
     # 'preset': args.mp3_preset,
-    # 'clip': args.clip_mode,
+    # 调用方已按 save_audio 默认的 'rescale' 处理过，编码器不再改动样本
+    'clip': 'none',
     # 'as_float': args.float32,
     # 'bits_per_sample': 24 if args.int24 else 16,
   }
-  for k, v in output_sources.items():
-    filename = out_dir / f"{base_name}_{k}.{ext}"
-    save_audio(v, filename, **kwargs)
-    print(f"wrote: {filename}")
-  return sources.cpu().numpy()
+  save_audio(torch.as_tensor(wav), filename, **kwargs)
+
+def _sf_readable(audio_path: Path) -> bool:
+  try:
+    sf.info(str(audio_path))
+  except sf.SoundFileRuntimeError:
+    return False
+  return True
+
+def can_stream(audio_path: Path) -> bool:
+  """audio_path 能否分块读取，即能否用 separate_streaming：libsndfile 能读的格式（wav/flac/ogg/mp3 等）
+  直接读，其余（m4a 等）需要 PATH 上有 ffmpeg。"""
+  return _sf_readable(audio_path) or shutil.which("ffmpeg") is not None
+
+def _convert_channels(x: np.ndarray, channels: int) -> np.ndarray:
+  """(samples, src_channels) -> (samples, channels)，规则同 demucs.audio.convert_audio_channels。"""
+  src_channels = x.shape[1]
+  if src_channels == channels:
+    return x
+  if channels == 1:
+    return x.mean(axis=1, keepdims=True)
+  if src_channels == 1:
+    return np.repeat(x, channels, axis=1)
+  if src_channels > channels:
+    return x[:, :channels]
+  raise ValueError('The audio file has less channels than requested but is not mono.')
+
+def _stream_track(audio_path: Path, channels: int, samplerate: int, blocksize: int) -> Iterator[np.ndarray]:
+  """分块解码并流式重采样到模型的采样率与声道数，逐块产出 (channels, samples) float32。
+  soxr 的流式重采样与整段重采样逐样本一致。"""
+  if not _sf_readable(audio_path):
+    yield from _ffmpeg_stream(audio_path, channels, samplerate, blocksize)
+    return
+  with sf.SoundFile(str(audio_path)) as f:
+    resampler = soxr.ResampleStream(f.samplerate, samplerate, channels, dtype='float32')
+    while True:
+      data = f.read(blocksize, dtype='float32', always_2d=True)
+      last = len(data) < blocksize
+      out = resampler.resample_chunk(_convert_channels(data, channels), last=last)
+      if len(out):
+        yield np.ascontiguousarray(out.T)
+      if last:
+        return
+
+def _ffmpeg_stream(audio_path: Path, channels: int, samplerate: int, blocksize: int) -> Iterator[np.ndarray]:
+  """libsndfile 读不了的格式交给 ffmpeg 解码、重采样并转换声道（同 demucs.audio.AudioFile），
+  从管道按块读 f32le，不落临时文件。"""
+  command = ["ffmpeg", "-v", "error", "-nostdin", "-i", str(audio_path),
+             "-f", "f32le", "-ac", str(channels), "-ar", str(samplerate), "-"]
+  frame = 4 * channels
+  proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+  try:
+    while True:
+      data = proc.stdout.read(blocksize * frame)
+      usable = len(data) - len(data) % frame
+      if usable:
+        yield np.frombuffer(data[:usable], dtype='<f4').reshape(-1, channels).T.copy()
+      if len(data) < blocksize * frame:
+        break
+    if proc.wait() != 0:
+      raise RuntimeError(f"ffmpeg failed to decode {audio_path} (exit code {proc.returncode})")
+  finally:
+    # 提前停止读取时（异常或生成器被关闭）不要让 ffmpeg 卡在写管道上
+    if proc.poll() is None:
+      proc.kill()
+    proc.stdout.close()
+    proc.wait()
+
+def separate_streaming(model,
+                       audio_path: Path,
+                       device: str = "cpu",
+                       two_stems: bool = True,
+                       out_dir: Path | None = None,
+                       ext: str = "mp3",
+                       precision: str = "fp32",
+                       segment: float | None = None,
+                       overlap: float = 0.25,
+                       shifts: int = 0,
+                       jobs: int = 0,
+                       chunk_seconds: float = 30.0,
+                       chunk_overlap: float = 1.0,
+) -> list[Path]:
+  """Like separate_with_model, without holding the whole track in memory.
+
+  The input is decoded with soundfile block by block and resampled on the fly;
+  formats libsndfile can't read (m4a and the like) are decoded by an ffmpeg
+  process and read from its pipe in blocks instead (see can_stream). Demucs runs on chunk_seconds long chunks that overlap by chunk_overlap
+  seconds, linearly crossfaded, and every stem is appended to its output file as
+  soon as a chunk is done. Peak memory follows chunk_seconds, not the track length.
+
+  The input is normalized with the whole track's statistics (a first, cheap
+  decoding pass), so Demucs sees the same scale as in separate_with_model. Stems
+  are written at the input's own level and clamped, since the peak of the whole
+  stem, which the in-memory path rescales by, isn't known while streaming.
+  Returns the written stem paths.
+  """
+  if precision not in PRECISIONS:
+    raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+  channels, samplerate = model.audio_channels, model.samplerate
+  chunk = int(chunk_seconds * samplerate)
+  fade = min(int(chunk_overlap * samplerate), chunk)
+  blocksize = 1 << 16
+
+  # 第一遍只求单声道混音的均值与标准差（同 separate_audio_impl 的归一化，torch.std 为无偏估计）
+  n, total, total_sq = 0, 0.0, 0.0
+  for block in _stream_track(audio_path, channels, samplerate, blocksize):
+    ref = block.mean(axis=0, dtype=np.float64)
+    n, total, total_sq = n + len(ref), total + ref.sum(), total_sq + np.dot(ref, ref)
+  if n < 2:
+    raise ValueError(f"Audio file is too short to separate: {audio_path}")
+  mean = total / n
+  std = float(np.sqrt(max(total_sq - n * mean * mean, 0.0) / (n - 1))) or 1.0
+
+  names = ["vocals", "non_vocals"] if two_stems else list(model.sources)
+  vocals_idx = model.sources.index("vocals")
+  base_name = audio_path.stem
+  out_dir = out_dir or audio_path.parent
+  out_dir.mkdir(parents=True, exist_ok=True)
+  paths = [out_dir / f"{base_name}_{k}.{ext}" for k in names]
+  model = model.to(device)
+
+  def separate_chunk(mix: np.ndarray) -> np.ndarray:
+    """一块混音 (channels, samples) -> 各输出声部 (len(names), channels, samples)，原始电平。"""
+    nonlocal segment
+    wav = (torch.from_numpy(mix).to(device) - mean) / std
+    sources, segment = _apply_with_retry(model, wav[None], device, precision, segment, overlap, shifts, jobs)
+    sources = sources[0].cpu().numpy() * std + mean
+    if two_stems:
+      # 伴奏 = 混音 - 人声，理由同 separate_with_model
+      return np.stack([sources[vocals_idx], mix - sources[vocals_idx]])
+    return sources
+
+  writers = [sf.SoundFile(str(path), "w", samplerate=samplerate, channels=channels) for path in paths]
+  try:
+    def write(stems: np.ndarray):
+      # 同 save_audio 的 clip='clamp'
+      for writer, stem in zip(writers, np.clip(stems, -0.99, 0.99)):
+        writer.write(stem.T)
 
+    # 第 k 块覆盖 [k*chunk, k*chunk + chunk + fade)；与上一块重叠的 fade 个样本线性交叉淡化
+    buf = np.zeros((channels, 0), dtype=np.float32)
+    tail = None
+    def emit(stems: np.ndarray, final: bool):
+      nonlocal tail
+      start = 0
+      if tail is not None:
+        start = min(fade, stems.shape[-1])
+        w = np.linspace(0.0, 1.0, start, endpoint=False, dtype=np.float32)
+        write(tail[..., :start] * (1 - w) + stems[..., :start] * w)
+      if final:
+        write(stems[..., start:])
+      else:
+        write(stems[..., start:chunk])
+        tail = stems[..., chunk:]
+    for block in _stream_track(audio_path, channels, samplerate, blocksize):
+      buf = np.concatenate([buf, block], axis=1)
+      while buf.shape[1] >= chunk + fade:
+        emit(separate_chunk(buf[:, :chunk + fade]), final=False)
+        buf = buf[:, chunk:]
+    if tail is None or buf.shape[1] > fade:
+      emit(separate_chunk(buf), final=True)
+    else:
+      # 剩下的正好是上一块已经算过的重叠部分
+      write(tail)
+  finally:
+    for writer in writers:
+      writer.close()
+    model.cpu()
+    _empty_device_cache(device)
+  for path in paths:
+    print(f"wrote: {path}")
+  return paths
 
 # %%
 if __name__ == "__main__":
-  import platform
+  from pitch import load_audio
   workspace_dir = Path(__file__).parent.parent
   # Constants
   audio_base_name = "我的一个道姑朋友"
@@ -92,13 +512,11 @@ if __name__ == "__main__":
   # Demo/testing code when run as script
   # output_dir = audio_path.parent.joinpath(audio_path.name)
 
-  # str is needed on PosixPath: AttributeError: 'PosixPath' object has no attribute 'encode'
-  y, sr = librosa.load(str(audio_path), sr=None)
+  y, sr = load_audio(audio_path)
   print(f"音频加载完成 - 采样率: {sr} Hz, 时长: {librosa.get_duration(y=y, sr=sr):.2f} 秒")
 
   # call the inlined separation (replaces demucs.separate.main invocation)
-  device = "mps" if platform.system() == "Darwin" else "cuda"
-  sources = separate_audio(audio_path, model_name="mdx_extra", device=device)
+  sources = separate_audio(audio_path, model_name="mdx_extra", device=default_device())
 
   show_mel(y, sr=sr, name=audio_path.name)
   show_mel(sources[3].mean(0), sr=sr, name=audio_path.name + "_vocals")
@@ -9,20 +9,80 @@ This module provides a complete pipeline for processing audio files:
 3. Outputs the separated vocals and generated MIDI files
 """
 
+import contextlib
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-import platform
-import time
+from time import perf_counter
+from typing import TYPE_CHECKING
 import numpy as np
+import soundfile as sf
 
 workspace_dir = Path(__file__).parent
 sys.path.append(str(workspace_dir / "analysis"))
 
-from analysis.vocal_separation import separate_audio
-from analysis.pitch import get_audio_pitches, pitch_to_midi_notes, notes_to_midi
-from analysis.basic_pitch.inference import transform_to_midi
+if TYPE_CHECKING:
+    from analysis.basic_pitch.inference import Model
+
+# separated stems of earlier runs, one directory per input content + separation settings
+DEFAULT_CACHE_DIR = Path.home() / ".klok" / "cache"
 
 # %%
+@functools.cache
+def _pitch():
+    """
+    analysis.pitch, imported on first use. Importing it pulls in numba and matplotlib,
+    which runs without pitch analysis don't need.
+    """
+    from analysis import pitch
+    return pitch
+
+
+@functools.cache
+def _separation():
+    """
+    analysis.vocal_separation, imported on first use: it pulls in torch and demucs,
+    which --help, bad arguments and the MIDI worker processes don't need.
+    """
+    from analysis import vocal_separation
+    return vocal_separation
+
+
+@functools.cache
+def _basic_pitch():
+    """analysis.basic_pitch.inference (onnxruntime, librosa), imported on first use."""
+    from analysis.basic_pitch import inference
+    return inference
+
+
+def use_project_numba_cache():
+    """
+    Cache numba's compiled functions (librosa's and analysis.pitch's) in the project's
+    .numba_cache, so they persist even where site-packages isn't writable. For entry
+    points, before anything imports numba; an NUMBA_CACHE_DIR already set wins.
+    Spawned MIDI workers inherit it.
+    """
+    os.environ.setdefault("NUMBA_CACHE_DIR", str(workspace_dir / ".numba_cache"))
+
+
+# stems the pipeline writes (separation with two_stems)
+_STEMS = ("vocals", "non_vocals")
+
+
+def _store_stem(stems_cache: Path, name: str, wav: np.ndarray, samplerate: int):
+    """Save one separated (channels, samples) stem into the cache; written to a temporary file and renamed into place."""
+    stems_cache.mkdir(parents=True, exist_ok=True)
+    tmp_path = stems_cache / f".{name}.{os.getpid()}.tmp"
+    sf.write(tmp_path, wav.T, samplerate, format="FLAC", subtype="PCM_24")
+    os.replace(tmp_path, stems_cache / f"{name}.flac")
+
+
 class AudioPipeline:
     """
     A pipeline for processing audio files to extract vocals and generate MIDI.
@@ -32,34 +92,165 @@ class AudioPipeline:
                  model_name: str = "mdx_extra",
                  device: str | None = None,
                  output_ext: str = "mp3",
-                 hop_length: int = 512):
+                 hop_length: int = 512,
+                 precision: str = "fp32",
+                 segment: float | None = None,
+                 overlap: float = 0.25,
+                 shifts: int = 0,
+                 jobs: int = 0,
+                 cache: bool = True,
+                 cache_dir: Path | str = DEFAULT_CACHE_DIR,
+                 cache_sources: bool = False,
+                 writer_workers: int = 2,
+                 fast_viterbi: bool = True,
+                 decimate_pyin: bool = False,
+                 basic_pitch_int8: bool = False,
+                 quiet: bool = False,
+                 streaming: bool = False,
+                 chunk_seconds: float = 30.0,
+                 batch_size: int = 1,
+                 midi_workers: int = 0,
+                 warmup: bool = False):
         """
         Initialize the audio pipeline.
 
         Args:
             model_name: Demucs model name for vocal separation
-            device: Device to use ("cpu", "cuda", "mps"). Auto-detected if None.
+            device: Device to use ("cpu", "cuda", "mps") for both Demucs and Basic
+                Pitch. If None, the first available of cuda, mps and cpu.
             output_ext: Extension for separated audio files
             hop_length: Hop length for pitch analysis (default: 512)
+            precision: Demucs inference precision ("fp32", "fp16", "bf16", "int8")
+            segment: Demucs window length in seconds (None = the model's own); shorter
+                windows use less memory. Halved automatically on CUDA out-of-memory.
+            overlap: Fraction by which Demucs windows overlap; lower is faster
+            shifts: Average Demucs over this many random time shifts of the input.
+                Each one is a full extra pass for a small quality gain; 0 runs once
+                and gives reproducible stems.
+            jobs: Threads running Demucs windows in parallel (CPU only)
+            cache: Reuse earlier results: the separated stems, kept as FLAC under
+                cache_dir and keyed by the input's content and the separation
+                settings, and the pitch analysis, cached next to the vocals file and
+                keyed by its content and hop length
+            cache_dir: Where the separated stems are cached (default ~/.klok/cache)
+            cache_sources: Also cache the raw Demucs sources (a large .npy per track)
+            writer_workers: Threads encoding the separated stems in the background
+            fast_viterbi: Decode pyin with the diagonal Viterbi kernel from analysis.pitch
+                (same result as librosa's, about 3x faster decoding, see
+                analysis/bench_viterbi.py); False keeps librosa's own. Scoped to this
+                pipeline's pyin calls, librosa isn't changed for other code
+            decimate_pyin: Run pyin on the vocals resampled down by up to 4x (see
+                analysis.pitch._pyin_decimation). Faster, but a few percent of the
+                frames get a different voicing or note than at the full rate.
+            basic_pitch_int8: Run Basic Pitch from the int8 model written by
+                analysis/basic_pitch/quantize.py, if present. Only worth it on CPUs with
+                fast int8 dot products (VNNI/AMX); check the notes it produces.
+            quiet: Don't print progress messages; stage timings are still returned
+                in the results' 'timings' entry
+            streaming: Separate long tracks chunk by chunk, decoding the input and
+                writing the stems incrementally, so memory use follows chunk_seconds
+                rather than the track length. Pitch analysis and Basic Pitch then read
+                the vocals file block by block too. Stems are written at the input's
+                level instead of peak-normalized. Formats libsndfile can't read
+                (e.g. m4a) are streamed through ffmpeg, or separated in one piece
+                when ffmpeg isn't installed.
+            chunk_seconds: Length of the streamed chunks (1 s of overlap is crossfaded)
+            batch_size: In process_many, separate this many files per Demucs call,
+                so every window runs on the whole batch (GPU throughput). The batch
+                sits in device memory at once; 1 separates file by file. Not
+                combined with streaming or cache_sources.
+            midi_workers: In process_many, run the MIDI steps in this many worker
+                processes (one ONNX Runtime thread each) while this process goes on
+                separating the next files; os.cpu_count() // 2 is a good start.
+                0 runs everything here, file after file.
+            warmup: Once process_audio/process_many has checked its inputs and found
+                at least one that needs separating, load the models in a background
+                thread (on a GPU also one Demucs run over silence, see
+                vocal_separation.warm_up) while the first input is decoded
         """
         self.model_name = model_name
+        self.precision = precision
+        self.segment = segment
+        self.overlap = overlap
+        self.shifts = shifts
+        self.jobs = jobs
         self.output_ext = output_ext
         self.hop_length = hop_length
+        self.cache = cache
+        self.cache_dir = Path(cache_dir)
+        # input content digests by (path, size, mtime), so a file is hashed once per run
+        self._digests = {}
+        self.cache_sources = cache_sources
+        self.fast_viterbi = fast_viterbi
+        self.decimate_pyin = decimate_pyin
+        self.basic_pitch_int8 = basic_pitch_int8
+        self.quiet = quiet
+        self.streaming = streaming
+        self.chunk_seconds = chunk_seconds
+        self.batch_size = batch_size
+        self.midi_workers = midi_workers
+        # ONNX Runtime threads for Basic Pitch; None picks by whether pitch analysis runs alongside
+        self._basic_pitch_threads = None
+        # seconds per stage of the file being processed, returned as results['timings']
+        self._timings = {}
+        self._basic_pitch_models = {}
+        self._demucs_model = None
+        self.warmup = warmup
+        # background thread of _start_warmup; the model accessors wait for it
+        self._warmup = None
+        # per-frame buffers for note extraction, grown to the longest track and reused
+        self._scratch = {}
+        # stem files are encoded here while the MIDI steps run
+        self._io_pool = ThreadPoolExecutor(max_workers=writer_workers, thread_name_prefix="stem-writer")
+
+        self.device = device or _separation().default_device()
+
+    def _start_warmup(self, audio_paths: list[Path], output_dir: Path | None, generate_pitch_midi: bool,
+                      generate_basic_pitch_midi: bool, force_separate: bool):
+        """
+        With warmup, start loading the models in a background thread, unless every
+        one of the (already validated) audio_paths can skip separation. The model
+        accessors wait for the thread before touching a model.
+        """
+        if not self.warmup or self._warmup is not None:
+            return
+        if not any(self._needs_separation(p, output_dir or p.parent, force_separate) for p in audio_paths):
+            return
+        # not a daemon: torch/CUDA work shouldn't be cut off at interpreter exit
+        self._warmup = threading.Thread(target=self._warm_up, name="pipeline-warmup",
+                                        args=(generate_pitch_midi, generate_basic_pitch_midi))
+        self._warmup.start()
+
+    def _warm_up(self, generate_pitch_midi: bool, generate_basic_pitch_midi: bool):
+        start = perf_counter()
+        try:
+            model = self._separation_model()
+            _separation().warm_up(model, self.device, precision=self.precision, segment=self.segment,
+                                  overlap=self.overlap)
+            # with midi_workers the MIDI steps run in the workers, which load their own
+            if self.midi_workers <= 0:
+                if generate_basic_pitch_midi:
+                    self._basic_pitch_model(shared_cpu=generate_pitch_midi)
+                if generate_pitch_midi:
+                    _pitch().start_warmup()
+        except Exception as e:
+            # the step that needs the model loads it again and reports the error there
+            self._log(f"⚠️ Warm-up failed: {e}")
+            return
+        self._log(f"🔥 Models warmed up ({perf_counter() - start:.2f}s)")
 
-        if device is None:
-            # Auto-detect device
-            if platform.system() == "Darwin":
-                self.device = "mps"  # Metal Performance Shaders for macOS
-            else:
-                self.device = "cuda"  # CUDA for Linux/Windows
-        else:
-            self.device = device
+    def _await_warmup(self):
+        """Wait for _start_warmup's thread, unless called from it."""
+        warmup = self._warmup
+        if warmup is not None and warmup is not threading.current_thread():
+            warmup.join()
 
     def process_audio(self,
                      audio_path: Path,
                      output_dir: Path | None = None,
                      generate_pitch_midi: bool = True,
-                     generate_basic_pitch_midi: bool = True) -> dict:
+                     generate_basic_pitch_midi: bool = True,
+                     force_separate: bool = False) -> dict:
         """
         Complete audio processing pipeline.
 
@@ -68,108 +259,554 @@ class AudioPipeline:
             output_dir: Directory for output files. Uses audio file directory if None.
             generate_pitch_midi: Whether to generate MIDI using pitch analysis
             generate_basic_pitch_midi: Whether to generate MIDI using Basic Pitch
+            force_separate: Run Demucs even when the vocals file from an earlier run
+                is already in output_dir and newer than the input; by default that
+                file is reused and only the MIDI steps run
 
         Returns:
             Dictionary containing paths to generated files:
             {
                 'vocals_path': Path to separated vocals,
                 'pitch_midi_path': Path to pitch-based MIDI (if generated),
-                'basic_pitch_midi_path': Path to Basic Pitch MIDI (if generated)
+                'basic_pitch_midi_path': Path to Basic Pitch MIDI (if generated),
+                'timings': {stage: seconds} for 'separation', 'pitch_midi',
+                    'basic_pitch_midi' and 'stem_writes' (the wait for the stem files);
+                    only the steps that ran are listed
             }
         """
         audio_path = Path(audio_path)
         if not audio_path.exists():
             raise FileNotFoundError(f"Audio file not found: {audio_path}")
 
-        output_dir = output_dir or audio_path.parent
-        output_dir = Path(output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
+        if output_dir is not None:
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+        self._start_warmup([audio_path], output_dir, generate_pitch_midi, generate_basic_pitch_midi, force_separate)
+        try:
+            return self._process_prechecked(audio_path, output_dir, generate_pitch_midi, generate_basic_pitch_midi,
+                                            force_separate)
+        finally:
+            self._await_warmup()
+
+    def _process_prechecked(self,
+                            audio_path: Path,
+                            output_dir: Path | None,
+                            generate_pitch_midi: bool,
+                            generate_basic_pitch_midi: bool,
+                            force_separate: bool = False,
+                            separated: tuple[tuple[np.ndarray, int] | None, list, float] | None = None) -> dict:
+        """
+        process_audio, once audio_path is known to exist and output_dir (if given) to be created.
 
+        separated: (vocals, pending stem writes, seconds) when _separate_batch already
+        separated this file
+        """
+        output_dir = output_dir or audio_path.parent
+        vocals, pending_writes, results = self._separate_step(audio_path, output_dir, generate_pitch_midi,
+                                                               force_separate, separated)
+        return self._generate_midis(results['vocals_path'], output_dir, vocals, pending_writes, results,
+                                    generate_pitch_midi, generate_basic_pitch_midi,
+                                    self._pitch_cache_key(audio_path) if generate_pitch_midi else None)
+
+    def _separate_step(self,
+                       audio_path: Path,
+                       output_dir: Path,
+                       generate_pitch_midi: bool,
+                       force_separate: bool,
+                       separated: tuple[tuple[np.ndarray, int] | None, list, float] | None
+                       ) -> tuple[tuple[np.ndarray, int] | None, list, dict]:
+        """
+        Step 1 of _process_prechecked: get the vocals of audio_path into output_dir,
+        by separating, from a batch, from an earlier run or from the stems cache.
+        Returns (vocals in memory or None, pending stem writes, results so far).
+        """
         base_name = audio_path.stem
-        results = {}
+        self._timings = {}
+        results = {'timings': self._timings}
 
-        print(f"🎵 Processing audio file: {audio_path.name}")
+        self._log(f"🎵 Processing audio file: {audio_path.name}")
 
-        # Step 1: Vocal separation
-        print("🎤 Separating vocals...")
-        start_time = time.time()
-        try:
-            separate_audio(
-                audio_path,
-                model_name=self.model_name,
-                device=self.device,
-                out_dir=output_dir,
-                ext=self.output_ext
-            )
+        if generate_pitch_midi:
+            # warm pyin up (librosa imports, numba cache) in the background while Demucs runs
+            _pitch().start_warmup()
 
-            vocals_path = output_dir / f"{base_name}_vocals.{self.output_ext}"
+        # Step 1: Vocal separation, skipped when an earlier run already wrote the vocals
+        vocals_path = output_dir / f"{base_name}_vocals.{self.output_ext}"
+        if separated is not None:
+            vocals, pending_writes, self._timings['separation'] = separated
+            results['vocals_path'] = vocals_path
+            self._log(f"✅ Vocals separated in a batch, encoding to: {vocals_path} "
+                      f"(batch took {self._timings['separation']:.2f}s)")
+            return vocals, pending_writes, results
+        if self._has_fresh_vocals(audio_path, vocals_path, force_separate):
+            self._log(f"🔁 Reusing vocals from an earlier run: {vocals_path}")
             results['vocals_path'] = vocals_path
-            elapsed = time.time() - start_time
-            print(f"✅ Vocals saved to: {vocals_path} (took {elapsed:.2f}s)")
+            return None, [], results
+        stems_cache = self._stems_cache_dir(audio_path)
+        if not force_separate and self._has_cached_stems(stems_cache):
+            self._log(f"🗄️ Restoring separated stems from the cache: {stems_cache}")
+            with self._timed("separation"):
+                vocals, pending_writes = self._restore_stems(stems_cache, audio_path, output_dir)
+            results['vocals_path'] = vocals_path
+            return vocals, pending_writes, results
+
+        self._log("🎤 Separating vocals...")
+        # keep the separated vocals in memory, so pitch analysis and Basic Pitch don't decode the written file again.
+        # Both analyse mono audio, so the channels are mixed down once here and the array is shared.
+        stems = {}
+        pending_writes = []
+        def submit_write(fn, *args, **kwargs):
+            future = self._io_pool.submit(fn, *args, **kwargs)
+            pending_writes.append(future)
+            return future
+        def keep_vocals(name: str, wav: np.ndarray, samplerate: int):
+            if name == "vocals":
+                stems[name] = (wav.mean(axis=0), samplerate)
+            if stems_cache is not None:
+                submit_write(_store_stem, stems_cache, name, wav, samplerate)
+        streaming = self.streaming and _separation().can_stream(audio_path)
+        if self.streaming and not streaming:
+            self._log(f"ℹ️ {audio_path.suffix} can't be read in chunks without ffmpeg; separating the whole track at once")
+        try:
+            with self._timed("separation"):
+                if streaming:
+                    # the stems are on disk when this returns; the MIDI steps stream the vocals file
+                    _separation().separate_streaming(
+                        self._separation_model(),
+                        audio_path,
+                        device=self.device,
+                        out_dir=output_dir,
+                        ext=self.output_ext,
+                        precision=self.precision,
+                        segment=self.segment,
+                        overlap=self.overlap,
+                        shifts=self.shifts,
+                        jobs=self.jobs,
+                        chunk_seconds=self.chunk_seconds
+                    )
+                else:
+                    _separation().separate_with_model(
+                        self._separation_model(),
+                        audio_path,
+                        model_name=self.model_name,
+                        device=self.device,
+                        out_dir=output_dir,
+                        ext=self.output_ext,
+                        precision=self.precision,
+                        segment=self.segment,
+                        overlap=self.overlap,
+                        shifts=self.shifts,
+                        jobs=self.jobs,
+                        on_stem=keep_vocals,
+                        cache_sources=self.cache_sources,
+                        submit_write=submit_write
+                    )
         except Exception as e:
-            elapsed = time.time() - start_time
-            print(f"❌ Vocal separation failed: {e} (took {elapsed:.2f}s)")
+            self._log(f"❌ Vocal separation failed: {e} (took {self._timings['separation']:.2f}s)")
             raise
+        results['vocals_path'] = vocals_path
+        self._log(f"✅ Vocals separated, encoding to: {vocals_path} (took {self._timings['separation']:.2f}s)")
 
-        # Step 2: Generate MIDI using pitch analysis
-        if generate_pitch_midi:
-            print("🎹 Generating MIDI using pitch analysis...")
-            start_time = time.time()
-            try:
-                pitch_midi_path = self._generate_pitch_midi(vocals_path, output_dir)
-                results['pitch_midi_path'] = pitch_midi_path
-                elapsed = time.time() - start_time
-                print(f"✅ Pitch MIDI saved to: {pitch_midi_path} (took {elapsed:.2f}s)")
-            except Exception as e:
-                elapsed = time.time() - start_time
-                print(f"⚠️ Pitch MIDI generation failed: {e} (took {elapsed:.2f}s)")
-                results['pitch_midi_path'] = None
+        return stems.pop("vocals", None), pending_writes, results
+
+    def _needs_separation(self, audio_path: Path, output_dir: Path, force_separate: bool) -> bool:
+        """Whether neither fresh vocals in output_dir nor cached stems can stand in for separating audio_path."""
+        vocals_path = output_dir / f"{audio_path.stem}_vocals.{self.output_ext}"
+        return (not self._has_fresh_vocals(audio_path, vocals_path, force_separate)
+                and (force_separate or not self._has_cached_stems(self._stems_cache_dir(audio_path))))
+
+    def _has_fresh_vocals(self, audio_path: Path, vocals_path: Path, force_separate: bool) -> bool:
+        """Whether vocals_path, from an earlier run, can stand in for separating audio_path."""
+        return (not force_separate and vocals_path.exists()
+                and vocals_path.stat().st_mtime > audio_path.stat().st_mtime)
+
+    def _stems_cache_dir(self, audio_path: Path) -> Path | None:
+        """
+        The cache directory for audio_path's stems under the current separation
+        settings, or None when caching is off. Keyed by a SHA-256 of the file's
+        content, so renamed, copied or re-touched inputs still hit.
+        """
+        if not self.cache or self.streaming:
+            # restoring reads whole stems into memory, which streaming is there to avoid
+            return None
+        return self.cache_dir / self._separation_key(audio_path)
+
+    def _separation_key(self, audio_path: Path) -> str:
+        """A SHA-256 of audio_path's content and the separation settings, which decide the stems."""
+        stat = audio_path.stat()
+        key = (str(audio_path.resolve()), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            with open(audio_path, "rb") as f:
+                self._digests[key] = hashlib.file_digest(f, "sha256").hexdigest()
+        settings = json.dumps([self.model_name, self.precision, self.segment, self.overlap, self.shifts])
+        return hashlib.sha256(f"{self._digests[key]}:{settings}".encode()).hexdigest()[:32]
+
+    def _pitch_cache_key(self, audio_path: Path) -> str | None:
+        """
+        The key of the pitch analysis cache for audio_path's vocals, or None when
+        caching is off. Derived from the input and the settings that shape the
+        written vocals rather than from the samples analysed, so the in-memory
+        analysis of a fresh separation and a later run reading the vocals file
+        share one cache entry.
+        """
+        if not self.cache:
+            return None
+        vocals = json.dumps([self.output_ext, self.streaming, self.chunk_seconds if self.streaming else None])
+        return f"{self._separation_key(audio_path)}:{vocals}"
 
-        # Step 3: Generate MIDI using Basic Pitch
-        if generate_basic_pitch_midi:
-            print("🤖 Generating MIDI using Basic Pitch...")
-            start_time = time.time()
-            try:
-                basic_pitch_midi_path = self._generate_basic_pitch_midi(vocals_path, output_dir)
-                results['basic_pitch_midi_path'] = basic_pitch_midi_path
-                elapsed = time.time() - start_time
-                print(f"✅ Basic Pitch MIDI saved to: {basic_pitch_midi_path} (took {elapsed:.2f}s)")
-            except Exception as e:
-                elapsed = time.time() - start_time
-                print(f"⚠️ Basic Pitch MIDI generation failed: {e} (took {elapsed:.2f}s)")
+    @staticmethod
+    def _has_cached_stems(stems_cache: Path | None) -> bool:
+        return stems_cache is not None and all((stems_cache / f"{name}.flac").exists() for name in _STEMS)
+
+    def _restore_stems(self, stems_cache: Path, audio_path: Path,
+                       output_dir: Path) -> tuple[tuple[np.ndarray, int], list]:
+        """
+        Write the cached stems to output_dir as a separation would, through the same
+        encoder (vocal_separation.save_stem). Returns the vocals as (mono samples, sr)
+        and the futures of the stem writes.
+        """
+        save_stem = _separation().save_stem
+        vocals = None
+        pending_writes = []
+        for name in _STEMS:
+            wav, samplerate = sf.read(stems_cache / f"{name}.flac", dtype="float32", always_2d=True)
+            out_path = output_dir / f"{audio_path.stem}_{name}.{self.output_ext}"
+            pending_writes.append(self._io_pool.submit(save_stem, np.ascontiguousarray(wav.T), out_path, samplerate))
+            if name == "vocals":
+                vocals = (wav.mean(axis=1), samplerate)
+        return vocals, pending_writes
+
+    def _separate_batch(self,
+                        audio_paths: list[Path],
+                        output_dir: Path | None,
+                        force_separate: bool) -> dict[Path, tuple[tuple[np.ndarray, int] | None, list, float]]:
+        """
+        Separate the files of audio_paths that need it in one Demucs batch, for
+        _process_prechecked(separated=...). The stem files are still being encoded
+        when this returns; their futures go with the last file of the batch.
+        """
+        todo = [p for p in audio_paths if self._needs_separation(p, output_dir or p.parent, force_separate)]
+        if not todo:
+            return {}
+        self._log(f"🎤 Separating vocals of {len(todo)} files in one batch...")
+        vocals = {}
+        pending_writes = []
+        def keep_vocals(audio_path: Path, name: str, wav: np.ndarray, samplerate: int):
+            if name == "vocals":
+                vocals[audio_path] = (wav.mean(axis=0), samplerate)
+            stems_cache = self._stems_cache_dir(audio_path)
+            if stems_cache is not None:
+                submit_write(_store_stem, stems_cache, name, wav, samplerate)
+        def submit_write(fn, *args, **kwargs):
+            future = self._io_pool.submit(fn, *args, **kwargs)
+            pending_writes.append(future)
+            return future
+        start = perf_counter()
+        _separation().separate_many_with_model(
+            self._separation_model(),
+            todo,
+            batch_size=len(todo),
+            device=self.device,
+            out_dir=output_dir,
+            ext=self.output_ext,
+            precision=self.precision,
+            segment=self.segment,
+            overlap=self.overlap,
+            shifts=self.shifts,
+            jobs=self.jobs,
+            on_stem=keep_vocals,
+            submit_write=submit_write
+        )
+        elapsed = perf_counter() - start
+        return {p: (vocals.get(p), pending_writes if p == todo[-1] else [], elapsed) for p in todo}
+
+    def _generate_midis(self,
+                        vocals_path: Path,
+                        output_dir: Path,
+                        vocals: tuple[np.ndarray, int] | None,
+                        pending_writes: list,
+                        results: dict,
+                        generate_pitch_midi: bool,
+                        generate_basic_pitch_midi: bool,
+                        pitch_cache_key: str | None = None) -> dict:
+        """
+        Steps 2 and 3 of _process_prechecked, then wait for the stem files in pending_writes.
+
+        pitch_cache_key: see _pitch_cache_key
+        """
+        # Steps 2 and 3 only read the vocals, so Basic Pitch (ONNX Runtime, native
+        # threads) runs in a worker thread while pitch analysis runs here. Pitch analysis
+        # stays on the calling thread because it draws matplotlib figures.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            basic_pitch_future = None
+            if generate_basic_pitch_midi:
+                self._log("🤖 Generating MIDI using Basic Pitch...")
+                def run_basic_pitch():
+                    with self._timed("basic_pitch_midi"):
+                        return self._generate_basic_pitch_midi(
+                            vocals_path, output_dir, self._basic_pitch_model(shared_cpu=generate_pitch_midi), vocals
+                        )
+                basic_pitch_future = executor.submit(run_basic_pitch)
+
+            # Step 2: Generate MIDI using pitch analysis
+            if generate_pitch_midi:
+                self._log("🎹 Generating MIDI using pitch analysis...")
+                results['pitch_midi_path'] = None
+                try:
+                    with self._timed("pitch_midi"):
+                        results['pitch_midi_path'] = self._generate_pitch_midi(vocals_path, output_dir, vocals,
+                                                                               pitch_cache_key)
+                    self._log(f"✅ Pitch MIDI saved to: {results['pitch_midi_path']} (took {self._timings['pitch_midi']:.2f}s)")
+                except Exception as e:
+                    self._log(f"⚠️ Pitch MIDI generation failed: {e} (took {self._timings['pitch_midi']:.2f}s)")
+
+            # Step 3: Generate MIDI using Basic Pitch
+            if basic_pitch_future is not None:
                 results['basic_pitch_midi_path'] = None
+                try:
+                    results['basic_pitch_midi_path'] = basic_pitch_future.result()
+                    self._log(f"✅ Basic Pitch MIDI saved to: {results['basic_pitch_midi_path']} "
+                              f"(took {self._timings['basic_pitch_midi']:.2f}s)")
+                except Exception as e:
+                    self._log(f"⚠️ Basic Pitch MIDI generation failed: {e} (took {self._timings['basic_pitch_midi']:.2f}s)")
+
+        # The stem files were encoded alongside the MIDI steps; wait until they are on disk
+        self._await_stem_writes(pending_writes)
 
-        print("🎉 Pipeline completed successfully!")
+        self._log("🎉 Pipeline completed successfully!")
         return results
 
-    def _generate_pitch_midi(self, vocals_path: Path, output_dir: Path) -> Path:
-        """Generate MIDI using pitch analysis (librosa)."""
-        import librosa
-        import numpy as np
+    def _await_stem_writes(self, pending_writes: list):
+        if not pending_writes:
+            return
+        try:
+            with self._timed("stem_writes"):
+                for future in pending_writes:
+                    future.result()
+        except Exception as e:
+            self._log(f"❌ Writing separated stems failed: {e}")
+            raise
+        self._log(f"✅ Separated stems written (waited {self._timings['stem_writes']:.2f}s)")
 
-        # Load audio
-        y, sr = librosa.load(str(vocals_path), sr=None)
+    def process_many(self,
+                     audio_paths: list[Path],
+                     output_dir: Path | None = None,
+                     generate_pitch_midi: bool = True,
+                     generate_basic_pitch_midi: bool = True,
+                     force_separate: bool = False) -> list[dict]:
+        """
+        Run process_audio over several files. The Demucs model and the Basic Pitch
+        session are loaded once and reused, so each extra file only costs inference.
+        All inputs are checked before the first one is processed, and the output
+        directory is created once. With batch_size > 1, each group of batch_size
+        files is separated together before their MIDI steps run.
 
-        # Extract pitch information
-        pitches, voiced_flag, voiced_prob, rms = get_audio_pitches(
-            y, sr, hop_length=self.hop_length, audio_path=vocals_path
-        )
+        Returns:
+            One results dictionary per input file, in order
+        """
+        audio_paths = [Path(p) for p in audio_paths]
+        missing = [p for p in audio_paths if not p.exists()]
+        if missing:
+            raise FileNotFoundError(f"Audio file(s) not found: {', '.join(map(str, missing))}")
+
+        if output_dir is not None:
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+        self._start_warmup(audio_paths, output_dir, generate_pitch_midi, generate_basic_pitch_midi, force_separate)
+        try:
+            return self._process_many_prechecked(audio_paths, output_dir, generate_pitch_midi,
+                                                 generate_basic_pitch_midi, force_separate)
+        finally:
+            self._await_warmup()
+
+    def _process_many_prechecked(self,
+                                 audio_paths: list[Path],
+                                 output_dir: Path | None,
+                                 generate_pitch_midi: bool,
+                                 generate_basic_pitch_midi: bool,
+                                 force_separate: bool) -> list[dict]:
+        """process_many, once the inputs are known to exist and output_dir (if given) to be created."""
+        if self.midi_workers > 0:
+            return self._process_many_pooled(audio_paths, output_dir, generate_pitch_midi,
+                                             generate_basic_pitch_midi, force_separate)
+        if self.batch_size <= 1 or self.streaming:
+            return [
+                self._process_prechecked(audio_path, output_dir, generate_pitch_midi, generate_basic_pitch_midi,
+                                         force_separate)
+                for audio_path in audio_paths
+            ]
+
+        all_results = []
+        for i in range(0, len(audio_paths), self.batch_size):
+            group = audio_paths[i:i + self.batch_size]
+            if generate_pitch_midi:
+                # warm pyin up (librosa imports, numba cache) in the background while Demucs runs
+                _pitch().start_warmup()
+            separated = self._separate_batch(group, output_dir, force_separate)
+            all_results += [
+                self._process_prechecked(audio_path, output_dir, generate_pitch_midi, generate_basic_pitch_midi,
+                                         force_separate, separated.get(audio_path))
+                for audio_path in group
+            ]
+        return all_results
+
+    def _process_many_pooled(self,
+                             audio_paths: list[Path],
+                             output_dir: Path | None,
+                             generate_pitch_midi: bool,
+                             generate_basic_pitch_midi: bool,
+                             force_separate: bool) -> list[dict]:
+        """
+        process_many with midi_workers: this process only separates, handing each
+        file's vocals to a worker process as soon as they are ready, so MIDI
+        generation for one file overlaps separation of the next.
+        """
+        settings = dict(device=self.device, output_ext=self.output_ext, hop_length=self.hop_length,
+                        cache=self.cache, fast_viterbi=self.fast_viterbi, decimate_pyin=self.decimate_pyin,
+                        basic_pitch_int8=self.basic_pitch_int8, quiet=self.quiet)
+        step = 1 if self.streaming else max(1, self.batch_size)
+        jobs = []
+        with ProcessPoolExecutor(
+                max_workers=self.midi_workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_midi_worker, initargs=(settings,)) as pool:
+            for i in range(0, len(audio_paths), step):
+                group = audio_paths[i:i + step]
+                separated = self._separate_batch(group, output_dir, force_separate) if step > 1 else {}
+                for audio_path in group:
+                    file_output_dir = output_dir or audio_path.parent
+                    # pitch analysis runs in the workers, so it isn't imported (and warmed up) here
+                    vocals, pending_writes, results = self._separate_step(
+                        audio_path, file_output_dir, False, force_separate, separated.get(audio_path))
+                    pitch_cache_key = self._pitch_cache_key(audio_path) if generate_pitch_midi else None
+                    future = pool.submit(_midi_job, results['vocals_path'], file_output_dir, vocals,
+                                         generate_pitch_midi, generate_basic_pitch_midi, pitch_cache_key)
+                    jobs.append((results, pending_writes, future))
+
+            all_results = []
+            for results, pending_writes, future in jobs:
+                midi_results = future.result()
+                results['timings'].update(midi_results.pop('timings'))
+                results.update(midi_results)
+                self._timings = results['timings']
+                self._await_stem_writes(pending_writes)
+                all_results.append(results)
+        return all_results
+
+    @contextlib.contextmanager
+    def _timed(self, label: str):
+        """Record how long the block took in self._timings[label], also when it raises."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._timings[label] = perf_counter() - start
+
+    def _log(self, message: str):
+        if not self.quiet:
+            print(message)
+
+    def _separation_model(self):
+        """The Demucs model, loaded from disk on first use and kept for later files."""
+        self._await_warmup()
+        if self._demucs_model is None:
+            self._demucs_model = _separation().load_model(self.model_name, self.precision)
+        return self._demucs_model
+
+    def _generate_pitch_midi(self, vocals_path: Path, output_dir: Path,
+                             audio: tuple[np.ndarray, int] | None = None,
+                             cache_key: str | None = None) -> Path:
+        """
+        Generate MIDI using pitch analysis (librosa).
+
+        audio: the vocals already in memory as (mono samples, sr); read from
+        vocals_path when not given.
+        cache_key: keys the pitch analysis cache next to vocals_path (see
+        _pitch_cache_key); None keys it by the vocals' content.
+        """
+        pitch = _pitch()
+        # the kernel choice only applies to pyin calls on this thread, inside the block
+        with pitch.fast_viterbi(self.fast_viterbi):
+            if audio is not None:
+                y, sr = audio
+                pitches, voiced_flag, voiced_prob, rms = pitch.get_audio_pitches(
+                    y, sr, hop_length=self.hop_length, audio_path=vocals_path if self.cache else None,
+                    decimate=self.decimate_pyin, cache_key=cache_key
+                )
+            else:
+                # Extract pitch information, streaming the file block by block
+                pitches, voiced_flag, voiced_prob, rms, sr = pitch.get_file_pitches(
+                    vocals_path, hop_length=self.hop_length, cache=self.cache,
+                    decimate=self.decimate_pyin, cache_key=cache_key
+                )
 
         # Convert to MIDI notes
-        notes = pitch_to_midi_notes(pitches, rms, sr, hop_length=self.hop_length)
+        notes = pitch.pitch_to_midi_notes(pitches, rms, sr, hop_length=self.hop_length, scratch=self._scratch)
 
         # Save MIDI file
         midi_path = output_dir / f"{vocals_path.stem}_pyin.mid"
-        notes_to_midi(notes, midi_path)
+        pitch.notes_to_midi(notes, midi_path)
 
         return midi_path
 
-    def _generate_basic_pitch_midi(self, vocals_path: Path, output_dir: Path) -> Path:
-        """Generate MIDI using Basic Pitch neural network."""
+    def _generate_basic_pitch_midi(self, vocals_path: Path, output_dir: Path,
+                                   model: "Model | Path | None" = None,
+                                   audio: tuple[np.ndarray, int] | None = None) -> Path:
+        """
+        Generate MIDI using Basic Pitch neural network.
+
+        model: a Model or model path; the bundled ICASSP 2022 model when not given.
+        audio: the vocals already in memory as (mono samples, sr); read from
+        vocals_path when not given.
+        """
         midi_path = output_dir / f"{vocals_path.stem}_pitches.mid"
-        transform_to_midi(vocals_path, midi_path)
+        inference = _basic_pitch()
+        inference.transform_to_midi(audio if audio is not None else vocals_path, midi_path,
+                                    model if model is not None else inference.ICASSP_2022_MODEL_PATH)
         return midi_path
 
+    def _basic_pitch_model(self, shared_cpu: bool) -> "Model":
+        """
+        The Basic Pitch session, created once per pipeline on self.device (ONNX
+        Runtime's CUDA provider for "cuda"; CPU with a warning if onnxruntime-gpu
+        isn't installed). When pitch analysis runs at the same time, its CPU
+        threads are limited to half the cores so the two don't oversubscribe the CPU.
+        """
+        self._await_warmup()
+        if shared_cpu not in self._basic_pitch_models:
+            threads = self._basic_pitch_threads or (max(1, (os.cpu_count() or 2) // 2) if shared_cpu else None)
+            inference = _basic_pitch()
+            self._basic_pitch_models[shared_cpu] = inference.Model(
+                inference.ICASSP_2022_MODEL_PATH, intra_op_num_threads=threads,
+                precision="int8" if self.basic_pitch_int8 else None, device=self.device
+            )
+        return self._basic_pitch_models[shared_cpu]
+
+
+_midi_worker_pipeline: AudioPipeline | None = None
+
+
+def _init_midi_worker(settings: dict):
+    """
+    Worker process initializer: one thread each for BLAS, numba and Basic Pitch
+    (the workers themselves are the parallelism), and the AudioPipeline whose MIDI
+    steps _midi_job runs.
+    """
+    global _midi_worker_pipeline
+    _pitch().limit_worker_threads(1)
+    _midi_worker_pipeline = AudioPipeline(**settings)
+    _midi_worker_pipeline._basic_pitch_threads = 1
+
+
+def _midi_job(vocals_path: Path, output_dir: Path, vocals: tuple[np.ndarray, int] | None,
+              generate_pitch_midi: bool, generate_basic_pitch_midi: bool, pitch_cache_key: str | None) -> dict:
+    """Steps 2 and 3 for one file, in a worker process; returns its results and timings."""
+    pipeline = _midi_worker_pipeline
+    pipeline._timings = {}
+    return pipeline._generate_midis(vocals_path, output_dir, vocals, [], {'timings': pipeline._timings},
+                                    generate_pitch_midi, generate_basic_pitch_midi, pitch_cache_key)
+
 
 def process_audio_file(audio_path: str,
                       output_dir: Path | None = None,
@@ -201,32 +838,74 @@ def main():
     parser = argparse.ArgumentParser(
         description="Audio processing pipeline: vocal separation + MIDI generation"
     )
-    parser.add_argument("audio_path", help="Path to input audio file")
+    parser.add_argument("audio_paths", nargs="+", metavar="audio_path",
+                       help="Path(s) to input audio files")
     parser.add_argument("-o", "--output", help="Output directory")
     parser.add_argument("-m", "--model", default="mdx_extra",
                        help="Demucs model name (default: mdx_extra)")
     parser.add_argument("-d", "--device", help="Device (cpu/cuda/mps)")
+    parser.add_argument("--precision", default="fp32",
+                       help="Demucs inference precision: fp32, fp16, bf16 or int8 (default: fp32)")
+    parser.add_argument("--segment", type=float,
+                       help="Demucs window length in seconds (default: the model's own)")
+    parser.add_argument("--overlap", type=float, default=0.25,
+                       help="Fraction by which Demucs windows overlap (default: 0.25)")
+    parser.add_argument("--shifts", type=int, default=0,
+                       help="Random shifts Demucs averages over; each is a full extra pass (default: 0)")
+    parser.add_argument("--jobs", type=int, default=0,
+                       help="Threads running Demucs windows in parallel, CPU only (default: 0)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                       help="Files separated per Demucs call when several are given (default: 1)")
+    parser.add_argument("--midi-workers", type=int, default=0,
+                       help="Processes generating MIDI while the next files are separated (default: 0)")
+    parser.add_argument("--streaming", action="store_true",
+                       help="Separate in chunks, so memory use doesn't grow with the track length")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0,
+                       help="Chunk length for --streaming (default: 30)")
     parser.add_argument("--no-pitch", action="store_true",
                        help="Skip pitch-based MIDI generation")
     parser.add_argument("--no-basic-pitch", action="store_true",
                        help="Skip Basic Pitch MIDI generation")
+    parser.add_argument("--decimate-pyin", action="store_true",
+                       help="Run pitch analysis on downsampled vocals (faster, slightly different notes)")
+    parser.add_argument("--basic-pitch-int8", action="store_true",
+                       help="Use the int8 Basic Pitch model from analysis/basic_pitch/quantize.py")
+    parser.add_argument("--force", action="store_true",
+                       help="Separate again even if the vocals from an earlier run are up to date")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Separate and analyse again instead of reusing cached results")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR),
+                       help=f"Where separated stems are cached (default: {DEFAULT_CACHE_DIR})")
 
     args = parser.parse_args()
-
-    pipeline = AudioPipeline(model_name=args.model, device=args.device)
+    # checked here rather than with choices=, which would import torch before --help
+    if args.precision not in _separation().PRECISIONS:
+        parser.error(f"argument --precision: invalid choice: {args.precision!r} "
+                     f"(choose from {', '.join(_separation().PRECISIONS)})")
+
+    pipeline = AudioPipeline(model_name=args.model, device=args.device,
+                             precision=args.precision, segment=args.segment,
+                             overlap=args.overlap, shifts=args.shifts, jobs=args.jobs,
+                             streaming=args.streaming, chunk_seconds=args.chunk_seconds,
+                             batch_size=args.batch_size, midi_workers=args.midi_workers,
+                             cache=not args.no_cache, cache_dir=args.cache_dir,
+                             decimate_pyin=args.decimate_pyin,
+                             basic_pitch_int8=args.basic_pitch_int8, warmup=True)
 
     try:
-        results = pipeline.process_audio(
-            Path(args.audio_path),
+        all_results = pipeline.process_many(
+            [Path(p) for p in args.audio_paths],
             Path(args.output) if args.output else None,
             generate_pitch_midi=not args.no_pitch,
-            generate_basic_pitch_midi=not args.no_basic_pitch
+            generate_basic_pitch_midi=not args.no_basic_pitch,
+            force_separate=args.force
         )
 
         print("\n📁 Generated files:")
-        for key, path in results.items():
-            if path:
-                print(f"  {key}: {path}")
+        for results in all_results:
+            for key, path in results.items():
+                if path and key != "timings":
+                    print(f"  {key}: {path}")
 
     except Exception as e:
         print(f"❌ Pipeline failed: {e}")
@@ -234,4 +913,5 @@ def main():
 
 
 if __name__ == "__main__":
+    use_project_numba_cache()
     main()
@@ -6,7 +6,7 @@ This script demonstrates how to use the audio pipeline to process audio files.
 """
 
 from pathlib import Path
-from audio_pipeline import AudioPipeline, process_audio_file
+from audio_pipeline import AudioPipeline, process_audio_file, use_project_numba_cache
 
 
 def example_basic_usage():
@@ -29,7 +29,8 @@ def example_basic_usage():
         print("✅ Processing completed!")
         print("📁 Generated files:")
         for key, path in results.items():
-            print(f"  {key}: {path}")
+            if key != "timings":
+                print(f"  {key}: {path}")
             
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -53,7 +54,7 @@ def example_advanced_usage():
     # Create pipeline with custom settings
     pipeline = AudioPipeline(
         model_name="mdx_extra",  # Demucs model
-        device="cpu",            # Force CPU (for compatibility)
+        device=None,             # Auto-detect: cuda, then mps, then cpu
         output_ext="wav"         # Use WAV for separated audio
     )
     
@@ -68,9 +69,10 @@ def example_advanced_usage():
         print("✅ Advanced processing completed!")
         print("📁 Generated files:")
         for key, path in results.items():
-            if path:
+            if path and key != "timings":
                 print(f"  {key}: {path}")
                 print(f"    Size: {path.stat().st_size} bytes")
+        print("⏱️ Stage timings:", {k: f"{v:.2f}s" for k, v in results["timings"].items()})
         
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -82,6 +84,7 @@ def example_midi_only():
     print("-" * 30)
     
     # Check if vocals already exist
+    audio_path = Path("res/我的一个道姑朋友.m4a")
     vocals_path = Path("res/我的一个道姑朋友_vocals.mp3")
     
     if vocals_path.exists():
@@ -90,16 +93,11 @@ def example_midi_only():
         pipeline = AudioPipeline()
         
         try:
-            # Generate only MIDI files from existing vocals
-            output_dir = vocals_path.parent
-            
-            print("🎹 Generating pitch-based MIDI...")
-            pitch_midi = pipeline._generate_pitch_midi(vocals_path, output_dir)
-            print(f"✅ Saved: {pitch_midi}")
-            
-            print("🤖 Generating Basic Pitch MIDI...")
-            basic_midi = pipeline._generate_basic_pitch_midi(vocals_path, output_dir)
-            print(f"✅ Saved: {basic_midi}")
+            # Vocals newer than the input are reused, so only the MIDI steps run
+            # (pass force_separate=True to run Demucs again)
+            results = pipeline.process_audio(audio_path)
+            print(f"✅ Saved: {results.get('pitch_midi_path')}")
+            print(f"✅ Saved: {results.get('basic_pitch_midi_path')}")
             
         except Exception as e:
             print(f"❌ Error: {e}")
@@ -135,4 +133,5 @@ def main():
 
 
 if __name__ == "__main__":
+    use_project_numba_cache()
     main()
\ No newline at end of file
@@ -1,23 +1,57 @@
+# Extensions picked up when a directory is given instead of files
+AUDIO_EXTENSIONS = {".m4a", ".mp3", ".wav", ".flac", ".ogg", ".opus", ".aac"}
+
+
+def collect_audio_paths(paths):
+    """
+    Expand directories among paths into the audio files directly inside them,
+    sorted by name. Listed with os.scandir, whose entries carry the file type,
+    so large folders need no stat call per file. Stems written by earlier runs
+    (*_vocals.*, *_non_vocals.*) are skipped. Other paths are kept as given.
+    """
+    import os
+    from pathlib import Path
+
+    audio_paths = []
+    for p in paths:
+        if not os.path.isdir(p):
+            audio_paths.append(Path(p))
+            continue
+        with os.scandir(p) as entries:
+            found = [
+                Path(entry.path) for entry in entries
+                if entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS
+                and not os.path.splitext(entry.name)[0].endswith(("_vocals", "_non_vocals"))
+            ]
+        audio_paths.extend(sorted(found))
+    return audio_paths
+
+
 def main():
     """
     Main entry point for the Klok audio processing application.
     Processes audio files with vocal separation and MIDI generation.
     """
     import argparse
+    import os
     from pathlib import Path
-    from audio_pipeline import AudioPipeline
     
     parser = argparse.ArgumentParser(
         description="Klok Audio Processing Pipeline: vocal separation + MIDI generation"
     )
-    parser.add_argument("audio_path", nargs="?", 
-                       help="Path to input audio file (.m4a, .mp3, .wav, etc.)")
+    parser.add_argument("audio_paths", nargs="*", metavar="audio_path",
+                       help="Path(s) to input audio files (.m4a, .mp3, .wav, etc.) or directories of them")
     parser.add_argument("-o", "--output", 
                        help="Output directory for generated files")
     parser.add_argument("-m", "--model", default="mdx_extra", 
                        help="Demucs model name (default: mdx_extra)")
     parser.add_argument("-d", "--device", 
                        help="Device (cpu/cuda/mps, auto-detected if not specified)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                       help="Files separated per Demucs call when several are given (default: 1)")
+    parser.add_argument("--midi-workers", type=int, default=0,
+                       help="Processes generating MIDI while the next files are separated (default: 0)")
     parser.add_argument("--no-pitch", action="store_true", 
                        help="Skip pitch-based MIDI generation")
     parser.add_argument("--no-basic-pitch", action="store_true", 
@@ -28,11 +62,16 @@ def main():
     print("🎵 Welcome to Klok Audio Processing Pipeline!")
     print("=" * 50)
     
-    # Determine input audio file
-    if args.audio_path:
-        audio_path = Path(args.audio_path)
-        if not audio_path.exists():
-            print(f"❌ Audio file not found: {audio_path}")
+    # Determine input audio files
+    if args.audio_paths:
+        audio_paths = collect_audio_paths(args.audio_paths)
+        missing = [p for p in audio_paths if not os.path.isfile(p)]
+        if missing:
+            for audio_path in missing:
+                print(f"❌ Audio file not found: {audio_path}")
+            return 1
+        if not audio_paths:
+            print("📂 No audio files found in the given directories")
             return 1
     else:
         # Default to sample audio in res/ folder
@@ -42,19 +81,28 @@ def main():
             print("💡 Usage examples:")
             print("   python main.py audio_file.m4a")
             print("   python main.py audio_file.mp3 -o output_directory")
+            print("   python main.py *.mp3 --batch-size 4  # several files, separated 4 at a time")
+            print("   python main.py songs/  # every audio file in a directory")
             print("   python main.py  # (uses sample audio in res/ directory)")
             return 1
         print(f"📁 Using sample audio: {audio_path}")
+        audio_paths = [audio_path]
     
-    print(f"🎵 Processing: {audio_path}")
-    
-    # Create pipeline with specified options
-    pipeline = AudioPipeline(model_name=args.model, device=args.device)
+    for audio_path in audio_paths:
+        print(f"🎵 Processing: {audio_path}")
     
     try:
+        # Imported only now: the pipeline pulls in torch/demucs/onnxruntime, which
+        # --help and a missing input file shouldn't have to wait for
+        from audio_pipeline import AudioPipeline
+
+        # Create pipeline with specified options
+        pipeline = AudioPipeline(model_name=args.model, device=args.device, batch_size=args.batch_size,
+                                 midi_workers=args.midi_workers, warmup=True)
+
         print("\n🚀 Starting audio processing pipeline...")
-        results = pipeline.process_audio(
-            audio_path,
+        all_results = pipeline.process_many(
+            audio_paths,
             Path(args.output) if args.output else None,
             generate_pitch_midi=not args.no_pitch,
             generate_basic_pitch_midi=not args.no_basic_pitch
@@ -62,9 +110,10 @@ def main():
         
         print("\n✅ Processing completed successfully!")
         print("\n📁 Generated files:")
-        for key, path in results.items():
-            if path and path.exists():
-                print(f"  📄 {key}: {path}")
+        for results in all_results:
+            for key, path in results.items():
+                if key != "timings" and path and path.exists():
+                    print(f"  📄 {key}: {path}")
                 
     except ImportError as e:
         print(f"⚠️  Missing dependencies: {e}")
@@ -75,7 +124,7 @@ def main():
     except Exception as e:
         print(f"❌ Pipeline failed: {e}")
         print("\n💡 You can also run the pipeline manually:")
-        print(f"   python audio_pipeline.py \"{audio_path}\"")
+        print(f"   python audio_pipeline.py {' '.join(f'"{p}"' for p in audio_paths)}")
         return 1
     
     print("\n" + "=" * 50)
@@ -90,5 +139,10 @@ def main():
 
 
 if __name__ == "__main__":
+    import os
     import sys
+    from pathlib import Path
+    # numba's compile cache in the project (see audio_pipeline.use_project_numba_cache);
+    # set before the pipeline imports numba
+    os.environ.setdefault("NUMBA_CACHE_DIR", str(Path(__file__).parent / ".numba_cache"))
     sys.exit(main())